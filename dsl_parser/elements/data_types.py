@@ -38,20 +38,20 @@ class SchemaPropertyType(Element):
 
     schema = Leaf(type=str)
 
-    # requires will be modified later.
+    # requires is replaced once DataType is defined (see below)
     requires = {}
 
-    provides = ['component_types']
+    provides = ['data_types_registry']
 
-    def validate(self, data_type, **kwargs):
+    def validate(self, data_types_registry, **kwargs):
         if self.initial_value and self.initial_value not in \
-                constants.USER_PRIMITIVE_TYPES and not data_type:
+                constants.USER_PRIMITIVE_TYPES and not data_types_registry:
             raise exceptions.DSLParsingLogicException(
                 exceptions.ERROR_UNKNOWN_TYPE,
                 "Illegal type name '{0}'".format(self.initial_value))
 
-    def calculate_provided(self, component_types, **kwargs):
-        return {'component_types': component_types}
+    def calculate_provided(self, data_types_registry, **kwargs):
+        return {'data_types_registry': data_types_registry}
 
 
 class SchemaPropertyDefault(Element):
@@ -59,12 +59,12 @@ class SchemaPropertyDefault(Element):
     schema = Leaf(type=elements.PRIMITIVE_TYPES)
 
     requires = {
-        SchemaPropertyType: [Requirement('component_types',
+        SchemaPropertyType: [Requirement('data_types_registry',
                                          required=False,
                                          predicate=sibling_predicate)]
     }
 
-    def parse(self, component_types):
+    def parse(self, data_types_registry):
         type_name = self.sibling(SchemaPropertyType).value
         initial_value = self.initial_value
         if initial_value is None:
@@ -73,7 +73,7 @@ class SchemaPropertyDefault(Element):
                 initial_value = {}
             else:
                 return None
-        component_types = component_types or {}
+        data_types = data_types_registry or {}
         prop_name = self.ancestor(SchemaProperty).name
         undefined_property_error = 'Undefined property {1} in default' \
                                    ' value of type {0}'
@@ -81,7 +81,7 @@ class SchemaPropertyDefault(Element):
         return utils.parse_value(
             value=initial_value,
             type_name=type_name,
-            data_types=component_types,
+            data_types=data_types,
             undefined_property_error_message=undefined_property_error,
             missing_property_error_message='illegal state',
             node_name=current_type,
@@ -152,25 +152,17 @@ class DataType(types.Type):
         'version': DataTypeVersion
     }
 
+    # component types are parsed before the data type, as its properties
+    # require them (see SchemaPropertyType)
     requires = {
         'self': [
-            Requirement('component_types',
-                        multiple_results=True,
-                        required=False,
-                        predicate=lambda source, target:
-                            target.name in source.direct_component_types),
             Value('super_type',
                   predicate=types.derived_from_predicate,
                   required=False)
         ]
     }
 
-    provides = ['component_types']
-
-    def __init__(self, *args, **kwargs):
-        super(DataType, self).__init__(*args, **kwargs)
-        self._direct_component_types = None
-        self.component_types = {}
+    provides = ['data_types_registry']
 
     def validate(self, **kwargs):
         if self.name in constants.USER_PRIMITIVE_TYPES:
@@ -179,11 +171,8 @@ class DataType(types.Type):
                 'Can\'t redefine primitive type {0}'.format(self.name)
             )
 
-    def parse(self, super_type, component_types):
-        merged_component_types = {}
-        for component in component_types:
-            merged_component_types.update(component)
-        self.component_types.update(merged_component_types)
+    def parse(self, super_type):
+        data_types_registry = self.parent().data_types_registry
         result = self.build_dict_result()
         if constants.PROPERTIES not in result:
             result[constants.PROPERTIES] = {}
@@ -191,25 +180,13 @@ class DataType(types.Type):
             result[constants.PROPERTIES] = utils.merge_schemas(
                 overridden_schema=super_type.get('properties', {}),
                 overriding_schema=result.get('properties', {}),
-                data_types=merged_component_types)
+                data_types=data_types_registry)
         self.fix_properties(result)
-        self.component_types[self.name] = result
+        data_types_registry.register(self.name, result)
         return result
 
     def calculate_provided(self, **kwargs):
-        return {'component_types': self.component_types}
-
-    @property
-    def direct_component_types(self):
-        if self._direct_component_types is None:
-            direct_component_types = set()
-            parent_type = self.initial_value.get(constants.DERIVED_FROM)
-            if parent_type:
-                direct_component_types.add(parent_type)
-            for desc in self.descendants(SchemaPropertyType):
-                direct_component_types.add(desc.initial_value)
-            self._direct_component_types = direct_component_types
-        return self._direct_component_types
+        return {'data_types_registry': self.parent().data_types_registry}
 
 
 class DataTypes(types.Types):
@@ -221,10 +198,51 @@ class DataTypes(types.Types):
         'inputs': ['validate_version']
     }
 
+    provides = ['data_types_registry', 'properties_schemas']
+
+    def __init__(self, *args, **kwargs):
+        super(DataTypes, self).__init__(*args, **kwargs)
+        self.data_types_registry = DataTypesRegistry()
+
     def validate(self, version, validate_version):
         if validate_version:
             self.validate_version(version, (1, 2))
 
+    def calculate_provided(self, **kwargs):
+        return {
+            'data_types_registry': self.data_types_registry,
+            'properties_schemas': utils.PropertiesSchemas(
+                self.data_types_registry)
+        }
+
+
+class DataTypesRegistry(object):
+    """
+    The data types of a parse, by name. Each data type is registered once
+    it is parsed, and data types are parsed after the data types they are
+    composed of, so these are always registered when looked up.
+
+    A single registry is shared by all the elements requiring it.
+    """
+
+    def __init__(self):
+        self._data_types = {}
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def register(self, name, data_type):
+        self._data_types[name] = data_type
+
+    def __contains__(self, name):
+        return name in self._data_types
+
+    def __getitem__(self, name):
+        return self._data_types[name]
+
+    def __len__(self):
+        return len(self._data_types)
+
 
 # source: element describing data_type name
 # target: data_type
@@ -232,7 +250,10 @@ def _has_type(source, target):
     return source.initial_value == target.name
 
 
-SchemaPropertyType.requires[DataType] = [
-    Value('data_type', predicate=_has_type, required=False),
-    Requirement('component_types', predicate=_has_type, required=False)
-]
+# replaced as a whole rather than modified, so the requirements of a class
+# never change once they are visible
+SchemaPropertyType.requires = {
+    DataType: [Requirement('data_types_registry',
+                           predicate=_has_type,
+                           required=False)]
+}
@@ -15,6 +15,7 @@
 
 import os
 import urllib
+import weakref
 
 import networkx as nx
 
@@ -25,6 +26,7 @@ from dsl_parser import (exceptions,
 from dsl_parser.framework.elements import (Element,
                                            Leaf,
                                            List)
+from dsl_parser.framework.requirements import Requirement
 
 
 MERGE_NO_OVERRIDE = set([
@@ -76,7 +78,8 @@ class ImportsLoader(Element):
                    'blueprint_location',
                    'version',
                    'resolver',
-                   'validate_version']
+                   'validate_version',
+                   Requirement('imports_cache', required=False)]
     }
 
     resource_base = None
@@ -96,7 +99,8 @@ class ImportsLoader(Element):
               blueprint_location,
               version,
               resolver,
-              validate_version):
+              validate_version,
+              imports_cache):
         if blueprint_location:
             blueprint_location = _dsl_location_to_url(
                 dsl_location=blueprint_location,
@@ -108,7 +112,8 @@ class ImportsLoader(Element):
                                 resources_base_url=resources_base_url,
                                 version=version,
                                 resolver=resolver,
-                                validate_version=validate_version)
+                                validate_version=validate_version,
+                                imports_cache=imports_cache)
 
     def calculate_provided(self, **kwargs):
         return {
@@ -133,7 +138,8 @@ def _dsl_location_to_url(dsl_location, resources_base_url):
 
 def _get_resource_location(resource_name,
                            resources_base_url,
-                           current_resource_context=None):
+                           current_resource_context=None,
+                           resource_exists=utils.url_exists):
     url_parts = resource_name.split(':')
     if url_parts[0] in ['http', 'https', 'file', 'ftp']:
         return resource_name
@@ -145,7 +151,7 @@ def _get_resource_location(resource_name,
     if current_resource_context:
         candidate_url = current_resource_context[
             :current_resource_context.rfind('/') + 1] + resource_name
-        if utils.url_exists(candidate_url):
+        if resource_exists(candidate_url):
             return candidate_url
 
     if resources_base_url:
@@ -156,11 +162,12 @@ def _get_resource_location(resource_name,
 
 def _combine_imports(parsed_dsl_holder, dsl_location,
                      resources_base_url, version, resolver,
-                     validate_version):
+                     validate_version, imports_cache=None):
     ordered_imports = _build_ordered_imports(parsed_dsl_holder,
                                              dsl_location,
                                              resources_base_url,
-                                             resolver)
+                                             resolver,
+                                             imports_cache)
     holder_result = parsed_dsl_holder.copy()
     version_key_holder, version_value_holder = parsed_dsl_holder.get_item(
         _version.VERSION)
@@ -180,11 +187,15 @@ def _combine_imports(parsed_dsl_holder, dsl_location,
 def _build_ordered_imports(parsed_dsl_holder,
                            dsl_location,
                            resources_base_url,
-                           resolver):
+                           resolver,
+                           imports_cache=None):
 
     def location(value):
         return value or 'root'
 
+    if imports_cache is None:
+        imports_cache = ImportsCache()
+
     imports_graph = ImportsGraph()
     imports_graph.add(location(dsl_location), parsed_dsl_holder)
 
@@ -196,9 +207,10 @@ def _build_ordered_imports(parsed_dsl_holder,
             return
 
         for another_import in imports_value_holder.restore():
-            import_url = _get_resource_location(another_import,
-                                                resources_base_url,
-                                                _current_import)
+            import_url = imports_cache.get_location(another_import,
+                                                    resources_base_url,
+                                                    _current_import,
+                                                    resolver)
             if import_url is None:
                 ex = exceptions.DSLParsingLogicException(
                     13, "Import failed: no suitable location found for "
@@ -209,7 +221,8 @@ def _build_ordered_imports(parsed_dsl_holder,
                 imports_graph.add_graph_dependency(import_url,
                                                    location(_current_import))
             else:
-                raw_imported_dsl = resolver.fetch_import(import_url)
+                raw_imported_dsl = imports_cache.fetch_import(import_url,
+                                                              resolver)
                 imported_dsl_holder = utils.load_yaml(
                     raw_yaml=raw_imported_dsl,
                     error_message="Failed to parse import '{0}' (via '{1}')"
@@ -306,3 +319,72 @@ class ImportsGraph(object):
 
     def __contains__(self, item):
         return item in self._imports_tree
+
+
+class ImportsCache(object):
+    """
+    Caches the locations imports are resolved to, by the location importing
+    them, along with the imports fetched while resolving them.
+
+    Relative imports are probed by fetching them (using the resolver)
+    relative to the importing location, and the fetched import is then
+    reused instead of being fetched again. Probing makes a single attempt
+    (see AbstractImportResolver.probe_import), and an import is considered
+    missing if the resolver fails to fetch it (raising a
+    DSLParsingLogicException or an IOError). Imports which are not found
+    are cached as well.
+
+    Everything is cached per resolver (instance), since different resolvers
+    may fetch the same url from different places. To share fetched imports
+    between parses, pass them the same resolver as well.
+
+    A cache is created for each parse, unless one is passed to it (see
+    parser.parse), in which case it is shared by the parses it is passed to.
+    """
+
+    def __init__(self):
+        self._resolver_caches = weakref.WeakKeyDictionary()
+
+    def _resolver_cache(self, resolver):
+        if resolver not in self._resolver_caches:
+            self._resolver_caches[resolver] = {
+                'locations': {},
+                'imports': {},
+                'missing': set()
+            }
+        return self._resolver_caches[resolver]
+
+    def get_location(self,
+                     resource_name,
+                     resources_base_url,
+                     current_resource_context,
+                     resolver):
+        locations = self._resolver_cache(resolver)['locations']
+        key = (resource_name, resources_base_url, current_resource_context)
+        if key not in locations:
+            locations[key] = _get_resource_location(
+                resource_name,
+                resources_base_url,
+                current_resource_context,
+                resource_exists=lambda url: self._probe(url, resolver))
+        return locations[key]
+
+    def fetch_import(self, import_url, resolver):
+        imports = self._resolver_cache(resolver)['imports']
+        if import_url not in imports:
+            imports[import_url] = resolver.fetch_import(import_url)
+        return imports[import_url]
+
+    def _probe(self, import_url, resolver):
+        cache = self._resolver_cache(resolver)
+        if import_url in cache['imports']:
+            return True
+        if import_url in cache['missing']:
+            return False
+        try:
+            cache['imports'][import_url] = resolver.probe_import(import_url)
+            return True
+        except (exceptions.DSLParsingLogicException, IOError):
+            # url, http and requests errors are all IOErrors
+            cache['missing'].add(import_url)
+            return False
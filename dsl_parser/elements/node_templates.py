@@ -16,7 +16,6 @@
 import copy
 
 from dsl_parser import (exceptions,
-                        utils,
                         constants)
 from dsl_parser.interfaces import interfaces_parser
 from dsl_parser.elements import (node_types as _node_types,
@@ -57,17 +56,18 @@ class NodeTemplateProperties(Element):
     requires = {
         NodeTemplateType: [],
         _node_types.NodeTypes: [Value('node_types')],
-        _data_types.DataTypes: [Value('data_types')]
+        _data_types.DataTypes: ['properties_schemas']
     }
 
-    def parse(self, node_types, data_types):
+    def parse(self, node_types, properties_schemas):
         properties = self.initial_value or {}
         node_type_name = self.sibling(NodeTemplateType).value
         node_type = node_types[node_type_name]
-        return utils.merge_schema_and_instance_properties(
+        schema = properties_schemas.compile(
+            node_type['properties'],
+            key=(constants.NODE_TYPES, node_type_name))
+        return schema.merge(
             instance_properties=properties,
-            schema_properties=node_type['properties'],
-            data_types=data_types,
             undefined_property_error_message=(
                 "'{0}' node '{1}' property is not part of the derived"
                 " type properties schema"),
@@ -125,18 +125,18 @@ class NodeTemplateRelationshipProperties(Element):
     requires = {
         NodeTemplateRelationshipType: [],
         _relationships.Relationships: [Value('relationships')],
-        _data_types.DataTypes: [Value('data_types')]
+        _data_types.DataTypes: ['properties_schemas']
     }
 
-    def parse(self, relationships, data_types):
+    def parse(self, relationships, properties_schemas):
         relationship_type_name = self.sibling(
             NodeTemplateRelationshipType).value
         properties = self.initial_value or {}
-        return utils.merge_schema_and_instance_properties(
+        schema = properties_schemas.compile(
+            relationships[relationship_type_name]['properties'],
+            key=(constants.RELATIONSHIPS, relationship_type_name))
+        return schema.merge(
             instance_properties=properties,
-            schema_properties=relationships[relationship_type_name][
-                'properties'],
-            data_types=data_types,
             undefined_property_error_message=(
                 "'{0}' node relationship '{1}' property is not part of "
                 "the derived relationship type properties schema"),
@@ -340,11 +340,12 @@ class NodeTemplate(Element):
         'properties': NodeTemplateProperties,
     }
     requires = {
-        'inputs': [Requirement('resource_base', required=False)],
+        'inputs': [Requirement('resource_base', required=False),
+                   Requirement('resources', required=False)],
         'self': [Value('related_node_templates',
                        predicate=_node_template_related_nodes_predicate,
                        multiple_results=True)],
-        _plugins.Plugins: [Value('plugins')],
+        _plugins.Plugins: [Value('plugins'), 'plugins_index'],
         _node_types.NodeType: [
             Value('node_type',
                   predicate=_node_template_node_type_predicate)],
@@ -355,7 +356,9 @@ class NodeTemplate(Element):
               node_type,
               host_types,
               plugins,
+              plugins_index,
               resource_base,
+              resources,
               related_node_templates):
         node = self.build_dict_result()
         node.update({
@@ -374,15 +377,19 @@ class NodeTemplate(Element):
                                   .format(node['id'], node['type']),
             interfaces=node[constants.INTERFACES],
             plugins=plugins,
+            plugins_index=plugins_index,
             error_code=10,
-            resource_base=resource_base)
+            resource_base=resource_base,
+            resources=resources)
 
         node_name_to_node = dict((node['id'], node)
                                  for node in related_node_templates)
         _post_process_node_relationships(processed_node=node,
                                          node_name_to_node=node_name_to_node,
                                          plugins=plugins,
-                                         resource_base=resource_base)
+                                         plugins_index=plugins_index,
+                                         resource_base=resource_base,
+                                         resources=resources)
 
         contained_in = self.child(NodeTemplateRelationships).provided[
             'contained_in']
@@ -400,7 +407,9 @@ class NodeTemplate(Element):
 def _post_process_node_relationships(processed_node,
                                      node_name_to_node,
                                      plugins,
-                                     resource_base):
+                                     plugins_index,
+                                     resource_base,
+                                     resources):
     for relationship in processed_node[constants.RELATIONSHIPS]:
         target_node = node_name_to_node[relationship['target_id']]
         _process_node_relationships_operations(
@@ -409,21 +418,27 @@ def _post_process_node_relationships(processed_node,
             operations_attribute='source_operations',
             node_for_plugins=processed_node,
             plugins=plugins,
-            resource_base=resource_base)
+            plugins_index=plugins_index,
+            resource_base=resource_base,
+            resources=resources)
         _process_node_relationships_operations(
             relationship=relationship,
             interfaces_attribute='target_interfaces',
             operations_attribute='target_operations',
             node_for_plugins=target_node,
             plugins=plugins,
-            resource_base=resource_base)
+            plugins_index=plugins_index,
+            resource_base=resource_base,
+            resources=resources)
 
 
 def _process_operations(partial_error_message,
                         interfaces,
                         plugins,
+                        plugins_index,
                         error_code,
-                        resource_base):
+                        resource_base,
+                        resources):
     operations = {}
     for interface_name, interface in interfaces.items():
         interface_operations = \
@@ -434,7 +449,9 @@ def _process_operations(partial_error_message,
                 partial_error_message=(
                     "In interface '{0}' {1}".format(interface_name,
                                                     partial_error_message)),
-                resource_bases=resource_base)
+                resource_bases=resource_base,
+                plugins_index=plugins_index,
+                resources=resources)
         for operation in interface_operations:
             operation_name = operation.pop('name')
             if operation_name in operations:
@@ -456,7 +473,9 @@ def _process_node_relationships_operations(relationship,
                                            operations_attribute,
                                            node_for_plugins,
                                            plugins,
-                                           resource_base):
+                                           plugins_index,
+                                           resource_base,
+                                           resources):
     partial_error_message = "in relationship of type '{0}' in node '{1}'" \
         .format(relationship['type'],
                 node_for_plugins['id'])
@@ -465,8 +484,10 @@ def _process_node_relationships_operations(relationship,
         partial_error_message=partial_error_message,
         interfaces=relationship[interfaces_attribute],
         plugins=plugins,
+        plugins_index=plugins_index,
         error_code=19,
-        resource_base=resource_base)
+        resource_base=resource_base,
+        resources=resources)
 
     relationship[operations_attribute] = operations
 
@@ -476,6 +497,7 @@ class NodeTemplates(Element):
     required = True
     schema = Dict(type=NodeTemplate)
     requires = {
+        'inputs': [Requirement('shared_operations', required=False)],
         _plugins.Plugins: [Value('plugins')],
         _node_types.NodeTypes: ['host_types']
     }
@@ -484,13 +506,18 @@ class NodeTemplates(Element):
         'deployment_plugins_to_install'
     ]
 
-    def parse(self, host_types, plugins):
+    def parse(self, host_types, plugins, shared_operations):
         processed_nodes = dict((node.name, node.value)
                                for node in self.children())
         _process_nodes_plugins(
             processed_nodes=processed_nodes,
             host_types=host_types,
             plugins=plugins)
+        if shared_operations is not None:
+            # node values are copied separately, so operations can only be
+            # shared between nodes once all of them are collected here
+            for node in processed_nodes.itervalues():
+                _share_node_operations(node, shared_operations)
         return processed_nodes.values()
 
     def calculate_provided(self, **kwargs):
@@ -509,6 +536,24 @@ class NodeTemplates(Element):
         return deployment_plugins.values()
 
 
+def _share_node_operations(node, shared_operations):
+    _share_operations(node['operations'], shared_operations)
+    for interface in node[constants.INTERFACES].itervalues():
+        _share_operations(interface, shared_operations)
+    for relationship in node[constants.RELATIONSHIPS]:
+        for operations in ['source_operations', 'target_operations']:
+            _share_operations(relationship[operations], shared_operations)
+        for interfaces in [constants.SOURCE_INTERFACES,
+                           constants.TARGET_INTERFACES]:
+            for interface in relationship[interfaces].itervalues():
+                _share_operations(interface, shared_operations)
+
+
+def _share_operations(operations, shared_operations):
+    for operation_name, operation in operations.items():
+        operations[operation_name] = shared_operations.share(operation)
+
+
 def _process_nodes_plugins(processed_nodes,
                            host_types,
                            plugins):
@@ -521,24 +566,32 @@ def _process_nodes_plugins(processed_nodes,
         for rel in node['relationships']:
             node_operations.append(rel['source_operations'])
             nodes_operations[rel['target_id']].append(rel['target_operations'])
+    # node plugins by (plugin name, executor), shared between nodes using
+    # the same plugin with the same executor
+    node_plugins = {}
     for node_name, node in processed_nodes.iteritems():
         node[constants.PLUGINS] = _get_plugins_from_operations(
             operations_lists=nodes_operations[node_name],
-            processed_plugins=plugins)
+            processed_plugins=plugins,
+            node_plugins=node_plugins)
+
+    contained_nodes = {}
+    for node in processed_nodes.itervalues():
+        if 'host_id' in node:
+            contained_nodes.setdefault(node['host_id'], []).append(node)
 
     for node in processed_nodes.itervalues():
         # set plugins_to_install property for nodes
         if node['type'] in host_types:
             plugins_to_install = {}
-            for another_node in processed_nodes.itervalues():
-                # going over all other nodes, to accumulate plugins
-                # from different nodes whose host is the current node
-                if another_node.get('host_id') == node['id']:
-                    # ok to override here since we assume it is the same plugin
-                    for plugin in another_node[constants.PLUGINS]:
-                        if plugin[constants.PLUGIN_EXECUTOR_KEY] \
-                                == constants.HOST_AGENT:
-                            plugins_to_install[plugin['name']] = plugin
+            # accumulate plugins from different nodes whose host is the
+            # current node
+            for another_node in contained_nodes.get(node['id'], []):
+                # ok to override here since we assume it is the same plugin
+                for plugin in another_node[constants.PLUGINS]:
+                    if plugin[constants.PLUGIN_EXECUTOR_KEY] \
+                            == constants.HOST_AGENT:
+                        plugins_to_install[plugin['name']] = plugin
             node[constants.PLUGINS_TO_INSTALL] = plugins_to_install.values()
 
         # set deployment_plugins_to_install property for nodes
@@ -554,7 +607,8 @@ def _process_nodes_plugins(processed_nodes,
 
 
 def _get_plugins_from_operations(operations_lists,
-                                 processed_plugins):
+                                 processed_plugins,
+                                 node_plugins):
     plugins = {}
     for operations in operations_lists:
         for operation in operations.values():
@@ -562,12 +616,14 @@ def _get_plugins_from_operations(operations_lists,
             if not plugin_name:
                 # no-op
                 continue
-            plugin = processed_plugins[plugin_name]
             operation_executor = operation['executor']
             plugin_key = (plugin_name, operation_executor)
             if plugin_key not in plugins:
-                plugin = copy.deepcopy(plugin)
-                plugin['executor'] = operation_executor
+                plugin = node_plugins.get(plugin_key)
+                if plugin is None:
+                    plugin = copy.deepcopy(processed_plugins[plugin_name])
+                    plugin['executor'] = operation_executor
+                    node_plugins[plugin_key] = plugin
                 plugins[plugin_key] = plugin
     return plugins.values()
 
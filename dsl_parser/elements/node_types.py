@@ -35,10 +35,10 @@ class NodeType(types.Type):
         'self': [requirements.Value('super_type',
                                     predicate=types.derived_from_predicate,
                                     required=False)],
-        _data_types.DataTypes: [requirements.Value('data_types')]
+        _data_types.DataTypes: ['data_types_registry']
     }
 
-    def parse(self, super_type, data_types):
+    def parse(self, super_type, data_types_registry):
         node_type = self.build_dict_result()
         if not node_type.get('derived_from'):
             node_type.pop('derived_from', None)
@@ -46,7 +46,7 @@ class NodeType(types.Type):
             node_type[constants.PROPERTIES] = utils.merge_schemas(
                 overridden_schema=super_type.get('properties', {}),
                 overriding_schema=node_type.get('properties', {}),
-                data_types=data_types)
+                data_types=data_types_registry)
             node_type[constants.INTERFACES] = interfaces_parser. \
                 merge_node_type_interfaces(
                     overridden_interfaces=super_type[constants.INTERFACES],
@@ -14,11 +14,14 @@
 #    * limitations under the License.
 
 import copy
+import posixpath
 
 from dsl_parser import (constants,
                         exceptions,
+                        functions,
                         utils)
 from dsl_parser.elements import (data_types,
+                                 plugins as _plugins,
                                  version as _version)
 from dsl_parser.framework.elements import (DictElement,
                                            Element,
@@ -179,13 +182,21 @@ def process_interface_operations(
         plugins,
         error_code,
         partial_error_message,
-        resource_bases):
+        resource_bases,
+        plugins_index=None,
+        resources=None):
+    if plugins_index is None:
+        plugins_index = _plugins.PluginsIndex(plugins.keys())
+    if resources is None:
+        resources = Resources()
     return [process_operation(plugins=plugins,
                               operation_name=operation_name,
                               operation_content=operation_content,
                               error_code=error_code,
                               partial_error_message=partial_error_message,
-                              resource_bases=resource_bases)
+                              resource_bases=resource_bases,
+                              plugins_index=plugins_index,
+                              resources=resources)
             for operation_name, operation_content in interface.items()]
 
 
@@ -196,7 +207,9 @@ def process_operation(
         error_code,
         partial_error_message,
         resource_bases,
-        is_workflows=False):
+        is_workflows=False,
+        plugins_index=None,
+        resources=None):
     payload_field_name = 'parameters' if is_workflows else 'inputs'
     mapping_field_name = 'mapping' if is_workflows else 'implementation'
     operation_mapping = operation_content[mapping_field_name]
@@ -214,13 +227,17 @@ def process_operation(
         else:
             return no_op_operation(operation_name=operation_name)
 
-    candidate_plugins = [p for p in plugins.keys()
-                         if operation_mapping.startswith('{0}.'.format(p))]
+    if plugins_index is None:
+        plugins_index = _plugins.PluginsIndex(plugins.keys())
+    if resources is None:
+        resources = Resources()
+    candidate_plugins = plugins_index.match(operation_mapping)
     if candidate_plugins:
         if len(candidate_plugins) > 1:
             raise exceptions.DSLParsingLogicException(
                 91, 'Ambiguous operation mapping. [operation={0}, '
-                    'plugins={1}]'.format(operation_name, candidate_plugins))
+                    'plugins={1}]'.format(operation_name,
+                                          list(candidate_plugins)))
         plugin_name = candidate_plugins[0]
         mapping = operation_mapping[len(plugin_name) + 1:]
         if is_workflows:
@@ -239,7 +256,7 @@ def process_operation(
                 executor=operation_executor,
                 max_retries=operation_max_retries,
                 retry_interval=operation_retry_interval)
-    elif resource_bases and _resource_exists(resource_bases,
+    elif resource_bases and resources.exists(resource_bases,
                                              operation_mapping):
         operation_payload = copy.deepcopy(operation_payload or {})
         if constants.SCRIPT_PATH_PROPERTY in operation_payload:
@@ -302,6 +319,97 @@ def process_operation(
         raise exceptions.DSLParsingLogicException(error_code, error_message)
 
 
-def _resource_exists(resource_bases, resource_name):
-    return any(utils.url_exists('{0}/{1}'.format(resource_base, resource_name))
-               for resource_base in resource_bases if resource_base)
+class Resources(object):
+    """
+    Checks whether operation and workflow mappings are resources (scripts)
+    under the resource bases. Results, missing resources included, are
+    cached for the lifetime of the instance, which is a single parse.
+    """
+
+    def __init__(self, manifest=None):
+        """
+        :param manifest: An optional listing of the resource paths under the
+         resource bases, relative to them. When given, resources are looked
+         up in it instead of being fetched from the resource bases.
+        """
+        self._manifest = None
+        if manifest is not None:
+            self._manifest = frozenset(posixpath.normpath(resource_name)
+                                       for resource_name in manifest)
+        self._url_exists = {}
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def exists(self, resource_bases, resource_name):
+        if self._manifest is not None:
+            return posixpath.normpath(resource_name) in self._manifest
+        return any(self._exists('{0}/{1}'.format(resource_base,
+                                                 resource_name))
+                   for resource_base in resource_bases if resource_base)
+
+    def _exists(self, url):
+        exists = self._url_exists.get(url)
+        if exists is None:
+            exists = utils.url_exists(url)
+            self._url_exists[url] = exists
+        return exists
+
+
+class SharedOperations(object):
+    """
+    Holds a single dict for each distinct operation (and interface
+    operation) processed while parsing, so node templates and relationships
+    having identical operations share it instead of each carrying its own
+    copy. Operations with intrinsic functions in their inputs are never
+    shared, as functions are evaluated in place, in the context of the node
+    template they are defined in.
+    """
+
+    def __init__(self):
+        self._operations = {}
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def share(self, operation):
+        """
+        :param operation: An operation dict, which should not be modified
+         once shared.
+        :return: The shared dict identical to the operation, which is the
+         operation itself if it is the first of its kind or may not be
+         shared.
+        """
+        key = _shared_operation_key(operation)
+        if key is None:
+            return operation
+        try:
+            return self._operations.setdefault(key, operation)
+        except TypeError:
+            # unhashable values
+            return operation
+
+
+def _shared_operation_key(value):
+    # types are part of the key, as equal values of different types
+    # (e.g. 1 and True) should not be shared
+    if isinstance(value, dict):
+        if len(value) == 1 and \
+                functions.get_function(value.keys()[0]) is not None:
+            return None
+        items = []
+        for k, v in value.iteritems():
+            item_key = _shared_operation_key(v)
+            if item_key is None:
+                return None
+            items.append(((type(k), k), item_key))
+        return dict, frozenset(items)
+    if isinstance(value, list):
+        items = []
+        for item in value:
+            item_key = _shared_operation_key(item)
+            if item_key is None:
+                return None
+            items.append(item_key)
+        return list, tuple(items)
+    return type(value), value
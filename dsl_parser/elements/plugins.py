@@ -133,3 +133,45 @@ class Plugin(DictElement):
 class Plugins(DictElement):
 
     schema = Dict(type=Plugin)
+    provides = ['plugins_index']
+
+    def calculate_provided(self, **kwargs):
+        return {
+            'plugins_index': PluginsIndex(self.value.keys())
+        }
+
+
+class PluginsIndex(object):
+    """
+    Finds the plugins an operation mapping is prefixed with
+    ('<plugin name>.<mapping>'), by looking up the mapping's dot separated
+    prefixes instead of matching it against every plugin name.
+    Matches are memoized per mapping.
+    """
+
+    def __init__(self, plugin_names):
+        self._plugin_names = frozenset(plugin_names)
+        self._matches = {}
+
+    def __deepcopy__(self, memo):
+        # provided values are copied for each element requiring them, the
+        # index (and its memo) is shared instead
+        return self
+
+    def match(self, operation_mapping):
+        """
+        :param operation_mapping: An operation (or workflow) mapping.
+        :return: A tuple of the names of the plugins the mapping is prefixed
+         with. More than one plugin name means the mapping is ambiguous.
+        """
+        matches = self._matches.get(operation_mapping)
+        if matches is None:
+            matches = []
+            index = operation_mapping.find('.')
+            while index != -1:
+                if operation_mapping[:index] in self._plugin_names:
+                    matches.append(operation_mapping[:index])
+                index = operation_mapping.find('.', index + 1)
+            matches = tuple(matches)
+            self._matches[operation_mapping] = matches
+        return matches
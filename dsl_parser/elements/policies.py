@@ -13,8 +13,6 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
-import itertools
-
 import networkx as nx
 
 from dsl_parser import (exceptions,
@@ -350,30 +348,62 @@ class Policies(DictElement):
                 }
         return scaling_groups
 
-    def _validate_and_update_groups(self, scaling_groups, node_templates):
+    @classmethod
+    def _validate_and_update_groups(cls, scaling_groups, node_templates):
 
         member_graph = nx.DiGraph()
+        member_groups = {}
         for group_name, group in scaling_groups.items():
             for member in group['members']:
                 member_graph.add_edge(member, group_name)
+                member_groups[member] = group_name
 
-        node_graph = nx.DiGraph()
+        node_containers = {}
         for node in node_templates:
-            node_graph.add_node(node['id'])
             for rel in node.get(constants.RELATIONSHIPS, []):
                 if constants.CONTAINED_IN_REL_TYPE in rel['type_hierarchy']:
-                    node_graph.add_edge(node['id'], rel['target_id'])
+                    node_containers[node['id']] = rel['target_id']
+
+        cls._validate_no_group_cycles(member_graph)
+        cls._validate_members_in_one_group_only(member_graph)
+
+        # group chains are calculated only after the above validations so
+        # each member is known to have a single group and no group cycles
+        # exist (contained in cycles are rejected while parsing the nodes)
+        group_chains = cls._build_chains(member_groups, member_groups)
+        container_chains = cls._build_chains(
+            [node['id'] for node in node_templates], node_containers)
+        cls._validate_no_contained_in_shares_group_with_non_contained_in(
+            group_chains, container_chains)
+        cls._remove_contained_nodes_from_scaling_groups(
+            scaling_groups, group_chains, container_chains)
 
-        self._validate_no_group_cycles(member_graph)
-        self._validate_members_in_one_group_only(member_graph)
-        self._validate_no_contained_in_shares_group_with_non_contained_in(
-            member_graph, node_graph)
-        self._remove_contained_nodes_from_scaling_groups(
-            scaling_groups, member_graph, node_graph)
+    @staticmethod
+    def _build_chains(keys, successors):
+        # map each key to the list of keys reached by (recursively)
+        # following its successor, closest successor first.
+        # chains are built once per key, reusing the chain of the first
+        # successor whose chain was already built
+        chains = {}
+        for key in keys:
+            path = []
+            current = key
+            while current is not None and current not in chains:
+                path.append(current)
+                current = successors.get(current)
+            chain = [] if current is None else [current] + chains[current]
+            for path_key in reversed(path):
+                chains[path_key] = chain
+                chain = [path_key] + chain
+        return chains
 
     @staticmethod
     def _validate_no_group_cycles(member_graph):
         # verify no group cycles (i.e. group A in group B and vice versa)
+        # the cycles are only looked up (which is costly for large groups)
+        # when the graph is known to have some
+        if nx.is_directed_acyclic_graph(member_graph):
+            return
         group_cycles = nx.recursive_simple_cycles(member_graph)
         if group_cycles:
             raise exceptions.DSLParsingLogicException(
@@ -394,83 +424,41 @@ class Policies(DictElement):
 
     @staticmethod
     def _validate_no_contained_in_shares_group_with_non_contained_in(
-            member_graph, node_graph):
+            group_chains, container_chains):
         # for each node a, if node a is (recursively) contained in node b
         # verify that it is not contained in (recursively) a group that has
         # nodes that are not (recursively) contained in node b too unless
         # node b is in that group as well
 
-        # first extract all group members (recursively)
-        group_members = {}
-        for member in member_graph:
-            if member in node_graph:
+        # as members belong to a single group, two nodes share some group
+        # iff they share their top level group. every pair of nodes sharing
+        # a top level group should either be (recursively) contained in the
+        # same root node (a node not contained in any other node), or both
+        # their root nodes should be members of that top level group as well
+        # (recursively). so instead of checking each pair of nodes, the
+        # group node members are grouped by their root node, and a root
+        # node that is not part of the group may only contain all of them
+        top_level_group_roots = {}
+        for member, groups in group_chains.items():
+            if member not in container_chains:
                 continue
-            group_members[member] = nx.ancestors(member_graph, member)
-
-        # next, remove members that are groups themselves
-        group_names = set(group_members.keys())
-        group_node_members = {}
-        for group_name, members in group_members.items():
-            group_node_members[group_name] = members - group_names
-
-        # now, for each group, for each node pair, verify both nodes in pair
-        # are contained (recursively) in some third node or one of them is
-        # contained in some third node that has this property
-        containing_nodes = {}
-
-        def check_pair(pair_key):
-            node_a, node_b = pair_key
-            if node_a == node_b:
-                return True
-            if node_a not in containing_nodes:
-                containing_nodes[node_a] = nx.topological_sort(
-                    node_graph, nbunch=[node_a])
-            if node_b not in containing_nodes:
-                containing_nodes[node_b] = nx.topological_sort(
-                    node_graph, nbunch=[node_b])
-            a_containing_nodes = set(containing_nodes[node_a])
-            a_containing_nodes.remove(node_a)
-            b_containing_nodes = set(containing_nodes[node_b])
-            b_containing_nodes.remove(node_b)
-            if not (a_containing_nodes or b_containing_nodes):
-                return True
-            if node_b in a_containing_nodes:
-                return True
-            if node_a in b_containing_nodes:
-                return True
-            if a_containing_nodes & b_containing_nodes:
-                return True
-            return False
-
-        checked_pairs = set()
-        ok_pairs = set()
-        problematic_pairs = set()
-        for node_members in group_node_members.values():
-            for node_a, node_b in itertools.product(node_members, repeat=2):
-                pair_key = tuple(sorted([node_a, node_b]))
-                if pair_key in checked_pairs:
+            containers = container_chains[member]
+            root = containers[-1] if containers else member
+            roots = top_level_group_roots.setdefault(groups[-1], {})
+            roots.setdefault(root, []).append(member)
+
+        for top_level_group, roots in top_level_group_roots.items():
+            if len(roots) < 2:
+                continue
+            for root, members in sorted(roots.items()):
+                root_groups = group_chains.get(root)
+                if root_groups and root_groups[-1] == top_level_group:
                     continue
-                if check_pair(pair_key):
-                    ok_pairs.add(pair_key)
-                else:
-                    problematic_pairs.add(pair_key)
-                checked_pairs.add(pair_key)
-
-        def check_problematic_pair(node_a, node_b):
-            for node_a_containing_node in containing_nodes[node_a]:
-                pair_key = tuple(sorted([node_b, node_a_containing_node]))
-                if pair_key in ok_pairs:
-                    return True
-            for node_b_containing_node in containing_nodes[node_b]:
-                pair_key = tuple(sorted([node_a, node_b_containing_node]))
-                if pair_key in ok_pairs:
-                    return True
-            return False
-
-        for node_a, node_b in problematic_pairs:
-            if check_problematic_pair(node_a, node_b):
-                ok_pairs.add((node_a, node_b))
-            else:
+                node_a = min(members)
+                node_b = min(min(other_members)
+                             for other_root, other_members in roots.items()
+                             if other_root != root)
+                node_a, node_b = sorted([node_a, node_b])
                 raise exceptions.DSLParsingLogicException(
                     exceptions.ERROR_NON_CONTAINED_GROUP_MEMBERS,
                     "Node '{0}' and '{1}' belong to some shared group but "
@@ -479,47 +467,36 @@ class Policies(DictElement):
 
     @staticmethod
     def _remove_contained_nodes_from_scaling_groups(
-            scaling_groups, member_graph, node_graph):
+            scaling_groups, group_chains, container_chains):
         # for each node, if a node is (recursively) with
         # a node that contains it (recursively), remove the offending
         # member from the relevant group.
         # if the node and its containee are in the same group, remove the
         # containee, otherwise, remove the group closest to the containing
         # node
-        for member in member_graph:
-            if member not in node_graph:
+        removed_members = {}
+        for member, containing_groups in group_chains.items():
+            if member not in container_chains:
                 continue
-            containing_groups = nx.topological_sort(member_graph,
-                                                    nbunch=[member])
-            containing_nodes = nx.topological_sort(node_graph, nbunch=[member])
-            for node in containing_nodes:
-                if node == member:
-                    continue
-                if node not in member_graph:
+            for node in container_chains[member]:
+                containing_node_groups = group_chains.get(node)
+                if not containing_node_groups:
                     continue
-
-                containing_node_groups = nx.topological_sort(member_graph,
-                                                             nbunch=[node])
                 containing_node_groups_set = set(containing_node_groups)
-
-                shared_groups = (set(containing_groups) &
-                                 containing_node_groups_set)
-                if not shared_groups:
+                for index, group in enumerate(containing_groups):
+                    if group in containing_node_groups_set:
+                        break
+                else:
                     continue
 
-                minimal_containing_group = nx.topological_sort(
-                    member_graph, nbunch=shared_groups)[0]
-                direct_member_group = member_graph.successors(member)[0]
-                members = scaling_groups[minimal_containing_group]['members']
-                if direct_member_group == minimal_containing_group:
-                    removed_member = member
-                else:
-                    for containing_group in reversed(containing_groups):
-                        if containing_group not in containing_node_groups_set:
-                            removed_member = containing_group
-                            break
-                    else:
-                        raise RuntimeError('Illegal state')
-
-                if removed_member in members:
-                    members.remove(removed_member)
+                # the minimal containing group is the first shared group,
+                # the removed member is the member itself if it is a direct
+                # member of that group, otherwise, it is the group
+                # containing the member that is a direct member of it
+                removed_member = (containing_groups[index - 1] if index
+                                  else member)
+                removed_members.setdefault(group, set()).add(removed_member)
+
+        for group_name, removed in removed_members.items():
+            members = scaling_groups[group_name]['members']
+            members[:] = [m for m in members if m not in removed]
@@ -33,15 +33,17 @@ class Relationship(types.Type):
         'target_interfaces': operation.NodeTypeInterfaces,
     }
     requires = {
-        'inputs': [Requirement('resource_base', required=False)],
-        _plugins.Plugins: [Value('plugins')],
+        'inputs': [Requirement('resource_base', required=False),
+                   Requirement('resources', required=False)],
+        _plugins.Plugins: [Value('plugins'), 'plugins_index'],
         'self': [Value('super_type',
                        predicate=types.derived_from_predicate,
                        required=False)],
-        _data_types.DataTypes: [Value('data_types')]
+        _data_types.DataTypes: ['data_types_registry']
     }
 
-    def parse(self, super_type, plugins, resource_base, data_types):
+    def parse(self, super_type, plugins, plugins_index, resource_base,
+              resources, data_types_registry):
         relationship_type = self.build_dict_result()
         if not relationship_type.get('derived_from'):
             relationship_type.pop('derived_from', None)
@@ -51,7 +53,7 @@ class Relationship(types.Type):
             relationship_type[constants.PROPERTIES] = utils.merge_schemas(
                 overridden_schema=super_type.get('properties', {}),
                 overriding_schema=relationship_type.get('properties', {}),
-                data_types=data_types)
+                data_types=data_types_registry)
             for interfaces in [constants.SOURCE_INTERFACES,
                                constants.TARGET_INTERFACES]:
                 relationship_type[interfaces] = interfaces_parser. \
@@ -62,8 +64,10 @@ class Relationship(types.Type):
         _validate_relationship_fields(
             rel_obj=relationship_type,
             plugins=plugins,
+            plugins_index=plugins_index,
             rel_name=relationship_type_name,
-            resource_base=resource_base)
+            resource_base=resource_base,
+            resources=resources)
         relationship_type['name'] = relationship_type_name
         relationship_type[
             constants.TYPE_HIERARCHY] = self.create_type_hierarchy(super_type)
@@ -76,7 +80,8 @@ class Relationships(types.Types):
     schema = Dict(type=Relationship)
 
 
-def _validate_relationship_fields(rel_obj, plugins, rel_name, resource_base):
+def _validate_relationship_fields(rel_obj, plugins, plugins_index, rel_name,
+                                  resource_base, resources):
     for interfaces in [constants.SOURCE_INTERFACES,
                        constants.TARGET_INTERFACES]:
         for interface_name, interface in rel_obj[interfaces].items():
@@ -85,4 +90,6 @@ def _validate_relationship_fields(rel_obj, plugins, rel_name, resource_base):
                 plugins=plugins,
                 error_code=19,
                 partial_error_message="Relationship '{0}'".format(rel_name),
-                resource_bases=resource_base)
+                resource_bases=resource_base,
+                plugins_index=plugins_index,
+                resources=resources)
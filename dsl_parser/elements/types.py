@@ -13,7 +13,8 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
-from dsl_parser import exceptions
+from dsl_parser import (exceptions,
+                        models)
 from dsl_parser.framework.elements import (DictElement,
                                            Element,
                                            Leaf)
@@ -31,7 +32,7 @@ class Type(Element):
         else:
             type_hierarchy = []
         type_hierarchy.append(self.name)
-        return type_hierarchy
+        return models.TypeHierarchy.of(type_hierarchy)
 
     @staticmethod
     def fix_properties(value):
@@ -40,11 +40,12 @@ class Workflow(Element):
         }
     ]
     requires = {
-        'inputs': [Requirement('resource_base', required=False)],
-        _plugins.Plugins: [Value('plugins')]
+        'inputs': [Requirement('resource_base', required=False),
+                   Requirement('resources', required=False)],
+        _plugins.Plugins: [Value('plugins'), 'plugins_index']
     }
 
-    def parse(self, plugins, resource_base):
+    def parse(self, plugins, plugins_index, resource_base, resources):
         if isinstance(self.initial_value, str):
             operation_content = {'mapping': self.initial_value,
                                  'parameters': {}}
@@ -57,7 +58,9 @@ class Workflow(Element):
             error_code=21,
             partial_error_message='',
             resource_bases=resource_base,
-            is_workflows=True)
+            is_workflows=True,
+            plugins_index=plugins_index,
+            resources=resources)
 
 
 class Workflows(DictElement):
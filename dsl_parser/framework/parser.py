@@ -404,7 +404,6 @@ class Parser(object):
                     required_args[requirement.name] = result
 
         return required_args
-_parser = Parser()
 
 
 def validate_schema_api(element_cls):
@@ -417,11 +416,13 @@ def parse(value,
           inputs=None,
           strict=True):
     validate_schema_api(element_cls)
-    return _parser.parse(value=value,
-                         element_cls=element_cls,
-                         element_name=element_name,
-                         inputs=inputs,
-                         strict=strict)
+    # all parse state is kept per call, so concurrent (and nested) parses
+    # do not share anything
+    return Parser().parse(value=value,
+                          element_cls=element_cls,
+                          element_name=element_name,
+                          inputs=inputs,
+                          strict=strict)
 
 
 def _expected_type_message(value, expected_type):
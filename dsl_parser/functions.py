@@ -15,6 +15,16 @@
 
 import pkg_resources
 import abc
+import contextlib
+import copy
+import json
+import threading
+import time
+from multiprocessing.dummy import Pool as ThreadPool
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
 
 from dsl_parser import (constants,
                         exceptions,
@@ -27,6 +37,9 @@ TARGET = 'TARGET'
 
 TEMPLATE_FUNCTIONS = {}
 
+# per thread overlays of template functions, see overlay()
+_overlays = threading.local()
+
 
 def register(fn=None, name=None):
     if fn is None:
@@ -39,8 +52,40 @@ def register(fn=None, name=None):
 
 
 def unregister(name):
-    if name in TEMPLATE_FUNCTIONS:
-        del TEMPLATE_FUNCTIONS[name]
+    TEMPLATE_FUNCTIONS.pop(name, None)
+
+
+@contextlib.contextmanager
+def overlay(template_functions):
+    """
+    Makes template functions available to the current thread only, on top
+    of (and taking precedence over) the registered ones, for the duration
+    of the with block. Unlike register, parses and evaluations running in
+    other threads are not affected. Overlays may be nested.
+
+    :param template_functions: A dict from function name to function.
+    """
+    previous = getattr(_overlays, 'functions', None)
+    current = dict(previous or {})
+    for name, fn in (template_functions or {}).iteritems():
+        fn.name = name
+        current[name] = fn
+    _overlays.functions = current
+    try:
+        yield
+    finally:
+        _overlays.functions = previous
+
+
+def get_function(name):
+    """
+    :param name: A template function name.
+    :return: The function the name refers to in the current thread, or None.
+    """
+    functions = getattr(_overlays, 'functions', None)
+    if functions and name in functions:
+        return functions[name]
+    return TEMPLATE_FUNCTIONS.get(name)
 
 
 def _register_entry_point_functions():
@@ -50,39 +95,336 @@ def _register_entry_point_functions():
 _register_entry_point_functions()
 
 
+class RuntimeEvaluationCache(object):
+    """
+    A cache of node instances and nodes that can be shared by many
+    ``RuntimeEvaluationStorage`` objects (e.g. by all evaluations performed
+    during a single workflow execution). Indexes the storages derive from
+    them are cached too, and are dropped along with the entries they were
+    derived from.
+
+    :param ttl: Default time to live (in seconds) of cache entries. ``None``
+                means entries do not expire.
+    :param max_size: Maximum number of cache entries. When exceeded, the
+                     least recently used entries are evicted. ``None`` means
+                     the cache is unbounded.
+    :param clock: Function returning the current time in seconds.
+    """
+
+    NODE_INSTANCES = 'node_instances'
+    NODE_INSTANCE = 'node_instance'
+    NODE = 'node'
+    # indexes derived from the entries above
+    CONTAINING_GROUP_INSTANCES = 'containing_group_instances'
+    NODE_INSTANCES_BY_GROUP_INSTANCE = 'node_instances_by_group_instance'
+    RELATIONSHIP_TARGET_IDS = 'relationship_target_ids'
+
+    def __init__(self, ttl=None, max_size=None, clock=time.time):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._clock = clock
+        # LRU order is only tracked for bounded caches
+        self._entries = OrderedDict() if max_size is not None else {}
+        # entries derived from other entries, by the entries they depend on
+        # (and the other way around)
+        self._dependents = {}
+        self._dependencies = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, kind, key):
+        """Get a cached value, or ``None`` if missing or expired."""
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= self._clock():
+                self._remove((kind, key))
+                return None
+            if self._max_size is not None:
+                # re-insert to mark as most recently used
+                del self._entries[(kind, key)]
+                self._entries[(kind, key)] = entry
+            return value
+
+    def set(self, kind, key, value, ttl=None, depends_on=()):
+        """Cache a value.
+
+        :param ttl: Time to live of this entry, overrides the default ttl.
+        :param depends_on: ``(kind, key)`` tuples of the entries the value
+                           was derived from. The entry expires with them and
+                           is removed when any of them is invalidated,
+                           evicted or replaced. It is not cached if any of
+                           them is missing.
+        """
+        ttl = ttl if ttl is not None else self._ttl
+        expires = self._clock() + ttl if ttl is not None else None
+        with self._lock:
+            depends_on = set(depends_on)
+            for dependency in depends_on:
+                entry = self._entries.get(dependency)
+                if entry is None:
+                    return
+                dependency_expires = entry[0]
+                if dependency_expires is not None and (
+                        expires is None or dependency_expires < expires):
+                    expires = dependency_expires
+            if (kind, key) in self._entries:
+                self._remove((kind, key))
+            self._entries[(kind, key)] = (expires, value)
+            if depends_on:
+                self._dependencies[(kind, key)] = depends_on
+                for dependency in depends_on:
+                    self._dependents.setdefault(dependency, set()).add(
+                        (kind, key))
+            if self._max_size is not None:
+                while len(self._entries) > self._max_size:
+                    self._remove(next(iter(self._entries)))
+
+    def invalidate_node_instance(self, node_instance_id):
+        """Remove a node instance and the instance lists containing it,
+        along with the indexes derived from them."""
+        with self._lock:
+            self._remove((self.NODE_INSTANCE, node_instance_id))
+            for (kind, key), (_, value) in self._entries.items():
+                if kind != self.NODE_INSTANCES:
+                    continue
+                if any(node_instance.id == node_instance_id
+                       for node_instance in value):
+                    self._remove((kind, key))
+
+    def invalidate_node(self, node_id):
+        """Remove a node and its node instances list, along with the indexes
+        derived from them."""
+        with self._lock:
+            self._remove((self.NODE, node_id))
+            self._remove((self.NODE_INSTANCES, node_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dependents.clear()
+            self._dependencies.clear()
+
+    def _remove(self, entry_key):
+        self._entries.pop(entry_key, None)
+        for dependency in self._dependencies.pop(entry_key, ()):
+            dependents = self._dependents.get(dependency)
+            if dependents is not None:
+                dependents.discard(entry_key)
+                if not dependents:
+                    del self._dependents[dependency]
+        for dependent in self._dependents.pop(entry_key, ()):
+            self._remove(dependent)
+
+
 class RuntimeEvaluationStorage(object):
+    """
+    Caches node instances and nodes fetched during runtime evaluation.
+
+    The optional bulk methods are used by ``prefetch`` to fetch many
+    entities in a single call:
+
+    * get_node_instances_bulk_method(node_ids) - returns a list of all
+      node instances of the specified nodes.
+    * get_node_instance_bulk_method(node_instance_ids) - returns a list
+      of the specified node instances.
+    * get_node_bulk_method(node_ids) - returns a list of the specified
+      nodes.
+
+    A long lived ``RuntimeEvaluationCache`` may be passed as ``cache`` to
+    share fetched entities between storages. Otherwise, entities are cached
+    for the lifetime of the storage.
+    """
 
     def __init__(self,
                  get_node_instances_method,
                  get_node_instance_method,
-                 get_node_method):
+                 get_node_method,
+                 get_node_instances_bulk_method=None,
+                 get_node_instance_bulk_method=None,
+                 get_node_bulk_method=None,
+                 cache=None):
         self._get_node_instances_method = get_node_instances_method
         self._get_node_instance_method = get_node_instance_method
         self._get_node_method = get_node_method
-
-        self._node_to_node_instances = {}
-        self._node_instances = {}
-        self._nodes = {}
+        self._get_node_instances_bulk_method = get_node_instances_bulk_method
+        self._get_node_instance_bulk_method = get_node_instance_bulk_method
+        self._get_node_bulk_method = get_node_bulk_method
+        self._cache = cache if cache is not None else RuntimeEvaluationCache()
+
+    @property
+    def supports_prefetch(self):
+        return bool(self._get_node_instances_bulk_method or
+                    self._get_node_instance_bulk_method or
+                    self._get_node_bulk_method)
+
+    def prefetch(self, node_ids=(), node_instance_ids=()):
+        """Fetch node instances and nodes in bulk ahead of evaluation.
+
+        Fetches the node instances of ``node_ids``, the node instances
+        specified by ``node_instance_ids`` and then the nodes of all fetched
+        node instances. Entities already stored are not fetched again and
+        entities with no matching bulk method are left to be fetched lazily.
+        """
+        cache = self._cache
+        node_instances = []
+        missing_node_ids = []
+        for node_id in set(node_ids):
+            cached = cache.get(cache.NODE_INSTANCES, node_id)
+            if cached is None:
+                missing_node_ids.append(node_id)
+            else:
+                node_instances.extend(cached)
+        if missing_node_ids and self._get_node_instances_bulk_method:
+            node_to_node_instances = dict((node_id, []) for node_id
+                                          in missing_node_ids)
+            fetched = self._get_node_instances_bulk_method(missing_node_ids)
+            for node_instance in fetched:
+                node_to_node_instances.setdefault(
+                    node_instance.node_id, []).append(node_instance)
+            for node_id, instances in node_to_node_instances.iteritems():
+                self._cache_node_instances(node_id, instances)
+            node_instances.extend(fetched)
+
+        missing_node_instance_ids = []
+        for node_instance_id in set(node_instance_ids):
+            node_instance = cache.get(cache.NODE_INSTANCE, node_instance_id)
+            if node_instance is None:
+                missing_node_instance_ids.append(node_instance_id)
+            else:
+                node_instances.append(node_instance)
+        if missing_node_instance_ids and self._get_node_instance_bulk_method:
+            fetched = self._get_node_instance_bulk_method(
+                missing_node_instance_ids)
+            for node_instance in fetched:
+                cache.set(cache.NODE_INSTANCE, node_instance.id, node_instance)
+            node_instances.extend(fetched)
+
+        missing_node_ids = [
+            node_id for node_id in set(node_instance.node_id
+                                       for node_instance in node_instances)
+            if cache.get(cache.NODE, node_id) is None]
+        if missing_node_ids and self._get_node_bulk_method:
+            for node in self._get_node_bulk_method(missing_node_ids):
+                cache.set(cache.NODE, node.id, node)
 
     def get_node_instances(self, node_id):
-        if node_id not in self._node_to_node_instances:
+        cache = self._cache
+        node_instances = cache.get(cache.NODE_INSTANCES, node_id)
+        if node_instances is None:
             node_instances = self._get_node_instances_method(node_id)
-            self._node_to_node_instances[node_id] = node_instances
-            for node_instance in node_instances:
-                self._node_instances[node_instance.id] = node_instance
-        return self._node_to_node_instances[node_id]
+            self._cache_node_instances(node_id, node_instances)
+        return node_instances
 
     def get_node_instance(self, node_instance_id):
-        if node_instance_id not in self._node_instances:
+        cache = self._cache
+        node_instance = cache.get(cache.NODE_INSTANCE, node_instance_id)
+        if node_instance is None:
             node_instance = self._get_node_instance_method(node_instance_id)
-            self._node_instances[node_instance_id] = node_instance
-        return self._node_instances[node_instance_id]
+            cache.set(cache.NODE_INSTANCE, node_instance_id, node_instance)
+        return node_instance
 
     def get_node(self, node_id):
-        if node_id not in self._nodes:
+        cache = self._cache
+        node = cache.get(cache.NODE, node_id)
+        if node is None:
             node = self._get_node_method(node_id)
-            self._nodes[node_id] = node
-        return self._nodes[node_id]
+            cache.set(cache.NODE, node_id, node)
+        return node
+
+    def containing_group_instances(self, node_instance):
+        """Scaling group instances containing a node instance.
+
+        Includes group instances containing any of the node instance's
+        containers. Results are cached per node instance (along with the
+        entries they were derived from), so walking up the containment chain
+        through storage happens once per instance.
+
+        :return: A list of (group name, group instance id) tuples, ordered
+                 from the innermost group outwards.
+        """
+        cache = self._cache
+        node_instance_id = node_instance.id
+        result = cache.get(cache.CONTAINING_GROUP_INSTANCES, node_instance_id)
+        if result is None:
+            result = [(g['name'], g['id'])
+                      for g in node_instance.scaling_groups or []]
+            depends_on = [(cache.NODE_INSTANCE, node_instance_id),
+                          (cache.NODE, node_instance.node_id)]
+            parent_instance = self._parent_node_instance(node_instance)
+            if parent_instance:
+                result += self.containing_group_instances(parent_instance)
+                depends_on.append((cache.CONTAINING_GROUP_INSTANCES,
+                                   parent_instance.id))
+            cache.set(cache.CONTAINING_GROUP_INSTANCES, node_instance_id,
+                      result, depends_on=depends_on)
+        return result
+
+    def group_instance_id(self, node_instance, group_name):
+        for name, group_instance_id in self.containing_group_instances(
+                node_instance):
+            if name == group_name:
+                return group_instance_id
+        raise RuntimeError('Illegal state')
+
+    def node_instances_by_group_instance(self, node_id, group_name):
+        """Node instances of a node, indexed by their containing instance of
+        the specified scaling group.
+
+        :return: A dict from group instance id to a list of node instances.
+        """
+        cache = self._cache
+        key = (node_id, group_name)
+        result = cache.get(cache.NODE_INSTANCES_BY_GROUP_INSTANCE, key)
+        if result is None:
+            result = {}
+            depends_on = [(cache.NODE_INSTANCES, node_id)]
+            for node_instance in self.get_node_instances(node_id):
+                group_instance_id = self.group_instance_id(node_instance,
+                                                           group_name)
+                result.setdefault(group_instance_id, []).append(node_instance)
+                depends_on.append((cache.CONTAINING_GROUP_INSTANCES,
+                                   node_instance.id))
+            cache.set(cache.NODE_INSTANCES_BY_GROUP_INSTANCE, key, result,
+                      depends_on=depends_on)
+        return result
+
+    def relationship_target_ids(self, node_instance, target_name):
+        """Ids of the node instances of ``target_name`` the node instance
+        has relationships to."""
+        cache = self._cache
+        targets = cache.get(cache.RELATIONSHIP_TARGET_IDS, node_instance.id)
+        if targets is None:
+            targets = {}
+            for relationship in node_instance.relationships or []:
+                targets.setdefault(relationship['target_name'], set()).add(
+                    relationship['target_id'])
+            cache.set(cache.RELATIONSHIP_TARGET_IDS, node_instance.id,
+                      targets,
+                      depends_on=[(cache.NODE_INSTANCE, node_instance.id)])
+        return targets.get(target_name, set())
+
+    def _parent_node_instance(self, node_instance):
+        node = self.get_node(node_instance.node_id)
+        for relationship in node.relationships or []:
+            if (constants.CONTAINED_IN_REL_TYPE in
+                    relationship['type_hierarchy']):
+                target_name = relationship['target_id']
+                target_id = [
+                    r['target_id'] for r in node_instance.relationships
+                    if r['target_name'] == target_name][0]
+                return self.get_node_instance(target_id)
+        return None
+
+    def _cache_node_instances(self, node_id, node_instances):
+        cache = self._cache
+        cache.set(cache.NODE_INSTANCES, node_id, node_instances)
+        for node_instance in node_instances:
+            cache.set(cache.NODE_INSTANCE, node_instance.id, node_instance)
 
 
 class Function(object):
@@ -285,6 +627,10 @@ class GetAttribute(Function):
                                         self.attribute_path,
                                         self.path,
                                         raise_if_not_found=False)
+        if isinstance(value, (dict, list)):
+            # node instances and nodes may be cached (and shared between
+            # evaluations), so the payload must not reference their values
+            value = copy.deepcopy(value)
         return value
 
     def _resolve_node_instance_by_name(self, storage):
@@ -326,14 +672,11 @@ class GetAttribute(Function):
         if not self_instance_id:
             return None
         self_instance = storage.get_node_instance(self_instance_id)
-        self_instance_relationships = self_instance.relationships or []
-        node_instances_target_ids = set()
-        for relationship in self_instance_relationships:
-            if relationship['target_name'] == self.node_name:
-                node_instances_target_ids.add(relationship['target_id'])
+        node_instances_target_ids = storage.relationship_target_ids(
+            self_instance, self.node_name)
         if len(node_instances_target_ids) != 1:
             return None
-        node_instance_target_id = node_instances_target_ids.pop()
+        node_instance_target_id = next(iter(node_instances_target_ids))
         for node_instance in node_instances:
             if node_instance.id == node_instance_target_id:
                 return node_instance
@@ -345,45 +688,14 @@ class GetAttribute(Function):
             storage,
             node_instances):
 
-        def _parent_instance(_instance):
-            _node = storage.get_node(_instance.node_id)
-            for relationship in _node.relationships or []:
-                if (constants.CONTAINED_IN_REL_TYPE in
-                        relationship['type_hierarchy']):
-                    target_name = relationship['target_id']
-                    target_id = [
-                        r['target_id'] for r in _instance.relationships
-                        if r['target_name'] == target_name][0]
-                    return storage.get_node_instance(target_id)
-            return None
-
-        def _containing_groups(_instance):
-            result = [g['name'] for g in _instance.scaling_groups or []]
-            parent_instance = _parent_instance(_instance)
-            if parent_instance:
-                result += _containing_groups(parent_instance)
-            return result
-
         def _minimal_shared_group(instance_a, instance_b):
-            a_containing_groups = _containing_groups(instance_a)
-            b_containing_groups = _containing_groups(instance_b)
-            shared_groups = set(a_containing_groups) & set(b_containing_groups)
-            if not shared_groups:
-                return None
-            for group in a_containing_groups:
-                if group in shared_groups:
-                    return group
-            else:
-                raise RuntimeError('Illegal state')
-
-        def _group_instance(node_instance, group_name):
-            for scaling_group in (node_instance.scaling_groups or []):
-                if scaling_group['name'] == group_name:
-                    return scaling_group['id']
-            parent_instance = _parent_instance(node_instance)
-            if not parent_instance:
-                raise RuntimeError('Illegal state')
-            return _group_instance(parent_instance, group_name)
+            b_containing_groups = set(
+                name for name, _ in
+                storage.containing_group_instances(instance_b))
+            for name, _ in storage.containing_group_instances(instance_a):
+                if name in b_containing_groups:
+                    return name
+            return None
 
         def _resolve_node_instance(context_instance_id):
             context_instance = storage.get_node_instance(context_instance_id)
@@ -392,12 +704,11 @@ class GetAttribute(Function):
             if not minimal_shared_group:
                 return None
 
-            context_group_instance = _group_instance(context_instance,
-                                                     minimal_shared_group)
-            result_node_instances = [
-                i for i in node_instances if
-                _group_instance(i, minimal_shared_group) ==
-                context_group_instance]
+            context_group_instance = storage.group_instance_id(
+                context_instance, minimal_shared_group)
+            result_node_instances = storage.node_instances_by_group_instance(
+                self.node_name, minimal_shared_group).get(
+                context_group_instance, [])
 
             if len(result_node_instances) == 1:
                 return result_node_instances[0]
@@ -419,6 +730,27 @@ class GetAttribute(Function):
 
         return None
 
+    def runtime_references(self):
+        """Node ids and node instance ids this function may fetch at runtime.
+
+        :return: A (node_ids, node_instance_ids) tuple of sets.
+        """
+        node_ids, context_keys = self.runtime_reference_keys()
+        return node_ids, _context_node_instance_ids(self.context or {},
+                                                    context_keys)
+
+    def runtime_reference_keys(self):
+        """Node ids this function may fetch at runtime, along with the
+        context keys holding the node instance ids it may fetch.
+
+        :return: A (node_ids, context_keys) tuple of sets.
+        """
+        if self.node_name in [SELF, SOURCE, TARGET]:
+            return set(), set([self.node_name.lower()])
+        # context node instances are used for resolving ambiguous node
+        # instances
+        return set([self.node_name]), set(['self', 'source', 'target'])
+
     def _validate_ref(self, ref, ref_name):
         if not ref:
             raise exceptions.FunctionEvaluationError(
@@ -535,33 +867,53 @@ def _get_property_value(node_name,
 
 def parse(raw_function, scope=None, context=None, path=None):
     if isinstance(raw_function, dict) and len(raw_function) == 1:
-        func_name = raw_function.keys()[0]
-        if func_name in TEMPLATE_FUNCTIONS:
+        func = get_function(raw_function.keys()[0])
+        if func is not None:
             func_args = raw_function.values()[0]
-            return TEMPLATE_FUNCTIONS[func_name](func_args,
-                                                 scope=scope,
-                                                 context=context,
-                                                 path=path,
-                                                 raw=raw_function)
+            return func(func_args,
+                        scope=scope,
+                        context=context,
+                        path=path,
+                        raw=raw_function)
     return raw_function
 
 
 def evaluate_functions(payload, context,
                        get_node_instances_method,
                        get_node_instance_method,
-                       get_node_method):
+                       get_node_method,
+                       get_node_instances_bulk_method=None,
+                       get_node_instance_bulk_method=None,
+                       get_node_bulk_method=None,
+                       cache=None):
     """Evaluate functions in payload.
 
+    When bulk methods are provided, all node instances and nodes referenced
+    by the payload functions are fetched in bulk before evaluation.
+
     :param payload: The payload to evaluate.
     :param context: Context used during evaluation.
     :param get_node_instances_method: A method for getting node instances.
     :param get_node_instance_method: A method for getting a node instance.
     :param get_node_method: A method for getting a node.
+    :param get_node_instances_bulk_method: A method for getting the node
+                                           instances of several nodes.
+    :param get_node_instance_bulk_method: A method for getting several node
+                                          instances.
+    :param get_node_bulk_method: A method for getting several nodes.
+    :param cache: A ``RuntimeEvaluationCache`` shared between evaluations.
     :return: payload.
     """
-    handler = runtime_evaluation_handler(get_node_instances_method,
-                                         get_node_instance_method,
-                                         get_node_method)
+    storage = RuntimeEvaluationStorage(
+        get_node_instances_method=get_node_instances_method,
+        get_node_instance_method=get_node_instance_method,
+        get_node_method=get_node_method,
+        get_node_instances_bulk_method=get_node_instances_bulk_method,
+        get_node_instance_bulk_method=get_node_instance_bulk_method,
+        get_node_bulk_method=get_node_bulk_method,
+        cache=cache)
+    _prefetch(storage, payload, context)
+    handler = _handler('evaluate_runtime', storage=storage)
     scan.scan_properties(payload,
                          handler,
                          scope=None,
@@ -574,13 +926,23 @@ def evaluate_functions(payload, context,
 def evaluate_outputs(outputs_def,
                      get_node_instances_method,
                      get_node_instance_method,
-                     get_node_method):
+                     get_node_method,
+                     get_node_instances_bulk_method=None,
+                     get_node_instance_bulk_method=None,
+                     get_node_bulk_method=None,
+                     cache=None):
     """Evaluates an outputs definition containing intrinsic functions.
 
     :param outputs_def: Outputs definition.
     :param get_node_instances_method: A method for getting node instances.
     :param get_node_instance_method: A method for getting a node instance.
     :param get_node_method: A method for getting a node.
+    :param get_node_instances_bulk_method: A method for getting the node
+                                           instances of several nodes.
+    :param get_node_instance_bulk_method: A method for getting several node
+                                          instances.
+    :param get_node_bulk_method: A method for getting several nodes.
+    :param cache: A ``RuntimeEvaluationCache`` shared between evaluations.
     :return: Outputs dict.
     """
     outputs = dict((k, v['value']) for k, v in outputs_def.iteritems())
@@ -589,7 +951,230 @@ def evaluate_outputs(outputs_def,
         context={},
         get_node_instances_method=get_node_instances_method,
         get_node_instance_method=get_node_instance_method,
-        get_node_method=get_node_method)
+        get_node_method=get_node_method,
+        get_node_instances_bulk_method=get_node_instances_bulk_method,
+        get_node_instance_bulk_method=get_node_instance_bulk_method,
+        get_node_bulk_method=get_node_bulk_method,
+        cache=cache)
+
+
+def evaluate_outputs_batch(deployments_outputs, max_workers=None):
+    """Evaluates the outputs of many deployments.
+
+    Identical outputs definitions are compiled once and evaluated using a
+    shared ``EvaluationTemplate``. Errors are isolated per deployment, so
+    one failing deployment does not fail the whole batch.
+
+    :param deployments_outputs: A dict from deployment id to a tuple of
+                                (outputs definition,
+                                 ``RuntimeEvaluationStorage``).
+    :param max_workers: Number of threads to evaluate with. Useful when the
+                        storage methods are I/O bound. By default,
+                        deployments are evaluated serially.
+    :return: A dict from deployment id to a dict with either the evaluated
+             'outputs' or the 'error' raised while evaluating them.
+    """
+    templates = {}
+
+    def compile_outputs(outputs_def):
+        try:
+            key = json.dumps(outputs_def, sort_keys=True)
+        except (TypeError, ValueError):
+            key = None
+        template = templates.get(key) if key is not None else None
+        if template is None:
+            template = compile_evaluation_template(
+                dict((k, v['value']) for k, v in outputs_def.iteritems()))
+            if key is not None:
+                templates[key] = template
+        return template
+
+    def evaluate(item):
+        deployment_id, (outputs_def, storage) = item
+        try:
+            template = compile_outputs(outputs_def)
+            outputs = template.evaluate(storage, context={})
+        except Exception as e:
+            return deployment_id, {'outputs': None, 'error': e}
+        return deployment_id, {'outputs': outputs, 'error': None}
+
+    items = deployments_outputs.items()
+    if not max_workers or max_workers <= 1:
+        return dict(evaluate(item) for item in items)
+
+    # compile up front, so threads only share read only templates
+    for _, (outputs_def, _) in items:
+        try:
+            compile_outputs(outputs_def)
+        except Exception:
+            # reported per deployment by evaluate()
+            pass
+    # worker threads see the overlays of the calling thread
+    overlay_functions = getattr(_overlays, 'functions', None)
+
+    def evaluate_in_worker(item):
+        with overlay(overlay_functions):
+            return evaluate(item)
+
+    pool = ThreadPool(max_workers)
+    try:
+        return dict(pool.map(evaluate_in_worker, items))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _prefetch(storage, payload, context):
+    """Prefetch, in bulk, everything the payload functions may reference."""
+    if not storage.supports_prefetch:
+        return
+    node_ids, context_keys = _runtime_reference_keys(payload, context)
+    storage.prefetch(
+        node_ids=node_ids,
+        node_instance_ids=_context_node_instance_ids(context, context_keys))
+
+
+def _runtime_reference_keys(payload, context=None):
+    """Node ids and context keys the payload functions may reference.
+    See GetAttribute.runtime_reference_keys."""
+    node_ids = set()
+    context_keys = set()
+
+    def handler(v, scope, context, path):
+        func = parse(v, scope=scope, context=context, path=path)
+        if isinstance(func, GetAttribute):
+            func_node_ids, func_context_keys = func.runtime_reference_keys()
+            node_ids.update(func_node_ids)
+            context_keys.update(func_context_keys)
+        return v
+
+    scan.scan_properties(payload, handler, context=context)
+    return node_ids, context_keys
+
+
+def _context_node_instance_ids(context, context_keys):
+    node_instance_ids = set(context.get(key) for key in context_keys)
+    node_instance_ids.discard(None)
+    return node_instance_ids
+
+
+class EvaluationTemplate(object):
+    """A payload compiled for repeated runtime evaluation.
+
+    Compiling a payload records the location of every intrinsic function
+    in it (the function slots) once, so that subsequent evaluations only
+    need to copy the payload containers and evaluate the slots, instead of
+    re-scanning and re-parsing every value in the payload.
+
+    Templates are reusable (evaluating a template does not modify it) and
+    can be serialized using ``serialize`` and ``deserialize``.
+    """
+
+    def __init__(self, payload, slots):
+        self._payload = payload
+        self._slots = slots
+        # what the functions reference is recorded once, and prefetched
+        # using the context of each evaluation
+        self._node_ids, self._context_keys = _runtime_reference_keys(
+            list(self._raw_functions()))
+
+    @property
+    def slots(self):
+        """List of (key path, context path) tuples, one per function."""
+        return self._slots
+
+    def evaluate(self, storage, context=None):
+        """Evaluate the template functions.
+
+        :param storage: A ``RuntimeEvaluationStorage`` used during
+                        evaluation.
+        :param context: Context used during evaluation.
+        :return: A new payload in which all functions were evaluated.
+        """
+        context = context if context is not None else {}
+        if storage.supports_prefetch:
+            storage.prefetch(
+                node_ids=self._node_ids,
+                node_instance_ids=_context_node_instance_ids(
+                    context, self._context_keys))
+        handler = _handler('evaluate_runtime', storage=storage)
+        result = _copy_containers(self._payload)
+        for keys, path in self._slots:
+            container = result
+            for key in keys[:-1]:
+                container = container[key]
+            key = keys[-1]
+            container[key] = handler(container[key],
+                                     scope=None,
+                                     context=context,
+                                     path=path)
+        return result
+
+    def _raw_functions(self):
+        for keys, _ in self._slots:
+            value = self._payload
+            for key in keys:
+                value = value[key]
+            yield value
+
+    def serialize(self):
+        return {
+            'payload': self._payload,
+            'slots': [{'keys': list(keys), 'path': path}
+                      for keys, path in self._slots]
+        }
+
+    @classmethod
+    def deserialize(cls, data):
+        return cls(payload=data['payload'],
+                   slots=[(tuple(slot['keys']), slot['path'])
+                          for slot in data['slots']])
+
+
+def compile_evaluation_template(payload, path='payload'):
+    """Compile a payload containing intrinsic functions into a template.
+
+    :param payload: The payload to compile (dict/list). It is copied, so
+                    later changes to it do not affect the template.
+    :param path: The payload base path (used in evaluation errors).
+    :return: An ``EvaluationTemplate``.
+    """
+    payload = _copy_containers(payload)
+    slots = []
+
+    def collect(value, keys, current_path):
+        if isinstance(value, dict):
+            items = ((k, v, '{0}.{1}'.format(current_path, k), None)
+                     for k, v in value.iteritems())
+        elif isinstance(value, list):
+            # child paths of list items mimic scan.scan_properties
+            items = ((index, item, '{0}[{1}]'.format(current_path, index),
+                      current_path)
+                     for index, item in enumerate(value))
+        else:
+            return
+        for key, item, item_path, child_path in items:
+            item_keys = keys + (key,)
+            if _is_function(item):
+                slots.append((item_keys, item_path))
+            else:
+                collect(item, item_keys, child_path or item_path)
+
+    collect(payload, (), path)
+    return EvaluationTemplate(payload=payload, slots=slots)
+
+
+def _is_function(value):
+    return (isinstance(value, dict) and len(value) == 1 and
+            get_function(value.keys()[0]) is not None)
+
+
+def _copy_containers(value):
+    if isinstance(value, dict):
+        return dict((k, _copy_containers(v)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        return [_copy_containers(item) for item in value]
+    return value
 
 
 def _handler(evaluator, **evaluator_kwargs):
@@ -18,7 +18,7 @@ import contextlib
 import urllib2
 
 import requests
-from retrying import retry
+from retrying import RetryError, retry
 
 from dsl_parser import exceptions
 
@@ -42,13 +42,31 @@ class AbstractImportResolver(object):
         raise NotImplementedError
 
     def fetch_import(self, import_url):
-        url_parts = import_url.split(':')
-        if url_parts[0] in ['http', 'https', 'ftp', 'file']:
+        if _is_url(import_url):
             return self.resolve(import_url)
         return read_import(import_url)
 
+    def probe_import(self, import_url):
+        """
+        Fetch an import which may not exist (e.g. a candidate location of a
+        relative import), making a single attempt to fetch it.
 
-def read_import(import_url):
+        Urls are resolved using resolve, so resolvers retrying failed
+        attempts should override this method.
+
+        :raises DSLParsingLogicException: (or IOError) if the import could
+         not be fetched.
+        """
+        if _is_url(import_url):
+            return self.resolve(import_url)
+        return read_import(import_url, retries=0)
+
+
+def _is_url(import_url):
+    return import_url.split(':')[0] in ['http', 'https', 'ftp', 'file']
+
+
+def read_import(import_url, retries=MAX_NUMBER_RETRIES):
     error_str = 'Import failed: Unable to open import url'
     if import_url.startswith('file:'):
         try:
@@ -59,7 +77,7 @@ def read_import(import_url):
                 13, '{0} {1}; {2}'.format(error_str, import_url, ex))
             raise ex
     else:
-        number_of_attempts = MAX_NUMBER_RETRIES + 1
+        number_of_attempts = retries + 1
 
         # Defines on which errors we should retry the import.
         def _is_recoverable_error(e):
@@ -92,7 +110,11 @@ def read_import(import_url):
                 raise invalid_url_err
 
         try:
-            import_result = get_import()
+            try:
+                import_result = get_import()
+            except RetryError as err:
+                # all attempts ended with an internal server error
+                import_result = err.last_attempt.value
             # If the error is an internal error only. A custom exception should
             # be raised.
             if _is_internal_error(import_result):
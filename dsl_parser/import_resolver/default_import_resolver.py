@@ -15,7 +15,10 @@
 from dsl_parser.exceptions import DSLParsingLogicException
 
 from dsl_parser.import_resolver.abstract_import_resolver \
-    import AbstractImportResolver, read_import
+    import (AbstractImportResolver,
+            MAX_NUMBER_RETRIES,
+            _is_url,
+            read_import)
 
 DEFAULT_RULES = []
 DEFAULT_RESLOVER_RULES_KEY = 'rules'
@@ -76,10 +79,19 @@ class DefaultImportResolver(AbstractImportResolver):
         # set the rules
         self.rules = rules
         if self.rules is None:
-            self.rules = DEFAULT_RULES
+            # copied, so resolvers never share (and modify) the same rules
+            self.rules = list(DEFAULT_RULES)
         self._validate_rules()
 
     def resolve(self, import_url):
+        return self._resolve(import_url, retries=MAX_NUMBER_RETRIES)
+
+    def probe_import(self, import_url):
+        if not _is_url(import_url):
+            return super(DefaultImportResolver, self).probe_import(import_url)
+        return self._resolve(import_url, retries=0)
+
+    def _resolve(self, import_url, retries):
         failed_urls = {}
         # trying to find a matching rule that can resolve this url
         for rule in self.rules:
@@ -94,7 +106,7 @@ class DefaultImportResolver(AbstractImportResolver):
                 if url_to_resolve not in failed_urls.keys():
                     # there is no point to try to resolve the same url twice
                     try:
-                        return read_import(url_to_resolve)
+                        return read_import(url_to_resolve, retries=retries)
                     except DSLParsingLogicException, ex:
                         # failed to resolve current rule,
                         # continue to the next one
@@ -103,7 +115,7 @@ class DefaultImportResolver(AbstractImportResolver):
         # failed to resolve the url using the rules
         # trying to open the original url
         try:
-            return read_import(import_url)
+            return read_import(import_url, retries=retries)
         except DSLParsingLogicException, ex:
             if not self.rules:
                 raise
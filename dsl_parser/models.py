@@ -13,6 +13,10 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import weakref
+
+from yaml import representer
+
 
 class Version(dict):
 
@@ -52,3 +56,73 @@ class Plan(dict):
     @property
     def node_templates(self):
         return self['nodes']
+
+
+class TypeHierarchy(list):
+    """
+    An immutable type hierarchy, listing the names of a type's ancestors
+    followed by the type name itself. Hierarchies are interned (see
+    ``TypeHierarchy.of``) and copying returns the same instance, so types,
+    node templates, relationships and node instances of the same type all
+    share a single hierarchy. Membership tests take constant time.
+    Being a list, a hierarchy compares as a plain list, and it is
+    serialized (JSON, YAML and pickle) as a plain list.
+    """
+
+    __slots__ = ('_types', '__weakref__')
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self, types=()):
+        super(TypeHierarchy, self).__init__(types)
+        self._types = frozenset(self)
+
+    @classmethod
+    def of(cls, types):
+        """
+        :param types: The type names, from the base type to the type itself.
+        :return: The interned hierarchy of these type names.
+        """
+        types = tuple(types)
+        hierarchy = cls._interned.get(types)
+        if hierarchy is None:
+            hierarchy = cls._interned.setdefault(types, cls(types))
+        return hierarchy
+
+    def __contains__(self, item):
+        try:
+            return item in self._types
+        except TypeError:
+            # unhashable items are not type names
+            return False
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # pickled plans hold plain lists, not references to this class
+        return list, (list(self),)
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("'{0}' object is immutable"
+                        .format(type(self).__name__))
+
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _immutable
+    __iadd__ = __imul__ = _immutable
+
+
+def _represent_type_hierarchy(dumper, hierarchy):
+    # shared hierarchies are written in full, as separate lists were, instead
+    # of as yaml aliases
+    dumper.alias_key = None
+    return dumper.represent_list(list(hierarchy))
+
+
+# the safe and the default yaml representers keep separate registries
+representer.SafeRepresenter.add_representer(TypeHierarchy,
+                                            _represent_type_hierarchy)
+representer.Representer.add_representer(TypeHierarchy,
+                                        _represent_type_hierarchy)
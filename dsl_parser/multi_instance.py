@@ -21,29 +21,89 @@ from dsl_parser import (models,
                         constants)
 
 
-def create_deployment_plan(plan):
+def create_deployment_plan(plan,
+                           node_instance_id_generator=None,
+                           processes=None):
     """
     Expand node instances based on number of instances to deploy and
     defined relationships
+
+    :param node_instance_id_generator: A rel_graph.NodeInstanceIdGenerator
+     used for generating node instance ids. Defaults to random ids.
+    :param processes: Expand independent contained-in trees using a pool
+     of this many processes. See rel_graph.build_deployment_node_graph.
     """
     deployment_plan = copy.deepcopy(plan)
-    plan_node_graph = rel_graph.build_node_graph(
-        nodes=deployment_plan['nodes'],
-        scaling_groups=deployment_plan['scaling_groups'])
+    deployment_plan[constants.NODE_INSTANCES] = list(
+        iter_deployment_node_instances(
+            deployment_plan,
+            node_instance_id_generator=node_instance_id_generator,
+            processes=processes))
+    return models.Plan(deployment_plan)
+
+
+def iter_deployment_node_instances(plan,
+                                   node_instance_id_generator=None,
+                                   processes=None):
+    """
+    Expand node instances like create_deployment_plan does, yielding them
+    one at a time (with their relationship instances), without copying the
+    plan or building the node instances list. This allows persisting the
+    node instances of large deployments in chunks as they are yielded.
+
+    Node instances are yielded in the order they were expanded in: each
+    contained-in tree at a time, with node instances following the node
+    instance containing them.
+
+    :param plan: The plan to expand node instances for. It is not modified.
+    :param node_instance_id_generator: A rel_graph.NodeInstanceIdGenerator
+     used for generating node instance ids. Defaults to random ids.
+    :param processes: Expand independent contained-in trees using a pool
+     of this many processes. See rel_graph.build_deployment_node_graph.
+    """
+    plan_node_graph = _build_plan_node_graph(plan)
     deployment_node_graph, ctx = rel_graph.build_deployment_node_graph(
-        plan_node_graph)
-    node_instances = rel_graph.extract_node_instances(
+        plan_node_graph,
+        node_instance_id_generator=node_instance_id_generator,
+        processes=processes)
+    return rel_graph.iter_node_instances(
         node_instances_graph=deployment_node_graph,
-        ctx=ctx)
-    deployment_plan[constants.NODE_INSTANCES] = node_instances
-    return models.Plan(deployment_plan)
+        ctx=ctx,
+        node_instance_ids=ctx.ordered_node_instance_ids)
+
+
+def estimate_deployment_plan(plan, modified_nodes=None):
+    """
+    Count the node instances and relationship instances of a deployment
+    plan (optionally, after modifying it), without expanding them.
+    See rel_graph.estimate_deployment_node_graph.
+
+    :param plan: A plan, or a deployment (its nodes and scaling groups).
+    :param modified_nodes: existing nodes whose instance number has changed,
+     as passed to modify_deployment.
+    """
+    return rel_graph.estimate_deployment_node_graph(
+        _build_plan_node_graph(plan),
+        modified_nodes=modified_nodes)
+
+
+def _build_plan_node_graph(plan):
+    # building the node graph replaces relationships of scaling group
+    # members, so these are copied
+    nodes = [dict(node, relationships=[dict(relationship) for relationship
+                                       in node.get('relationships', [])])
+             for node in plan['nodes']]
+    return rel_graph.build_node_graph(
+        nodes=nodes,
+        scaling_groups=plan['scaling_groups'])
 
 
 def modify_deployment(nodes,
                       previous_nodes,
                       previous_node_instances,
                       modified_nodes,
-                      scaling_groups):
+                      scaling_groups,
+                      node_instance_id_generator=None):
     """
     modifies deployment according to the expected nodes. based on
     previous_node_instances
@@ -51,6 +111,10 @@ def modify_deployment(nodes,
     :param previous_node_instances:
     :param modified_nodes: existing nodes whose instance number has changed
      Add a line note
+    :param node_instance_id_generator: A rel_graph.NodeInstanceIdGenerator
+     used for generating new node instance ids. Defaults to random ids.
+     Pass the generator (or restore its state) used for the deployment's
+     previous expansions, so ids of removed instances are not reissued.
     :return: a dict of add,extended,reduced and removed instances
      Add a line note
     """
@@ -69,44 +133,233 @@ def modify_deployment(nodes,
         plan_node_graph=plan_node_graph,
         previous_deployment_node_graph=previous_deployment_node_graph,
         previous_deployment_contained_graph=previous_deployment_contained_graph,  # noqa
-        modified_nodes=modified_nodes)
+        modified_nodes=modified_nodes,
+        node_instance_id_generator=node_instance_id_generator)
 
-    # Any node instances which were added or removed
-    added_and_related = rel_graph.extract_added_node_instances(
-        previous_deployment_node_graph, new_deployment_node_graph,
-        ctx=ctx)
-    removed_and_related = rel_graph.extract_removed_node_instances(
-        previous_deployment_node_graph, new_deployment_node_graph,
+    return rel_graph.extract_modified_node_instances(
+        previous_deployment_node_graph=previous_deployment_node_graph,
+        new_deployment_node_graph=new_deployment_node_graph,
         ctx=ctx)
 
-    # Any node instances which had a modification to their relationship.
-    # (newly introduced and removed nodes)
-    extended_and_related = rel_graph.extract_added_relationships(
-        previous_deployment_node_graph, new_deployment_node_graph,
-        ctx=ctx)
-    reduced_and_related = rel_graph.extract_removed_relationships(
-        previous_deployment_node_graph, new_deployment_node_graph,
-        ctx=ctx)
 
-    # The extracted extended and reduced relationships hold the new and old
-    # node instances. These are not required, since the change is on
-    # node instance level (and not the relationship level)
-    extended_and_related = \
-        filter_out_node_instances(added_and_related, extended_and_related)
-    reduced_and_related = \
-        filter_out_node_instances(removed_and_related, reduced_and_related)
+class DeploymentGraph(object):
+    """
+    The node instances of a deployment, kept along with the graph
+    modify_deployment would otherwise rebuild from them on each call.
+
+    Build it once (from_plan, or from an existing deployment), then call
+    modify for each scale operation. The returned modification is the same
+    one modify_deployment returns, and it is applied to the deployment
+    graph in place, so the next modification starts from it without
+    rebuilding the previous deployment graph from all node instances.
+    The state can be stored using serialize and loaded using deserialize,
+    including the state of the node instance id generator.
+
+    Note that modify still expands the contained-in trees of the whole
+    deployment (as modify_deployment does), so its cost remains linear in
+    the total number of node instances.
+    """
+
+    def __init__(self,
+                 nodes,
+                 node_instances,
+                 scaling_groups,
+                 node_instance_id_generator=None):
+        """
+        :param nodes: The deployment nodes.
+        :param node_instances: The current node instances of the deployment.
+        :param scaling_groups: The deployment scaling groups.
+        :param node_instance_id_generator: A rel_graph.NodeInstanceIdGenerator
+         used for generating new node instance ids. Defaults to random ids.
+        """
+        self._nodes = copy.deepcopy(nodes)
+        self._scaling_groups = copy.deepcopy(scaling_groups)
+        self._node_instances = dict(
+            (node_instance['id'], node_instance)
+            for node_instance in copy.deepcopy(node_instances))
+        self.node_instance_id_generator = node_instance_id_generator
+        plan_node_graph = self._build_plan_node_graph()
+        self._graph, self._contained_graph = \
+            rel_graph.build_previous_deployment_node_graph(
+                plan_node_graph=plan_node_graph,
+                previous_node_instances=copy.deepcopy(node_instances))
+        _restore_nodes(self._nodes)
+
+    @classmethod
+    def from_plan(cls, plan, node_instance_id_generator=None):
+        """
+        :param plan: A deployment plan, as returned by
+         create_deployment_plan.
+        """
+        return cls(nodes=plan['nodes'],
+                   node_instances=plan[constants.NODE_INSTANCES],
+                   scaling_groups=plan['scaling_groups'],
+                   node_instance_id_generator=node_instance_id_generator)
+
+    @property
+    def node_instances(self):
+        return copy.deepcopy(self._node_instances.values())
+
+    def modify(self, modified_nodes):
+        """
+        Modify the deployment and update the deployment graph accordingly.
+
+        :param modified_nodes: existing nodes (and scaling groups) whose
+         instance number has changed, as in modify_deployment.
+        :return: a dict of add,extended,reduced and removed instances
+        :raises ValueError: if modified_nodes holds an unknown node or
+         scaling group. The deployment graph is left unchanged.
+        """
+        # the state is only updated once the modification is built
+        nodes, scaling_groups = self._updated_instances_num(modified_nodes)
+        plan_node_graph = self._build_plan_node_graph()
+        new_deployment_node_graph, ctx = rel_graph.build_deployment_node_graph(
+            plan_node_graph=plan_node_graph,
+            previous_deployment_node_graph=self._graph,
+            previous_deployment_contained_graph=self._contained_graph,
+            modified_nodes=modified_nodes,
+            node_instance_id_generator=self.node_instance_id_generator)
+        modification = rel_graph.extract_modified_node_instances(
+            previous_deployment_node_graph=self._graph,
+            new_deployment_node_graph=new_deployment_node_graph,
+            ctx=ctx)
+        self._apply_modification(modification, plan_node_graph)
+        self._nodes = nodes
+        self._scaling_groups = scaling_groups
+        return modification
+
+    def serialize(self):
+        generator = self.node_instance_id_generator
+        return {
+            'nodes': copy.deepcopy(self._nodes),
+            'scaling_groups': copy.deepcopy(self._scaling_groups),
+            constants.NODE_INSTANCES: self.node_instances,
+            'node_instance_id_generator_state': (
+                generator.get_state() if generator else None)
+        }
+
+    @classmethod
+    def deserialize(cls, data, node_instance_id_generator=None):
+        """
+        :param node_instance_id_generator: A rel_graph.NodeInstanceIdGenerator
+         of the same type as the one the state was serialized with. The
+         serialized generator state is restored into it.
+        """
+        generator_state = data.get('node_instance_id_generator_state')
+        if node_instance_id_generator and generator_state is not None:
+            node_instance_id_generator.set_state(generator_state)
+        return cls(nodes=data['nodes'],
+                   node_instances=data[constants.NODE_INSTANCES],
+                   scaling_groups=data['scaling_groups'],
+                   node_instance_id_generator=node_instance_id_generator)
+
+    def _build_plan_node_graph(self):
+        return rel_graph.build_node_graph(
+            nodes=self._nodes,
+            scaling_groups=self._scaling_groups)
+
+    def _apply_modification(self, modification, plan_node_graph):
+        # build_node_graph replaces the contained_in relationships of scaling
+        # group members, building the deployment node graph restores them.
+        # The plan node graph edges still point at the scaling groups, which
+        # is what the previous deployment graph expects.
+        removed = _modified(modification['removed_and_related'], 'removed')
+        rel_graph.remove_previous_node_instances(
+            self._graph, self._contained_graph, removed)
+        for node_instance in removed:
+            del self._node_instances[node_instance['id']]
+
+        added = _modified(modification['added_and_related'], 'added')
+        added_graph_node_instances = []
+        for node_instance in added:
+            self._node_instances[node_instance['id']] = node_instance
+            graph_node_instance = copy.deepcopy(node_instance)
+            rel_graph.add_previous_node_instance(
+                self._graph, self._contained_graph, graph_node_instance)
+            added_graph_node_instances.append(graph_node_instance)
+        for graph_node_instance in added_graph_node_instances:
+            rel_graph.add_previous_node_instance_relationships(
+                self._graph, self._contained_graph, plan_node_graph,
+                graph_node_instance)
+
+        for node_instance in _modified(
+                modification['extended_and_related'], 'extended'):
+            node_instance_id = node_instance['id']
+            relationships = self._node_instances[node_instance_id][
+                'relationships']
+            graph_relationships = self._graph.node[node_instance_id][
+                'node']['relationships']
+            for relationship in node_instance['relationships']:
+                relationships.append(relationship)
+                graph_relationship = copy.deepcopy(relationship)
+                graph_relationships.append(graph_relationship)
+                self._graph.add_edge(node_instance_id,
+                                     relationship['target_id'],
+                                     relationship=graph_relationship,
+                                     index=len(graph_relationships) - 1)
+
+        for node_instance in _modified(
+                modification['reduced_and_related'], 'reduced'):
+            node_instance_id = node_instance['id']
+            reduced = set((r['target_id'], r['type'])
+                          for r in node_instance['relationships'])
+            for relationships in [
+                    self._node_instances[node_instance_id]['relationships'],
+                    self._graph.node[node_instance_id]['node'][
+                        'relationships']]:
+                relationships[:] = [
+                    r for r in relationships
+                    if (r['target_id'], r['type']) not in reduced]
+            for target_id, _ in reduced:
+                if self._graph.has_edge(node_instance_id, target_id):
+                    self._graph.remove_edge(node_instance_id, target_id)
+
+    def _updated_instances_num(self, modified_nodes):
+        nodes = copy.deepcopy(self._nodes)
+        scaling_groups = copy.deepcopy(self._scaling_groups)
+        nodes_by_id = dict((node['id'], node) for node in nodes)
+        unknown = [node_id for node_id in modified_nodes
+                   if node_id not in nodes_by_id and
+                   node_id not in scaling_groups]
+        if unknown:
+            raise ValueError('Unknown nodes or scaling groups modified: '
+                             '{0}'.format(', '.join(sorted(unknown))))
+        for node_id, modified_node in modified_nodes.items():
+            instances = modified_node['instances']
+            if node_id in scaling_groups:
+                scaling_groups[node_id]['properties'][
+                    'current_instances'] = instances
+                continue
+            node = nodes_by_id[node_id]
+            if 'capabilities' in node:
+                node['capabilities']['scalable']['properties'][
+                    'current_instances'] = instances
+            else:
+                node['number_of_instances'] = instances
+        return nodes, scaling_groups
+
+
+def _modified(node_instances, modification):
+    result = []
+    for node_instance in node_instances:
+        if node_instance.get('modification') == modification:
+            node_instance = copy.deepcopy(node_instance)
+            del node_instance['modification']
+            result.append(node_instance)
+    return result
+
 
-    return {
-        'added_and_related': added_and_related,
-        'extended_and_related': extended_and_related,
-        'reduced_and_related': reduced_and_related,
-        'removed_and_related': removed_and_related
-    }
+def _restore_nodes(nodes):
+    for node in nodes:
+        for relationship in node.get('relationships', []):
+            replaced = relationship.pop('replaced', None)
+            if replaced:
+                relationship['target_id'] = replaced
 
 
 def filter_out_node_instances(node_instances_to_filter_out,
                               base_node_instances):
-    instance_ids_to_remove = [n['id'] for n in node_instances_to_filter_out
-                              if 'modification' in n]
+    instance_ids_to_remove = set(n['id'] for n in node_instances_to_filter_out
+                                 if 'modification' in n)
     return [n for n in base_node_instances
             if n['id'] not in instance_ids_to_remove]
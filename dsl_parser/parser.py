@@ -19,7 +19,8 @@ import urllib2
 from dsl_parser import (functions,
                         utils)
 from dsl_parser.framework import parser
-from dsl_parser.elements import blueprint
+from dsl_parser.elements import (blueprint,
+                                 operation)
 from dsl_parser.import_resolver.default_import_resolver import \
     DefaultImportResolver
 
@@ -28,7 +29,11 @@ def parse_from_path(dsl_file_path,
                     resources_base_url=None,
                     resolver=None,
                     validate_version=True,
-                    additional_resource_sources=()):
+                    additional_resource_sources=(),
+                    resource_manifest=None,
+                    imports_cache=None,
+                    share_operations=False,
+                    template_functions=None):
     with open(dsl_file_path, 'r') as f:
         dsl_string = f.read()
     return _parse(dsl_string,
@@ -36,14 +41,22 @@ def parse_from_path(dsl_file_path,
                   dsl_location=dsl_file_path,
                   resolver=resolver,
                   validate_version=validate_version,
-                  additional_resource_sources=additional_resource_sources)
+                  additional_resource_sources=additional_resource_sources,
+                  resource_manifest=resource_manifest,
+                  imports_cache=imports_cache,
+                  share_operations=share_operations,
+                  template_functions=template_functions)
 
 
 def parse_from_url(dsl_url,
                    resources_base_url=None,
                    resolver=None,
                    validate_version=True,
-                   additional_resource_sources=()):
+                   additional_resource_sources=(),
+                   resource_manifest=None,
+                   imports_cache=None,
+                   share_operations=False,
+                   template_functions=None):
     try:
         with contextlib.closing(urllib2.urlopen(dsl_url)) as f:
             dsl_string = f.read()
@@ -60,17 +73,29 @@ def parse_from_url(dsl_url,
                   dsl_location=dsl_url,
                   resolver=resolver,
                   validate_version=validate_version,
-                  additional_resource_sources=additional_resource_sources)
+                  additional_resource_sources=additional_resource_sources,
+                  resource_manifest=resource_manifest,
+                  imports_cache=imports_cache,
+                  share_operations=share_operations,
+                  template_functions=template_functions)
 
 
 def parse(dsl_string,
           resources_base_url=None,
           resolver=None,
-          validate_version=True):
+          validate_version=True,
+          resource_manifest=None,
+          imports_cache=None,
+          share_operations=False,
+          template_functions=None):
     return _parse(dsl_string,
                   resources_base_url=resources_base_url,
                   resolver=resolver,
-                  validate_version=validate_version)
+                  validate_version=validate_version,
+                  resource_manifest=resource_manifest,
+                  imports_cache=imports_cache,
+                  share_operations=share_operations,
+                  template_functions=template_functions)
 
 
 def _parse(dsl_string,
@@ -78,51 +103,62 @@ def _parse(dsl_string,
            dsl_location=None,
            resolver=None,
            validate_version=True,
-           additional_resource_sources=()):
-    parsed_dsl_holder = utils.load_yaml(raw_yaml=dsl_string,
-                                        error_message='Failed to parse DSL',
-                                        filename=dsl_location)
-
-    if not resolver:
-        resolver = DefaultImportResolver()
-
-    # validate version schema and extract actual version used
-    result = parser.parse(
-        parsed_dsl_holder,
-        element_cls=blueprint.BlueprintVersionExtractor,
-        inputs={
-            'validate_version': validate_version
-        },
-        strict=False)
-    version = result['plan_version']
-
-    # handle imports
-    result = parser.parse(
-        value=parsed_dsl_holder,
-        inputs={
-            'main_blueprint_holder': parsed_dsl_holder,
-            'resources_base_url': resources_base_url,
-            'blueprint_location': dsl_location,
-            'version': version,
-            'resolver': resolver,
-            'validate_version': validate_version
-        },
-        element_cls=blueprint.BlueprintImporter,
-        strict=False)
-    resource_base = [result['resource_base']]
-    if additional_resource_sources:
-        resource_base.extend(additional_resource_sources)
-
-    merged_blueprint_holder = result['merged_blueprint']
-
-    # parse blueprint
-    plan = parser.parse(
-        value=merged_blueprint_holder,
-        inputs={
-            'resource_base': resource_base,
-            'validate_version': validate_version
-        },
-        element_cls=blueprint.Blueprint)
-
-    functions.validate_functions(plan)
-    return plan
+           additional_resource_sources=(),
+           resource_manifest=None,
+           imports_cache=None,
+           share_operations=False,
+           template_functions=None):
+    # template functions are only visible to this parse (and thread)
+    with functions.overlay(template_functions):
+        parsed_dsl_holder = utils.load_yaml(
+            raw_yaml=dsl_string,
+            error_message='Failed to parse DSL',
+            filename=dsl_location)
+
+        if not resolver:
+            resolver = DefaultImportResolver()
+
+        # validate version schema and extract actual version used
+        result = parser.parse(
+            parsed_dsl_holder,
+            element_cls=blueprint.BlueprintVersionExtractor,
+            inputs={
+                'validate_version': validate_version
+            },
+            strict=False)
+        version = result['plan_version']
+
+        # handle imports
+        result = parser.parse(
+            value=parsed_dsl_holder,
+            inputs={
+                'main_blueprint_holder': parsed_dsl_holder,
+                'resources_base_url': resources_base_url,
+                'blueprint_location': dsl_location,
+                'version': version,
+                'resolver': resolver,
+                'validate_version': validate_version,
+                'imports_cache': imports_cache
+            },
+            element_cls=blueprint.BlueprintImporter,
+            strict=False)
+        resource_base = [result['resource_base']]
+        if additional_resource_sources:
+            resource_base.extend(additional_resource_sources)
+
+        merged_blueprint_holder = result['merged_blueprint']
+
+        # parse blueprint
+        plan = parser.parse(
+            value=merged_blueprint_holder,
+            inputs={
+                'resource_base': resource_base,
+                'resources': operation.Resources(manifest=resource_manifest),
+                'shared_operations': (operation.SharedOperations()
+                                      if share_operations else None),
+                'validate_version': validate_version
+            },
+            element_cls=blueprint.Blueprint)
+
+        functions.validate_functions(plan)
+        return plan
@@ -15,6 +15,9 @@
 
 import copy
 import collections
+import hashlib
+import multiprocessing
+import random
 from random import choice
 from string import ascii_lowercase, digits
 
@@ -115,88 +118,132 @@ def build_previous_deployment_node_graph(plan_node_graph,
     graph = nx.DiGraph()
     contained_graph = nx.DiGraph()
     for node_instance in previous_node_instances:
-        node_instance_id = node_instance['id']
-        node_instance_host_id = node_instance.get('host_id')
-        graph.add_node(node_instance_id,
-                       node=node_instance)
-        contained_graph.add_node(node_instance_id,
-                                 node=node_instance)
-        scaling_groups = node_instance.get('scaling_groups') or ()
-        for scaling_group in scaling_groups:
-            group_id = scaling_group['id']
-            group_name = scaling_group['name']
-            node = {'id': group_id, 'name': group_name, 'group': True}
-            if node_instance_host_id:
-                node['host_id'] = node_instance_host_id
-            graph.add_node(group_id, node=node)
-            contained_graph.add_node(group_id, node=node)
-
+        add_previous_node_instance(graph, contained_graph, node_instance)
     for node_instance in previous_node_instances:
-        node_instance_id = node_instance['id']
-        node_id = _node_id_from_node_instance(node_instance)
-        scaling_groups = node_instance.get('scaling_groups')
-        contained_in_target_id = None
-        contained_in_target_name = None
-        for index, rel in enumerate(node_instance.get('relationships', [])):
-            target_id = rel['target_id']
-            target_name = rel['target_name']
-            # if the original relationship does not exist in the plan node
-            # graph, it means it was a contained_in relationship that was
-            # replaced by a scaling group
-            replaced_contained_in = target_name not in plan_node_graph[node_id]
-            if replaced_contained_in:
-                contained_in_target_id = target_id
-                contained_in_target_name = target_name
-                # for the purpose of containment, only the first group
-                # is relevant
-                scaling_group = scaling_groups[0]
-                rel['target_id'] = scaling_group['id']
-                rel['target_name'] = scaling_group['name']
-                rel['replaced'] = True
-                graph.add_edge(node_instance_id, scaling_group['id'],
-                               relationship=rel,
-                               index=index)
-                contained_graph.add_edge(node_instance_id, scaling_group['id'])
-            else:
-                graph.add_edge(node_instance_id, target_id,
-                               relationship=rel,
-                               index=index)
-                if _relationship_type_hierarchy_includes_one_of(
-                    plan_node_graph[node_id][target_name]['relationship'],
-                        [CONTAINED_IN_REL_TYPE]):
-                    contained_graph.add_edge(node_instance_id, target_id)
-
-        if scaling_groups:
-            scaling_groups = scaling_groups[:]
-            if contained_in_target_id:
-                scaling_groups.append({
-                    'id': contained_in_target_id,
-                    'name': contained_in_target_name
-                })
-            else:
-                scaling_groups.insert(0, {
-                    'id': node_instance_id,
-                    'name': node_id
-                })
-            for i in range(len(scaling_groups) - 1):
-                graph.add_edge(
-                    scaling_groups[i]['id'],
-                    scaling_groups[i+1]['id'],
-                    relationship={
-                        'type': GROUP_CONTAINED_IN_REL_TYPE,
-                        'target_id': scaling_groups[i+1]['id'],
-                        'target_name': scaling_groups[i+1]['name']
-                    },
-                    index=-1)
-                contained_graph.add_edge(scaling_groups[i]['id'],
-                                         scaling_groups[i+1]['id'])
+        add_previous_node_instance_relationships(
+            graph, contained_graph, plan_node_graph, node_instance)
     return graph, contained_graph
 
 
+def add_previous_node_instance(graph, contained_graph, node_instance):
+    """Add a node instance (and its scaling group instances) to a previous
+    deployment node graph. Its relationships are added separately by
+    add_previous_node_instance_relationships, once all node instances
+    have been added."""
+    node_instance_id = node_instance['id']
+    node_instance_host_id = node_instance.get('host_id')
+    graph.add_node(node_instance_id,
+                   node=node_instance)
+    contained_graph.add_node(node_instance_id,
+                             node=node_instance)
+    scaling_groups = node_instance.get('scaling_groups') or ()
+    for scaling_group in scaling_groups:
+        group_id = scaling_group['id']
+        group_name = scaling_group['name']
+        node = {'id': group_id, 'name': group_name, 'group': True}
+        if node_instance_host_id:
+            node['host_id'] = node_instance_host_id
+        graph.add_node(group_id, node=node)
+        contained_graph.add_node(group_id, node=node)
+
+
+def add_previous_node_instance_relationships(graph,
+                                             contained_graph,
+                                             plan_node_graph,
+                                             node_instance):
+    node_instance_id = node_instance['id']
+    node_id = _node_id_from_node_instance(node_instance)
+    scaling_groups = node_instance.get('scaling_groups')
+    contained_in_target_id = None
+    contained_in_target_name = None
+    for index, rel in enumerate(node_instance.get('relationships', [])):
+        target_id = rel['target_id']
+        target_name = rel['target_name']
+        # if the original relationship does not exist in the plan node
+        # graph, it means it was a contained_in relationship that was
+        # replaced by a scaling group
+        replaced_contained_in = target_name not in plan_node_graph[node_id]
+        if replaced_contained_in:
+            contained_in_target_id = target_id
+            contained_in_target_name = target_name
+            # for the purpose of containment, only the first group
+            # is relevant
+            scaling_group = scaling_groups[0]
+            rel['target_id'] = scaling_group['id']
+            rel['target_name'] = scaling_group['name']
+            rel['replaced'] = True
+            graph.add_edge(node_instance_id, scaling_group['id'],
+                           relationship=rel,
+                           index=index)
+            contained_graph.add_edge(node_instance_id, scaling_group['id'])
+        else:
+            graph.add_edge(node_instance_id, target_id,
+                           relationship=rel,
+                           index=index)
+            if _relationship_type_hierarchy_includes_one_of(
+                plan_node_graph[node_id][target_name]['relationship'],
+                    [CONTAINED_IN_REL_TYPE]):
+                contained_graph.add_edge(node_instance_id, target_id)
+
+    if scaling_groups:
+        scaling_groups = scaling_groups[:]
+        if contained_in_target_id:
+            scaling_groups.append({
+                'id': contained_in_target_id,
+                'name': contained_in_target_name
+            })
+        else:
+            scaling_groups.insert(0, {
+                'id': node_instance_id,
+                'name': node_id
+            })
+        for i in range(len(scaling_groups) - 1):
+            graph.add_edge(
+                scaling_groups[i]['id'],
+                scaling_groups[i+1]['id'],
+                relationship={
+                    'type': GROUP_CONTAINED_IN_REL_TYPE,
+                    'target_id': scaling_groups[i+1]['id'],
+                    'target_name': scaling_groups[i+1]['name']
+                },
+                index=-1)
+            contained_graph.add_edge(scaling_groups[i]['id'],
+                                     scaling_groups[i+1]['id'])
+
+
+def remove_previous_node_instances(graph, contained_graph, node_instances):
+    """Remove node instances from a previous deployment node graph, along
+    with the scaling group instances left without members."""
+    group_ids = []
+    for node_instance in node_instances:
+        graph.remove_node(node_instance['id'])
+        contained_graph.remove_node(node_instance['id'])
+        scaling_groups = node_instance.get('scaling_groups') or ()
+        group_ids += [(depth, scaling_group['id'])
+                      for depth, scaling_group in enumerate(scaling_groups)]
+    # inner group instances are removed before the groups containing them
+    # are checked
+    group_ids.sort(key=lambda (depth, _): depth)
+    for _, group_id in group_ids:
+        if group_id in graph and not graph.pred[group_id]:
+            graph.remove_node(group_id)
+            contained_graph.remove_node(group_id)
+
+
 def build_deployment_node_graph(plan_node_graph,
                                 previous_deployment_node_graph=None,
                                 previous_deployment_contained_graph=None,
-                                modified_nodes=None):
+                                modified_nodes=None,
+                                node_instance_id_generator=None,
+                                processes=None):
+    """
+    :param processes: When expanding a new deployment (not a modification),
+     expand independent contained-in trees using a pool of this many
+     processes. Each worker process generates ids using a copy of
+     node_instance_id_generator, so with the counter and seeded generators
+     the result is identical to expanding serially (the default). The
+     states of the copies are merged back into node_instance_id_generator.
+    """
 
     _verify_no_unsupported_relationships(plan_node_graph)
 
@@ -206,9 +253,10 @@ def build_deployment_node_graph(plan_node_graph,
         deployment_node_graph=deployment_node_graph,
         previous_deployment_node_graph=previous_deployment_node_graph,
         previous_deployment_contained_graph=previous_deployment_contained_graph,  # noqa
-        modified_nodes=modified_nodes)
+        modified_nodes=modified_nodes,
+        node_instance_id_generator=node_instance_id_generator)
 
-    _handle_contained_in(ctx)
+    _handle_contained_in(ctx, processes=processes)
 
     ctx.node_instance_ids.clear()
     ctx.node_ids_to_node_instance_ids.clear()
@@ -225,16 +273,117 @@ def build_deployment_node_graph(plan_node_graph,
     return deployment_node_graph, ctx
 
 
+def estimate_deployment_node_graph(plan_node_graph, modified_nodes=None):
+    """
+    Count the node instances and relationship instances
+    build_deployment_node_graph would create for a plan node graph, without
+    creating them, in O(plan nodes and relationships).
+
+    The instances number of a node (or scaling group) is multiplied by the
+    instances number of its container, and connected_to/depends_on
+    relationship instances are counted according to their connection type
+    and the scaling group containing both ends.
+
+    :param modified_nodes: existing nodes (and scaling groups) whose
+     instance number has changed, as passed to modify_deployment.
+    :return: a dict with the node_instances and relationship_instances
+     counts, and the instances number of each node (nodes) and scaling
+     group (scaling_groups)
+    """
+    _verify_no_unsupported_relationships(plan_node_graph)
+    modified_nodes = modified_nodes or {}
+    ctx = Context(plan_node_graph=plan_node_graph,
+                  deployment_node_graph=None)
+    contained_graph = ctx.plan_contained_graph
+
+    instances = {}
+    # containers come before the nodes contained in them
+    for node_id in reversed(nx.topological_sort(contained_graph)):
+        if node_id in modified_nodes:
+            instances_num = modified_nodes[node_id]['instances']
+        else:
+            instances_num = plan_node_graph.node[node_id][
+                'scale_properties']['current_instances']
+        for container_id in contained_graph.succ[node_id]:
+            instances_num *= instances[container_id]
+        instances[node_id] = instances_num
+
+    relationship_instances = 0
+    for source, _, edge_data in contained_graph.edges_iter(data=True):
+        if edge_data['relationship']['type'] != GROUP_CONTAINED_IN_REL_TYPE:
+            relationship_instances += instances[source]
+    for source, target, edge_data in ctx.plan_connected_graph.edges_iter(
+            data=True):
+        relationship = edge_data['relationship']
+        connection_type = _verify_and_get_connection_type(relationship)
+        source_instances_num = instances[source]
+        target_instances_num = instances[target]
+        if not source_instances_num or not target_instances_num:
+            continue
+        minimal_containing_group = ctx.minimal_containing_group(
+            node_a=source,
+            node_b=target)
+        if connection_type == ALL_TO_ONE:
+            if minimal_containing_group:
+                raise _unsupported_all_to_one_in_group(
+                    source, target, minimal_containing_group)
+            relationship_instances += source_instances_num
+        elif minimal_containing_group:
+            # sources are only connected to targets in the same group
+            # instance
+            group_instances_num = instances[minimal_containing_group]
+            relationship_instances += (
+                source_instances_num * target_instances_num //
+                group_instances_num)
+        else:
+            relationship_instances += (source_instances_num *
+                                       target_instances_num)
+
+    nodes = {}
+    scaling_groups = {}
+    for node_id, instances_num in instances.iteritems():
+        if plan_node_graph.node[node_id]['node'].get('group'):
+            scaling_groups[node_id] = instances_num
+        else:
+            nodes[node_id] = instances_num
+    return {
+        'node_instances': sum(nodes.values()),
+        'relationship_instances': relationship_instances,
+        'nodes': nodes,
+        'scaling_groups': scaling_groups
+    }
+
+
 def extract_node_instances(node_instances_graph,
                            ctx,
                            copy_instances=False,
                            contained_graph=None):
+    return list(iter_node_instances(node_instances_graph,
+                                    ctx=ctx,
+                                    copy_instances=copy_instances,
+                                    contained_graph=contained_graph))
+
+
+def iter_node_instances(node_instances_graph,
+                        ctx,
+                        copy_instances=False,
+                        contained_graph=None,
+                        node_instance_ids=None):
+    """
+    Yield the node instances of a node instances graph, along with their
+    relationship instances.
+
+    :param node_instance_ids: The order in which node instances are
+     yielded. Defaults to the graph order.
+    """
     contained_graph = contained_graph or ctx.deployment_contained_graph
     added_missing_node_instance_ids = set()
-    node_instances = []
-    for node_instance_id, data in node_instances_graph.nodes_iter(data=True):
+    if node_instance_ids is None:
+        node_instance_ids = node_instances_graph.nodes_iter()
+    for node_instance_id in node_instance_ids:
+        data = node_instances_graph.node[node_instance_id]
         node_instance = data['node']
-        if node_instance.get('group'):
+        if node_instance.get('group') or data.get('excluded'):
             continue
         node_instance_attributes = data.get('node_instance_attributes')
         if copy_instances:
@@ -246,10 +395,17 @@ def extract_node_instances(node_instances_graph,
                 node_instance_id):
             edge_data = node_instances_graph[node_instance_id][
                 target_node_instance_id]
-            relationship_instance = edge_data['relationship']
             relationship_index = edge_data['index']
-            if copy_instances:
-                relationship_instance = copy.deepcopy(relationship_instance)
+            relationship_template = edge_data.get('relationship_template')
+            if relationship_template is not None:
+                relationship_instance = _relationship_instance_from_template(
+                    relationship_template=relationship_template,
+                    target_node_instance_id=target_node_instance_id)
+            else:
+                relationship_instance = edge_data['relationship']
+                if copy_instances:
+                    relationship_instance = copy.deepcopy(
+                        relationship_instance)
             group_rel = (relationship_instance['type'] ==
                          GROUP_CONTAINED_IN_REL_TYPE)
             replaced = relationship_instance.pop('replaced', None)
@@ -285,122 +441,203 @@ def extract_node_instances(node_instances_graph,
                             target_node_instance = copy.deepcopy(
                                 target_node_instance)
                         target_node_instance[RELATIONSHIPS] = []
-                        node_instances.append(target_node_instance)
                         added_missing_node_instance_ids.add(target_id)
+                        yield target_node_instance
             if not group_rel:
                 indexed_relationship_instances.append(
                     (relationship_index, relationship_instance))
         indexed_relationship_instances.sort(key=lambda (index, _): index)
         relationship_instances = [r for _, r in indexed_relationship_instances]
         node_instance[RELATIONSHIPS] = relationship_instances
-        node_instances.append(node_instance)
-    return node_instances
-
+        yield node_instance
 
-def extract_added_node_instances(previous_deployment_node_graph,
-                                 new_deployment_node_graph,
-                                 ctx):
-    added_instances_graph = _graph_diff(
-        new_deployment_node_graph,
-        previous_deployment_node_graph,
-        node_instance_attributes={'modification': 'added'})
-    return extract_node_instances(
-        added_instances_graph,
-        ctx=ctx,
-        copy_instances=True,
-        contained_graph=ctx.deployment_contained_graph)
-
-
-def extract_removed_node_instances(previous_deployment_node_graph,
-                                   new_deployment_node_graph,
-                                   ctx):
-    removed_instances_graph = _graph_diff(
-        previous_deployment_node_graph,
-        new_deployment_node_graph,
-        node_instance_attributes={'modification': 'removed'})
-    return extract_node_instances(
-        removed_instances_graph,
-        ctx=ctx,
-        copy_instances=True,
-        contained_graph=ctx.previous_deployment_contained_graph)
 
+def extract_modified_node_instances(previous_deployment_node_graph,
+                                    new_deployment_node_graph,
+                                    ctx):
+    """
+    Extract the node instances which were added or removed, and the
+    node instances whose relationships were extended or reduced.
 
-def extract_added_relationships(previous_deployment_node_graph,
-                                new_deployment_node_graph,
-                                ctx):
+    Each of the graphs is traversed once, producing both the node instances
+    and the relationships diff.
 
-    modified_instance_graph = _graph_diff_relationships(
+    :return: a dict of added, extended, reduced and removed node instances
+     (and the node instances related to them)
+    """
+    added_instances_graph, extended_instances_graph = _graph_diff(
         new_deployment_node_graph,
         previous_deployment_node_graph,
-        node_instance_attributes={'modification': 'extended'})
-    return extract_node_instances(
-        modified_instance_graph,
-        ctx=ctx,
-        copy_instances=True,
-        contained_graph=ctx.deployment_contained_graph)
-
-
-def extract_removed_relationships(previous_deployment_node_graph,
-                                  new_deployment_node_graph,
-                                  ctx):
-    modified_instance_graph = _graph_diff_relationships(
+        node_instance_attributes={'modification': 'added'},
+        relationships_node_instance_attributes={'modification': 'extended'})
+    removed_instances_graph, reduced_instances_graph = _graph_diff(
         previous_deployment_node_graph,
         new_deployment_node_graph,
-        node_instance_attributes={'modification': 'reduced'})
-    return extract_node_instances(
-        modified_instance_graph,
-        ctx=ctx,
-        copy_instances=True,
-        contained_graph=ctx.previous_deployment_contained_graph)
-
-
-def _graph_diff(G, H, node_instance_attributes):
-    result = nx.DiGraph()
-    for n1, data in G.nodes_iter(data=True):
-        if n1 in H:
-            continue
-        result.add_node(n1, data,
-                        node_instance_attributes=node_instance_attributes)
-        for n2 in G.neighbors_iter(n1):
-            result.add_node(n2, G.node[n2])
-            result.add_edge(n1, n2, G[n1][n2])
-        for n2 in G.predecessors_iter(n1):
-            result.add_node(n2, G.node[n2])
-            result.add_edge(n2, n1, G[n2][n1])
-    return result
+        node_instance_attributes={'modification': 'removed'},
+        relationships_node_instance_attributes={'modification': 'reduced'})
+    return {
+        'added_and_related': extract_node_instances(
+            added_instances_graph,
+            ctx=ctx,
+            copy_instances=True,
+            contained_graph=ctx.deployment_contained_graph),
+        'extended_and_related': extract_node_instances(
+            extended_instances_graph,
+            ctx=ctx,
+            copy_instances=True,
+            contained_graph=ctx.deployment_contained_graph),
+        'reduced_and_related': extract_node_instances(
+            reduced_instances_graph,
+            ctx=ctx,
+            copy_instances=True,
+            contained_graph=ctx.previous_deployment_contained_graph),
+        'removed_and_related': extract_node_instances(
+            removed_instances_graph,
+            ctx=ctx,
+            copy_instances=True,
+            contained_graph=ctx.previous_deployment_contained_graph)
+    }
 
 
-def _graph_diff_relationships(G, H, node_instance_attributes):
+def _graph_diff(G, H,
+                node_instance_attributes,
+                relationships_node_instance_attributes):
     """
     G represents the base and H represents the changed graph.
-    :param G:
-    :param H:
-    :param node_instance_attributes:
-    :return:
-    """
-    result = nx.DiGraph()
-    for source, dest, data in G.edges_iter(data=True):
-        if source in H and dest not in H[source]:
-            new_node = copy.deepcopy(G.node[source])
-            result.add_node(source, new_node,
-                            node_instance_attributes=node_instance_attributes)
-            result.add_node(dest, G.node[dest])
-            result.add_edge(source, dest, G[source][dest])
-    return result
 
-
-def _handle_contained_in(ctx):
+    :return: A graph of the nodes of G which are not in H (along with
+     their relationships), and a graph of the edges of G between nodes of
+     H which are not in H. Nodes in the latter that are not in H are only
+     there as relationship targets, and are excluded from extraction.
+    """
+    nodes_result = nx.DiGraph()
+    relationships_result = nx.DiGraph()
+    G_node = G.node
+    G_succ = G.succ
+    for n1, n1_succ in G_succ.iteritems():
+        if n1 not in H:
+            nodes_result.add_node(
+                n1, dict(G_node[n1],
+                         node_instance_attributes=node_instance_attributes))
+            for n2, edge_data in n1_succ.iteritems():
+                if n2 not in nodes_result:
+                    nodes_result.add_node(n2, dict(G_node[n2]))
+                nodes_result.add_edge(n1, n2, edge_data)
+            for n2 in G.pred[n1]:
+                if n2 not in nodes_result:
+                    nodes_result.add_node(n2, dict(G_node[n2]))
+                nodes_result.add_edge(n2, n1, G_succ[n2][n1])
+            continue
+        H_n1_succ = H.succ[n1]
+        for n2, edge_data in n1_succ.iteritems():
+            if n2 in H_n1_succ:
+                continue
+            if n1 not in relationships_result:
+                relationships_result.add_node(n1, dict(
+                    G_node[n1],
+                    node_instance_attributes=(
+                        relationships_node_instance_attributes)))
+            if n2 not in relationships_result:
+                relationships_result.add_node(n2, dict(G_node[n2],
+                                                       excluded=n2 not in H))
+            relationships_result.add_edge(n1, n2, edge_data)
+    return nodes_result, relationships_result
+
+
+def _handle_contained_in(ctx, processes=None):
     # for each 'contained' tree, recursively build new trees based on
     # scaling groups with generated ids
+    contained_trees = []
     for contained_tree in nx.weakly_connected_component_subgraphs(
             ctx.plan_contained_graph.reverse(copy=True)):
         # extract tree root node id
         node_id = nx.topological_sort(contained_tree)[0]
-        _build_multi_instance_node_tree_rec(
-            node_id=node_id,
-            contained_tree=contained_tree,
-            ctx=ctx)
-    ctx.deployment_contained_graph = ctx.deployment_node_graph.copy()
+        contained_trees.append((node_id, contained_tree))
+    if (processes and processes > 1 and len(contained_trees) > 1 and
+            not ctx.is_modification):
+        expanded = _expand_contained_trees_in_processes(
+            ctx, contained_trees, processes)
+    else:
+        expanded = False
+    if not expanded:
+        for node_id, contained_tree in contained_trees:
+            _build_multi_instance_node_tree_rec(
+                node_id=node_id,
+                contained_tree=contained_tree,
+                ctx=ctx)
+    ctx.deployment_contained_graph = ContainedGraph(ctx.deployment_node_graph)
+
+
+def _expand_contained_trees_in_processes(ctx, contained_trees, processes):
+    """
+    Expand each contained-in tree in a worker process and merge the results
+    into the deployment node graph, in the order they would have been added
+    to it when expanding serially.
+
+    :return: False if ids generated for different trees collide, in which
+     case nothing is merged and the trees should be expanded serially.
+    """
+    pool = multiprocessing.Pool(processes,
+                                initializer=_init_expansion_worker,
+                                initargs=(ctx.plan_node_graph,))
+    try:
+        expanded_trees = pool.map(
+            _expand_contained_tree,
+            [(node_id, contained_tree, ctx.node_instance_id_generator)
+             for node_id, contained_tree in contained_trees],
+            chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    node_instance_ids = set()
+    for expanded_tree, _ in expanded_trees:
+        for node_instance_id, _, _, _ in expanded_tree:
+            if node_instance_id in node_instance_ids:
+                return False
+            node_instance_ids.add(node_instance_id)
+    graph = ctx.deployment_node_graph
+    for expanded_tree, generator_state in expanded_trees:
+        if generator_state is not None:
+            ctx.node_instance_id_generator.merge_state(generator_state)
+        for node_instance_id, node_instance, parent_id, edge_data in \
+                expanded_tree:
+            graph.add_node(node_instance_id, node=node_instance)
+            ctx.ordered_node_instance_ids.append(node_instance_id)
+            if parent_id is not None:
+                graph.add_edge(node_instance_id, parent_id, edge_data)
+    ctx.node_instance_ids.update(node_instance_ids)
+    return True
+
+
+_worker_plan_node_graph = None
+
+
+def _init_expansion_worker(plan_node_graph):
+    global _worker_plan_node_graph
+    _worker_plan_node_graph = plan_node_graph
+    # forked workers share the random state of the parent process
+    random.seed()
+
+
+def _expand_contained_tree(args):
+    node_id, contained_tree, node_instance_id_generator = args
+    ctx = Context(plan_node_graph=_worker_plan_node_graph,
+                  deployment_node_graph=nx.DiGraph(),
+                  node_instance_id_generator=node_instance_id_generator)
+    _build_multi_instance_node_tree_rec(node_id=node_id,
+                                        contained_tree=contained_tree,
+                                        ctx=ctx)
+    graph = ctx.deployment_node_graph
+    result = []
+    for node_instance_id in ctx.ordered_node_instance_ids:
+        # the only successor is the containing node instance
+        parent_id = next(iter(graph.succ[node_instance_id]), None)
+        edge_data = graph.succ[node_instance_id].get(parent_id)
+        result.append((node_instance_id,
+                       graph.node[node_instance_id]['node'],
+                       parent_id,
+                       edge_data))
+    return result, ctx.node_instance_id_generator.get_state()
 
 
 def _build_multi_instance_node_tree_rec(node_id,
@@ -417,6 +654,11 @@ def _build_multi_instance_node_tree_rec(node_id,
         parent_node_instance_id=parent_node_instance_id,
         parent_relationship=parent_relationship,
         current_host_instance_id=current_host_instance_id)
+    # contained_tree is a tree, so each child's subtree is simply reachable
+    # from it in contained_tree. There is no need to build a subgraph for
+    # each of them (once per container instance).
+    children = [(child_node_id, ctx.plan_node_graph[child_node_id][node_id])
+                for child_node_id in contained_tree.neighbors_iter(node_id)]
     for container in containers:
         node_instance = container.node_instance
         node_instance_id = node_instance['id']
@@ -424,23 +666,19 @@ def _build_multi_instance_node_tree_rec(node_id,
         new_current_host_instance_id = container.current_host_instance_id
         ctx.deployment_node_graph.add_node(node_instance_id,
                                            node=node_instance)
+        ctx.ordered_node_instance_ids.append(node_instance_id)
         if parent_node_instance_id is not None:
             ctx.deployment_node_graph.add_edge(
                 node_instance_id, parent_node_instance_id,
                 relationship=relationship_instance,
                 index=parent_relationship_index)
-        for child_node_id in contained_tree.neighbors_iter(node_id):
-            descendants = nx.descendants(contained_tree, child_node_id)
-            descendants.add(child_node_id)
-            child_contained_tree = contained_tree.subgraph(descendants)
+        for child_node_id, child_edge_data in children:
             _build_multi_instance_node_tree_rec(
                 node_id=child_node_id,
-                contained_tree=child_contained_tree,
+                contained_tree=contained_tree,
                 ctx=ctx,
-                parent_relationship=ctx.plan_node_graph[
-                    child_node_id][node_id]['relationship'],
-                parent_relationship_index=ctx.plan_node_graph[
-                    child_node_id][node_id]['index'],
+                parent_relationship=child_edge_data['relationship'],
+                parent_relationship_index=child_edge_data['index'],
                 parent_node_instance_id=node_instance_id,
                 current_host_instance_id=new_current_host_instance_id)
 
@@ -458,13 +696,17 @@ def _build_and_update_node_instances(ctx,
     if ctx.is_modification:
         all_previous_node_instance_ids = ctx.node_ids_to_node_instance_ids[
             node_id]
-        previous_node_instance_ids = [
-            instance_id for instance_id in all_previous_node_instance_ids
-            if not parent_node_instance_id or
-            (instance_id in ctx.previous_deployment_node_graph and
-             ctx.previous_deployment_node_graph[instance_id].get(
-                 parent_node_instance_id))
-        ]
+        if parent_node_instance_id:
+            # look up the instances related to the parent instance, instead
+            # of going over all the node instances for each parent instance
+            previous_node_instance_ids = [
+                instance_id for instance_id in
+                ctx.previous_deployment_node_graph.pred.get(
+                    parent_node_instance_id, ())
+                if instance_id in all_previous_node_instance_ids
+            ]
+        else:
+            previous_node_instance_ids = list(all_previous_node_instance_ids)
         previous_instances_num = len(previous_node_instance_ids)
         if node_id in ctx.modified_nodes:
             modified_node = ctx.modified_nodes[node_id]
@@ -525,26 +767,30 @@ def _handle_removed_instances(
     removed_instances_num = previous_instances_num - total_instances_num
     removed_ids_include_hint = modified_node.get(
         'removed_ids_include_hint', [])
-    removed_ids_exclude_hint = modified_node.get(
-        'removed_ids_exclude_hint', [])
+    removed_ids_exclude_hint = set(modified_node.get(
+        'removed_ids_exclude_hint', []))
+    previous_node_instance_ids_set = set(previous_node_instance_ids)
+    removed_instance_ids = set()
+    # removed instances are selected from the include hint first, then
+    # from instances not in the exclude hint and only then from the rest,
+    # in the order of previous_node_instance_ids
     for removed_instance_id in removed_ids_include_hint:
-        if removed_instances_num <= 0:
+        if len(removed_instance_ids) >= removed_instances_num:
             break
-        if removed_instance_id in previous_node_instance_ids:
-            previous_node_instance_ids.remove(removed_instance_id)
-            removed_instances_num -= 1
-    for removed_instance_id in copy.copy(
-            previous_node_instance_ids):
-        if removed_instances_num <= 0:
+        if removed_instance_id in previous_node_instance_ids_set:
+            removed_instance_ids.add(removed_instance_id)
+    for removed_instance_id in previous_node_instance_ids:
+        if len(removed_instance_ids) >= removed_instances_num:
             break
-        if removed_instance_id in removed_ids_exclude_hint:
-            continue
-        previous_node_instance_ids.remove(removed_instance_id)
-        removed_instances_num -= 1
-    remaining_removed_instance_ids = previous_node_instance_ids[
-        :removed_instances_num]
-    for removed_instance_id in remaining_removed_instance_ids:
-        previous_node_instance_ids.remove(removed_instance_id)
+        if removed_instance_id not in removed_ids_exclude_hint:
+            removed_instance_ids.add(removed_instance_id)
+    for removed_instance_id in previous_node_instance_ids:
+        if len(removed_instance_ids) >= removed_instances_num:
+            break
+        removed_instance_ids.add(removed_instance_id)
+    previous_node_instance_ids[:] = [
+        instance_id for instance_id in previous_node_instance_ids
+        if instance_id not in removed_instance_ids]
 
 
 def _extract_contained(node, node_instance):
@@ -658,12 +904,8 @@ def _add_connected_to_and_depends_on_relationships(
 
     if connection_type == ALL_TO_ONE:
         if minimal_containing_group:
-            raise exceptions.UnsupportedAllToOneInGroup(
-                "'{0}' connection type is not supported within groups, "
-                "but the source node '{1}' and target node '{2}' are both in "
-                "group '{3}'"
-                .format(ALL_TO_ONE, source_node_id, target_node_id,
-                        minimal_containing_group))
+            raise _unsupported_all_to_one_in_group(
+                source_node_id, target_node_id, minimal_containing_group)
         else:
             target_node_instance_id = _get_all_to_one_relationship_target_id(
                 ctx=ctx,
@@ -684,19 +926,30 @@ def _add_connected_to_and_depends_on_relationships(
         partitioned_node_instance_ids = [
             (source_node_instance_ids, target_node_instance_ids)]
 
+    # all relationship instances of this relationship differ only in their
+    # target id, which is the edge target. Edges share a single template
+    # which is materialized into relationship instances on extraction.
+    relationship_template = _relationship_instance_template(relationship)
     for source_node_instance_ids, target_node_instance_ids in \
             partitioned_node_instance_ids:
         for source_node_instance_id in source_node_instance_ids:
             for target_node_instance_id in target_node_instance_ids:
-                relationship_instance = _relationship_instance_copy(
-                    relationship=relationship,
-                    target_node_instance_id=target_node_instance_id)
                 ctx.deployment_node_graph.add_edge(
                     source_node_instance_id, target_node_instance_id,
-                    relationship=relationship_instance,
+                    relationship_template=relationship_template,
                     index=index)
 
 
+def _unsupported_all_to_one_in_group(source_node_id,
+                                     target_node_id,
+                                     group):
+    return exceptions.UnsupportedAllToOneInGroup(
+        "'{0}' connection type is not supported within groups, "
+        "but the source node '{1}' and target node '{2}' are both in "
+        "group '{3}'"
+        .format(ALL_TO_ONE, source_node_id, target_node_id, group))
+
+
 def _partition_source_and_target_instances(
         ctx,
         group,
@@ -735,9 +988,9 @@ def _build_scaling_groups_map(ctx, node_instance_ids, group):
 
 
 def _node_instance_id(node_id, ctx):
-    new_node_instance_id = '{0}_{1}'.format(node_id, _generate_id())
-    while new_node_instance_id in ctx.node_instance_ids:
-        new_node_instance_id = '{0}_{1}'.format(node_id, _generate_id())
+    new_node_instance_id = ctx.node_instance_id_generator.generate(
+        node_id=node_id,
+        existing_ids=ctx.node_instance_ids)
     ctx.node_instance_ids.add(new_node_instance_id)
     return new_node_instance_id
 
@@ -746,6 +999,119 @@ def _generate_id(id_len=6):
     return ''.join(choice(digits + ascii_lowercase) for _ in xrange(id_len))
 
 
+class NodeInstanceIdGenerator(object):
+    """Base class for node instance id generators.
+
+    Generators only know about the ids in use, so a generator that is
+    recreated between expansions (e.g. between modify_deployment calls)
+    may reissue the id of a removed node instance. Stateful generators
+    avoid this when their state is kept from one expansion to the next:
+    store get_state() after each expansion, and set_state() on the
+    generator used for the next one (DeploymentGraph.serialize and
+    deserialize do this).
+    """
+
+    def generate(self, node_id, existing_ids):
+        """Generate a new node instance id.
+
+        :param node_id: The id of the node the instance belongs to.
+        :param existing_ids: A set of ids that are already in use.
+        :return: A new id, not in existing_ids.
+        """
+        raise NotImplementedError()
+
+    def get_state(self):
+        """
+        :return: The (JSON serializable) state ids are generated from, or
+         None if the generator is stateless.
+        """
+        return None
+
+    def set_state(self, state):
+        """
+        :param state: A state returned by get_state.
+        """
+        pass
+
+    def merge_state(self, state):
+        """
+        Merge the state of a copy of this generator, used for generating ids
+        of other nodes (see build_deployment_node_graph processes).
+
+        :param state: A state returned by get_state.
+        """
+        pass
+
+
+class RandomNodeInstanceIdGenerator(NodeInstanceIdGenerator):
+    """Generates '<node_id>_<6 random alphanumeric chars>' ids (default)."""
+
+    def generate(self, node_id, existing_ids):
+        new_node_instance_id = '{0}_{1}'.format(node_id, _generate_id())
+        while new_node_instance_id in existing_ids:
+            new_node_instance_id = '{0}_{1}'.format(node_id, _generate_id())
+        return new_node_instance_id
+
+
+class CounterNodeInstanceIdGenerator(NodeInstanceIdGenerator):
+    """Generates '<node_id>_<counter>' ids, using a counter per node.
+
+    The counters are the generator state, so keeping it between expansions
+    means ids of removed node instances are never generated again.
+    """
+
+    def __init__(self):
+        self._counters = collections.defaultdict(int)
+
+    def generate(self, node_id, existing_ids):
+        while True:
+            self._counters[node_id] += 1
+            new_node_instance_id = self._format_id(node_id,
+                                                   self._counters[node_id])
+            if new_node_instance_id not in existing_ids:
+                return new_node_instance_id
+
+    def get_state(self):
+        return {'counters': dict(self._counters)}
+
+    def set_state(self, state):
+        self._counters = collections.defaultdict(int, state['counters'])
+
+    def merge_state(self, state):
+        for node_id, counter in state['counters'].items():
+            self._counters[node_id] = max(self._counters[node_id], counter)
+
+    def _format_id(self, node_id, counter):
+        return '{0}_{1}'.format(node_id, counter)
+
+
+class SeededNodeInstanceIdGenerator(CounterNodeInstanceIdGenerator):
+    """Generates reproducible '<node_id>_<6 alphanumeric chars>' ids.
+
+    The id suffix is derived from the seed (e.g. the deployment id), the
+    node id and a per node counter, so expanding the same plan with the
+    same seed generates the same ids. Colliding ids are skipped. As with
+    CounterNodeInstanceIdGenerator, the counters should be kept between
+    expansions (get_state/set_state), otherwise a new generator with the
+    same seed regenerates the ids of removed node instances.
+    """
+
+    def __init__(self, seed, id_len=6):
+        super(SeededNodeInstanceIdGenerator, self).__init__()
+        self._seed = seed
+        self._id_len = id_len
+
+    def _format_id(self, node_id, counter):
+        digest = hashlib.sha1('{0}:{1}:{2}'.format(
+            self._seed, node_id, counter)).digest()
+        return '{0}_{1}'.format(node_id, _encode_id(digest, self._id_len))
+
+
+def _encode_id(digest, id_len):
+    alphabet = digits + ascii_lowercase
+    return ''.join(alphabet[ord(c) % len(alphabet)] for c in digest[:id_len])
+
+
 def _node_instance_copy(node, node_instance_id):
     node_id = _node_id_from_node(node)
     result = {
@@ -762,10 +1128,15 @@ def _node_instance_copy(node, node_instance_id):
 
 def _relationship_instance_copy(relationship,
                                 target_node_instance_id):
+    return _relationship_instance_from_template(
+        relationship_template=_relationship_instance_template(relationship),
+        target_node_instance_id=target_node_instance_id)
+
+
+def _relationship_instance_template(relationship):
     result = {
         'type': relationship['type'],
-        'target_name': relationship['target_id'],
-        'target_id': target_node_instance_id
+        'target_name': relationship['target_id']
     }
     replaced = relationship.get('replaced')
     if replaced:
@@ -773,6 +1144,13 @@ def _relationship_instance_copy(relationship,
     return result
 
 
+def _relationship_instance_from_template(relationship_template,
+                                         target_node_instance_id):
+    result = relationship_template.copy()
+    result['target_id'] = target_node_instance_id
+    return result
+
+
 # currently we have decided not to support such relationships
 # until we better understand what semantics are required for such
 # relationships
@@ -796,8 +1174,8 @@ def _verify_and_get_connection_type(relationship):
 
 def _relationship_type_hierarchy_includes_one_of(relationship, expected_types):
     relationship_type_hierarchy = relationship['type_hierarchy']
-    return any([relationship_type in expected_types
-                for relationship_type in relationship_type_hierarchy])
+    return any(expected_type in relationship_type_hierarchy
+               for expected_type in expected_types)
 
 
 def _node_id_from_node(node):
@@ -815,7 +1193,8 @@ class Context(object):
                  deployment_node_graph,
                  previous_deployment_node_graph=None,
                  previous_deployment_contained_graph=None,
-                 modified_nodes=None):
+                 modified_nodes=None,
+                 node_instance_id_generator=None):
         self.plan_node_graph = plan_node_graph
         self.plan_contained_graph = self._build_contained_in_graph(
             plan_node_graph)
@@ -827,8 +1206,16 @@ class Context(object):
         self.previous_deployment_contained_graph = (
             previous_deployment_contained_graph)
         self.modified_nodes = modified_nodes
+        self.node_instance_id_generator = (
+            node_instance_id_generator or RandomNodeInstanceIdGenerator())
         self.node_ids_to_node_instance_ids = collections.defaultdict(set)
         self.node_instance_ids = set()
+        # node instance ids of the deployment node graph, in the order the
+        # node instances were added to it
+        self.ordered_node_instance_ids = []
+        self._plan_containing_groups = {}
+        self._minimal_containing_groups = {}
+        self._instance_containing_group_ids = {}
         if self.is_modification:
             for node_instance_id, data in \
                     self.previous_deployment_node_graph.nodes_iter(data=True):
@@ -843,43 +1230,57 @@ class Context(object):
         return self.previous_deployment_node_graph is not None
 
     def minimal_containing_group(self, node_a, node_b):
-        a_groups = self._containing_groups(node_a)
-        b_groups = self._containing_groups(node_b)
-        shared_groups = set(a_groups) & set(b_groups)
-        if not shared_groups:
-            return None
-        return nx.topological_sort(self.plan_contained_graph,
-                                   nbunch=shared_groups)[0]
+        key = (node_a, node_b)
+        if key not in self._minimal_containing_groups:
+            b_groups = set(self._containing_groups(node_b))
+            # containing groups are ordered from the innermost group
+            # outwards, so the first shared group is the minimal one
+            minimal_group = None
+            for group in self._containing_groups(node_a):
+                if group in b_groups:
+                    minimal_group = group
+                    break
+            self._minimal_containing_groups[key] = minimal_group
+        return self._minimal_containing_groups[key]
 
     def _containing_groups(self, node_id):
-        graph = self.plan_contained_graph
-        result = []
-        while True:
+        result = self._plan_containing_groups.get(node_id)
+        if result is None:
+            graph = self.plan_contained_graph
             succ = graph.succ[node_id]
             if succ:
                 assert len(succ) == 1
-                node_id = succ.keys()[0]
-                if not graph.node[node_id]['node'].get('group'):
-                    continue
-                result.append(node_id)
+                container_id = succ.keys()[0]
+                result = self._containing_groups(container_id)
+                if graph.node[container_id]['node'].get('group'):
+                    result = [container_id] + result
             else:
-                break
+                result = []
+            self._plan_containing_groups[node_id] = result
         return result
 
     def containing_group_id(self, node_instance_id, group_name):
-        graph = self.deployment_contained_graph
-        while True:
+        return self._containing_group_ids(node_instance_id).get(group_name)
+
+    def _containing_group_ids(self, node_instance_id):
+        """Map from group name to the id of the group instance containing
+        the node instance (directly or through its containers)"""
+        result = self._instance_containing_group_ids.get(node_instance_id)
+        if result is None:
+            graph = self.deployment_contained_graph
             succ = graph.succ[node_instance_id]
             if succ:
                 assert len(succ) == 1
-                node_instance_id = succ.keys()[0]
-                node = graph.node[node_instance_id]['node']
-                if not node.get('group'):
-                    continue
-                if _node_id_from_node_instance(node) == group_name:
-                    return node['id']
+                container_id = next(iter(succ))
+                result = self._containing_group_ids(container_id)
+                node = graph.node[container_id]['node']
+                if node.get('group'):
+                    result = result.copy()
+                    result[_node_id_from_node_instance(node)] = node['id']
             else:
-                return None
+                result = {}
+            self._instance_containing_group_ids[node_instance_id] = result
+        return result
 
     @staticmethod
     def containing_group_instances(instance_id,
@@ -889,7 +1290,7 @@ class Context(object):
             succ = contained_graph.succ[instance_id]
             if succ:
                 assert len(succ) == 1
-                node_instance_id = succ.keys()[0]
+                node_instance_id = next(iter(succ))
                 node = contained_graph.node[node_instance_id]['node']
                 instance_id = node['id']
                 result.append({
@@ -946,6 +1347,28 @@ class Context(object):
         return relationship_base_graph
 
 
+class ContainedGraph(object):
+    """
+    The contained-in structure of a deployment node graph, before
+    connected_to and depends_on relationships are added to it.
+
+    Node instance data is shared with the deployment node graph and only
+    the successors of each node instance (its container) are kept, instead
+    of copying the whole graph. As with a networkx graph, the container of
+    a node instance is in succ[node_instance_id] and its data in
+    node[node_instance_id].
+    """
+
+    def __init__(self, graph):
+        self.node = graph.node
+        self.succ = dict((node_instance_id, tuple(successors))
+                         for node_instance_id, successors
+                         in graph.succ.iteritems())
+
+    def __contains__(self, node_instance_id):
+        return node_instance_id in self.node
+
+
 class Container(object):
 
     def __init__(self,
@@ -75,11 +75,13 @@ def _process_functions(plan):
     scan.scan_service_template(plan, handler, replace=True)
 
 
-def prepare_deployment_plan(plan, inputs=None, **kwargs):
+def prepare_deployment_plan(plan, inputs=None, template_functions=None,
+                            **kwargs):
     """
     Prepare a plan for deployment
     """
     plan = models.Plan(copy.deepcopy(plan))
     _set_plan_inputs(plan, inputs)
-    _process_functions(plan)
+    with functions.overlay(template_functions):
+        _process_functions(plan)
     return multi_instance.create_deployment_plan(plan)
@@ -176,7 +176,8 @@ imports:"""
               resources_base_url=None,
               dsl_version=BASIC_VERSION_SECTION_DSL_1_0,
               resolver=None,
-              validate_version=True):
+              validate_version=True,
+              imports_cache=None):
         # add dsl version if missing
         if DSL_VERSION_PREFIX not in dsl_string:
             dsl_string = dsl_version + dsl_string
@@ -185,7 +186,8 @@ imports:"""
         return dsl_parse(dsl_string,
                          resources_base_url=resources_base_url,
                          resolver=resolver,
-                         validate_version=validate_version)
+                         validate_version=validate_version,
+                         imports_cache=imports_cache)
 
     def parse_1_0(self, dsl_string, resources_base_url=None):
         return self.parse(dsl_string, resources_base_url,
@@ -13,7 +13,14 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import copy
+import json
+
+from dsl_parser import rel_graph
+from dsl_parser.multi_instance import (DeploymentGraph,
+                                       modify_deployment)
 from dsl_parser.tests import scaling
+from dsl_parser.tests.abstract_test_parser import timeout
 
 
 class TestMultiInstanceModify(scaling.BaseTestMultiInstance):
@@ -681,6 +688,77 @@ class TestMultiInstanceModify(scaling.BaseTestMultiInstance):
         })
         self._assert_modification(modification, 0, 6, 0, 3)
 
+    def test_extended_and_reduced_exclude_added_and_removed(self):
+        yaml = self.BASE_BLUEPRINT + """
+    db:
+        type: db
+    webserver:
+        type: webserver
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+        relationships:
+            -   type: cloudify.relationships.connected_to
+                target: db
+"""
+        plan = self.parse_multi(yaml)
+        modification = self.modify_multi(plan, {
+            'db': {'instances': 2}
+        })
+        self._assert_modification(modification, 3, 0, 1, 0)
+        added_ids = self._node_ids(self._nodes_by_name(
+            modification['added_and_related'], 'db'))
+        extended_and_related = modification['extended_and_related']
+        self.assertEqual(2, len(extended_and_related))
+        for node_instance in extended_and_related:
+            self.assertEqual('webserver', node_instance['name'])
+            self.assertEqual('extended', node_instance['modification'])
+            self.assertEqual(added_ids, [r['target_id'] for r in
+                                         node_instance['relationships']])
+
+        for node_instance in modification['added_and_related']:
+            if node_instance.pop('modification', None) == 'added':
+                plan['node_instances'].append(node_instance)
+        for node_instance in self._nodes_by_name(plan['node_instances'],
+                                                 'webserver'):
+            node_instance['relationships'].append(dict(
+                node_instance['relationships'][0], target_id=added_ids[0]))
+        modification = self.modify_multi(plan, {
+            'db': {'instances': 1, 'removed_ids_include_hint': added_ids}
+        })
+        self._assert_modification(modification, 0, 3, 0, 1)
+        reduced_and_related = modification['reduced_and_related']
+        self.assertEqual(2, len(reduced_and_related))
+        for node_instance in reduced_and_related:
+            self.assertEqual('reduced', node_instance['modification'])
+            self.assertEqual(added_ids, [r['target_id'] for r in
+                                         node_instance['relationships']])
+        for node_instance in plan['node_instances']:
+            self.assertNotIn('modification', node_instance)
+
+    @timeout(seconds=30)
+    def test_large_scale_in(self):
+        yaml = self.BASE_BLUEPRINT + """
+    host:
+        type: cloudify.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 5000
+"""
+        plan = self.parse_multi(yaml)
+        host_ids = self._node_ids(plan['node_instances'])
+        for modified_node in [
+                {},
+                {'removed_ids_include_hint': host_ids[:2500]},
+                {'removed_ids_exclude_hint': host_ids[:2500]}]:
+            modified_node['instances'] = 2500
+            modification = self.modify_multi(plan, {'host': modified_node})
+            self._assert_modification(modification, 0, 2500, 0, 2500)
+        removed_ids = self._node_ids(modification['removed_and_related'])
+        self.assertEqual(set(host_ids[2500:]), set(removed_ids))
+
     def _test_base_nodes(self):
         return self.BASE_BLUEPRINT + """
             without_rel:
@@ -734,3 +812,200 @@ class TestMultiInstanceModify(scaling.BaseTestMultiInstance):
               }}]
         modified_nodes = [with_rel]
         self.modify_multi(plan, modified_nodes=modified_nodes)
+
+
+class TestDeploymentGraph(scaling.BaseTestMultiInstance):
+
+    BLUEPRINT = scaling.BaseTestMultiInstance.BASE_BLUEPRINT + """
+    host:
+        type: cloudify.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+    db:
+        type: db
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: host
+    webserver:
+        type: webserver
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+        relationships:
+            -   type: cloudify.relationships.connected_to
+                target: db
+    network:
+        type: network
+groups:
+    group1:
+        members: [host]
+policies:
+    policy:
+        type: cloudify.policies.scaling
+        targets: [group1]
+"""
+
+    MODIFICATIONS = [
+        {'group1': {'instances': 3}},
+        {'db': {'instances': 2}},
+        {'webserver': {'instances': 4}},
+        {'group1': {'instances': 2}},
+        {'webserver': {'instances': 1}},
+        {'db': {'instances': 1}},
+        {'group1': {'instances': 4}},
+        {'network': {'instances': 0}},
+        {'network': {'instances': 2}},
+    ]
+
+    @staticmethod
+    def _modify(state, modified_nodes, node_instance_id_generator):
+        return modify_deployment(
+            nodes=copy.deepcopy(state['nodes']),
+            previous_nodes=copy.deepcopy(state['nodes']),
+            previous_node_instances=copy.deepcopy(state['node_instances']),
+            modified_nodes=modified_nodes,
+            scaling_groups=copy.deepcopy(state['scaling_groups']),
+            node_instance_id_generator=node_instance_id_generator)
+
+    def _with_removed_ids_hint(self, deployment_graph, modified_nodes):
+        # make the removed node instances deterministic
+        node_instances = deployment_graph.node_instances
+        result = {}
+        for name, modified_node in modified_nodes.items():
+            ids = sorted(
+                set(g['id'] for n in node_instances
+                    for g in n.get('scaling_groups', [])
+                    if g['name'] == name) or
+                self._node_ids(self._nodes_by_name(node_instances, name)))
+            result[name] = dict(modified_node,
+                                removed_ids_include_hint=ids)
+        return result
+
+    @staticmethod
+    def _summary(modification):
+        # which of the generated ids is given to which added node instance
+        # depends on the graph iteration order, so these are replaced by
+        # their node id
+        added_ids = dict((n['id'], n['name'])
+                         for n in modification['added_and_related']
+                         if n.get('modification') == 'added')
+        result = {}
+        for key, node_instances in modification.items():
+            result[key] = sorted(
+                (added_ids.get(n['id'], n['id']),
+                 n.get('modification'),
+                 sorted((added_ids.get(r['target_id'], r['target_id']),
+                         r['type'])
+                        for r in n['relationships']),
+                 sorted(g['name'] for g in n.get('scaling_groups', [])))
+                for n in node_instances)
+        return result
+
+    def _assert_instances_num(self, deployment_graph, expected):
+        node_instances = deployment_graph.node_instances
+        for name, instances in expected.items():
+            self.assertEqual(
+                instances, len(self._nodes_by_name(node_instances, name)))
+
+    def test_same_modifications_as_modify_deployment(self):
+        plan = self.parse_multi(self.BLUEPRINT)
+        deployment_graph = DeploymentGraph.from_plan(
+            plan,
+            node_instance_id_generator=(
+                rel_graph.CounterNodeInstanceIdGenerator()))
+        for modified_nodes in self.MODIFICATIONS:
+            modified_nodes = self._with_removed_ids_hint(deployment_graph,
+                                                         modified_nodes)
+            state = deployment_graph.serialize()
+            expected = self._modify(state, modified_nodes, copy.deepcopy(
+                deployment_graph.node_instance_id_generator))
+            modification = deployment_graph.modify(modified_nodes)
+            self.assertEqual(self._summary(expected),
+                             self._summary(modification))
+        self._assert_instances_num(deployment_graph, {
+            'host': 8, 'db': 8, 'webserver': 1, 'network': 2})
+
+    def test_state_follows_modifications(self):
+        plan = self.parse_multi(self.BLUEPRINT)
+        deployment_graph = DeploymentGraph.from_plan(plan)
+        previous_ids = set(self._node_ids(deployment_graph.node_instances))
+        # each group instance holds 2 host instances
+        modification = deployment_graph.modify({'group1': {'instances': 3}})
+        self._assert_modification(modification, 10, 0, 8, 0)
+        added_ids = set(self._node_ids(
+            n for n in modification['added_and_related']
+            if n.get('modification') == 'added'))
+        self.assertEqual(previous_ids | added_ids,
+                         set(self._node_ids(deployment_graph.node_instances)))
+        for node_instance in deployment_graph.node_instances:
+            self.assertNotIn('modification', node_instance)
+            if node_instance['name'] == 'webserver':
+                self.assertEqual(6, len(node_instance['relationships']))
+
+        # no actual modification, the new state is the base of the next one
+        modification = deployment_graph.modify({'group1': {'instances': 3}})
+        self._assert_modification(modification, 0, 0, 0, 0)
+
+        modification = deployment_graph.modify({'group1': {'instances': 1}})
+        self._assert_modification(modification, 0, 10, 0, 8)
+        self._assert_instances_num(deployment_graph, {
+            'host': 2, 'db': 2, 'webserver': 2, 'network': 1})
+        for node_instance in self._nodes_by_name(
+                deployment_graph.node_instances, 'webserver'):
+            self.assertEqual(2, len(node_instance['relationships']))
+
+    def test_unknown_modified_node(self):
+        plan = self.parse_multi(self.BLUEPRINT)
+        deployment_graph = DeploymentGraph.from_plan(plan)
+        state = deployment_graph.serialize()
+        self.assertRaises(ValueError, deployment_graph.modify,
+                          {'group1': {'instances': 3},
+                           'unknown': {'instances': 1}})
+        self.assertEqual(state, deployment_graph.serialize())
+        # the failed modification did not affect the next one
+        modification = deployment_graph.modify({'group1': {'instances': 3}})
+        self._assert_modification(modification, 10, 0, 8, 0)
+        self._assert_instances_num(deployment_graph, {'host': 6, 'db': 6})
+
+    def test_serialization(self):
+        plan = self.parse_multi(self.BLUEPRINT)
+        deployment_graph = DeploymentGraph.from_plan(plan)
+        deployment_graph.modify({'db': {'instances': 2}})
+        data = json.loads(json.dumps(deployment_graph.serialize()))
+        loaded = DeploymentGraph.deserialize(data)
+        self.assertEqual(
+            sorted(self._node_ids(deployment_graph.node_instances)),
+            sorted(self._node_ids(loaded.node_instances)))
+        # the modified instances number is part of the state
+        modification = loaded.modify({'host': {'instances': 2}})
+        self._assert_modification(modification, 0, 0, 0, 0)
+        modification = loaded.modify({'group1': {'instances': 3}})
+        self._assert_modification(modification, 14, 0, 12, 0)
+        self._assert_instances_num(loaded, {'db': 12, 'webserver': 2})
+
+    def test_serialization_keeps_id_generator_state(self):
+        plan = self.parse_multi(self.BLUEPRINT)
+        deployment_graph = DeploymentGraph.from_plan(
+            plan,
+            node_instance_id_generator=(
+                rel_graph.SeededNodeInstanceIdGenerator('deployment')))
+        deployment_graph.modify({'group1': {'instances': 3}})
+        modification = deployment_graph.modify({'group1': {'instances': 1}})
+        removed_ids = set(self._node_ids(
+            n for n in modification['removed_and_related']
+            if n.get('modification') == 'removed'))
+        self.assertEqual(8, len(removed_ids))
+        data = json.loads(json.dumps(deployment_graph.serialize()))
+        loaded = DeploymentGraph.deserialize(
+            data,
+            node_instance_id_generator=(
+                rel_graph.SeededNodeInstanceIdGenerator('deployment')))
+        modification = loaded.modify({'group1': {'instances': 3}})
+        added_ids = set(self._node_ids(
+            n for n in modification['added_and_related']
+            if n.get('modification') == 'added'))
+        self.assertEqual(8, len(added_ids))
+        self.assertFalse(removed_ids & added_ids)
@@ -13,13 +13,26 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import copy
 import itertools
+import json
 import random
+import resource
 
 from mock import patch
 
-from dsl_parser import exceptions
+from dsl_parser import (exceptions,
+                        rel_graph)
+from dsl_parser.multi_instance import (DeploymentGraph,
+                                       create_deployment_plan,
+                                       estimate_deployment_plan,
+                                       iter_deployment_node_instances,
+                                       modify_deployment)
 from dsl_parser.tests import scaling
+from dsl_parser.tests.abstract_test_parser import timeout
+
+# peak memory allowed for expanding 50,000 node instances, in KB
+MEMORY_CEILING = 150 * 1024
 
 
 class TestMultiInstance(scaling.BaseTestMultiInstance):
@@ -549,3 +562,469 @@ policies:
 """
         self.assertRaises(exceptions.UnsupportedAllToOneInGroup,
                           self.parse_multi, blueprint)
+
+    def _id_generator_blueprint(self):
+        return self.BASE_BLUEPRINT + """
+    host:
+        type: cloudify.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 3
+    db:
+        type: db
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: host
+"""
+
+    def test_counter_node_instance_id_generator(self):
+        plan = create_deployment_plan(
+            self.parse_1_3(self._id_generator_blueprint()),
+            node_instance_id_generator=(
+                rel_graph.CounterNodeInstanceIdGenerator()))
+        node_instances = plan['node_instances']
+        self.assertEqual(
+            set(['host_1', 'host_2', 'host_3']),
+            set(self._node_ids(self._nodes_by_name(node_instances, 'host'))))
+        self.assertEqual(
+            set('db_{0}'.format(i) for i in range(1, 7)),
+            set(self._node_ids(self._nodes_by_name(node_instances, 'db'))))
+
+        modification = modify_deployment(
+            nodes=plan['nodes'],
+            previous_nodes=plan['nodes'],
+            previous_node_instances=plan['node_instances'],
+            modified_nodes={'host': {'instances': 4}},
+            scaling_groups=plan['scaling_groups'],
+            node_instance_id_generator=(
+                rel_graph.CounterNodeInstanceIdGenerator()))
+        added = [i['id'] for i in modification['added_and_related']
+                 if i.get('modification') == 'added']
+        self.assertEqual(set(['host_4', 'db_7', 'db_8']), set(added))
+
+    def test_seeded_node_instance_id_generator(self):
+        plan = self.parse_1_3(self._id_generator_blueprint())
+
+        def node_instance_ids(seed):
+            generator = rel_graph.SeededNodeInstanceIdGenerator(seed)
+            return sorted(self._node_ids(create_deployment_plan(
+                plan, node_instance_id_generator=generator)[
+                'node_instances']))
+
+        ids = node_instance_ids('deployment1')
+        self.assertEqual(9, len(set(ids)))
+        for node_instance_id in ids:
+            self.assertRegexpMatches(node_instance_id,
+                                     '^(host|db)_[0-9a-z]{6}$')
+        self.assertEqual(ids, node_instance_ids('deployment1'))
+        self.assertNotEqual(ids, node_instance_ids('deployment2'))
+
+    def test_seeded_node_instance_id_generator_collision(self):
+        generator = rel_graph.SeededNodeInstanceIdGenerator('seed')
+        first_id = generator.generate('node', set())
+        generator = rel_graph.SeededNodeInstanceIdGenerator('seed')
+        second_id = generator.generate('node', set([first_id]))
+        self.assertNotEqual(first_id, second_id)
+
+    def test_seeded_node_instance_id_generator_state(self):
+        def generator(state):
+            result = rel_graph.SeededNodeInstanceIdGenerator('deployment1')
+            result.set_state(json.loads(json.dumps(state)))
+            return result
+
+        plan = self.parse_1_3(self._id_generator_blueprint())
+        first_generator = rel_graph.SeededNodeInstanceIdGenerator(
+            'deployment1')
+        plan = create_deployment_plan(
+            plan, node_instance_id_generator=first_generator)
+        state = first_generator.get_state()
+        issued_ids = set(self._node_ids(plan['node_instances']))
+
+        node_instances = plan['node_instances']
+        for instances in [1, 3, 2, 4]:
+            modify_generator = generator(state)
+            modification = modify_deployment(
+                nodes=plan['nodes'],
+                previous_nodes=plan['nodes'],
+                previous_node_instances=node_instances,
+                modified_nodes={'host': {'instances': instances}},
+                scaling_groups=plan['scaling_groups'],
+                node_instance_id_generator=modify_generator)
+            state = modify_generator.get_state()
+            added = [i for i in modification['added_and_related']
+                     if i.get('modification') == 'added']
+            removed_ids = set(
+                i['id'] for i in modification['removed_and_related']
+                if i.get('modification') == 'removed')
+            # ids of removed node instances are never generated again
+            self.assertFalse(issued_ids & set(self._node_ids(added)))
+            issued_ids.update(self._node_ids(added))
+            node_instances = [
+                i for i in node_instances if i['id'] not in removed_ids]
+            for node_instance in added:
+                node_instance = copy.deepcopy(node_instance)
+                del node_instance['modification']
+                node_instances.append(node_instance)
+            self.assertEqual(
+                instances,
+                len(self._nodes_by_name(node_instances, 'host')))
+        self.assertEqual(3 + 2 + 2, len(
+            [i for i in issued_ids if i.startswith('host_')]))
+
+    def test_all_to_all_relationship_instances_not_shared(self):
+        yaml = self.BASE_BLUEPRINT + """
+    db:
+        type: db
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 3
+    webserver:
+        type: webserver
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 3
+        relationships:
+            -   type: cloudify.relationships.connected_to
+                target: db
+"""
+        node_instances = self.parse_multi(yaml)['node_instances']
+        db_ids = self._node_ids(self._nodes_by_name(node_instances, 'db'))
+        relationships = self._nodes_relationships(
+            self._nodes_by_name(node_instances, 'webserver'))
+        self.assertEqual(9, len(relationships))
+        self.assertEqual(9, len(set(id(r) for r in relationships)))
+        for relationship in relationships:
+            self.assertEqual({'type': 'cloudify.relationships.connected_to',
+                              'target_name': 'db',
+                              'target_id': relationship['target_id']},
+                             relationship)
+            self.assertIn(relationship['target_id'], db_ids)
+
+    def test_iter_deployment_node_instances(self):
+        yaml = self.BASE_BLUEPRINT + """
+    host:
+        type: cloudify.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 3
+    db:
+        type: db
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: host
+    webserver:
+        type: webserver
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: db
+            -   type: cloudify.relationships.connected_to
+                target: network
+    network:
+        type: network
+groups:
+    group1:
+        members: [host]
+policies:
+    policy:
+        type: cloudify.policies.scaling
+        targets: [group1]
+"""
+        plan = self.parse_1_3(yaml)
+        original_plan = copy.deepcopy(plan)
+        node_instances = list(iter_deployment_node_instances(
+            plan,
+            node_instance_id_generator=(
+                rel_graph.SeededNodeInstanceIdGenerator('deployment'))))
+        self.assertEqual(original_plan, plan)
+        expected = create_deployment_plan(
+            plan,
+            node_instance_id_generator=(
+                rel_graph.SeededNodeInstanceIdGenerator('deployment')))[
+            'node_instances']
+        self.assertEqual(sorted(expected, key=lambda n: n['id']),
+                         sorted(node_instances, key=lambda n: n['id']))
+        self.assertEqual(16, len(node_instances))
+
+        # node instances follow the node instance containing them
+        yielded_ids = set()
+        for node_instance in node_instances:
+            for relationship in node_instance['relationships']:
+                if relationship['type'] == \
+                        'cloudify.relationships.contained_in':
+                    self.assertIn(relationship['target_id'], yielded_ids)
+            yielded_ids.add(node_instance['id'])
+
+    @timeout(seconds=120)
+    def test_iter_deployment_node_instances_memory(self):
+        yaml = self.BASE_BLUEPRINT + """
+    host:
+        type: cloudify.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 10000
+    db:
+        type: db
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: host
+    webserver:
+        type: webserver
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: host
+            -   type: cloudify.relationships.connected_to
+                target: network
+    db_dependent:
+        type: db_dependent
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: host
+    network:
+        type: network
+"""
+        plan = self.parse_1_3(yaml)
+        # the peak resident memory of the forked test process starts from
+        # its resident memory when forked
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        node_instances_num = 0
+        chunk = []
+        for node_instance in iter_deployment_node_instances(plan):
+            chunk.append(node_instance)
+            if len(chunk) == 1000:
+                json.dumps(chunk)
+                node_instances_num += len(chunk)
+                chunk = []
+        node_instances_num += len(chunk)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.assertEqual(50001, node_instances_num)
+        # in KB
+        self.assertLess(peak - baseline, MEMORY_CEILING)
+
+    def _independent_trees_blueprint(self):
+        return self.BASE_BLUEPRINT + """
+    host1:
+        type: cloudify.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 3
+    db:
+        type: db
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: host1
+    host2:
+        type: cloudify.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+    webserver:
+        type: webserver
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: host2
+            -   type: cloudify.relationships.connected_to
+                target: db
+    host3:
+        type: cloudify.nodes.Compute
+    network:
+        type: network
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+groups:
+    group1:
+        members: [host2]
+policies:
+    policy:
+        type: cloudify.policies.scaling
+        targets: [group1]
+        properties:
+            default_instances: 2
+"""
+
+    def test_parallel_expansion_identical_to_serial(self):
+        plan = self.parse_1_3(self._independent_trees_blueprint())
+        for node_instance_id_generator in [
+                rel_graph.CounterNodeInstanceIdGenerator(),
+                rel_graph.SeededNodeInstanceIdGenerator('deployment')]:
+            serial_generator = copy.deepcopy(node_instance_id_generator)
+            serial = create_deployment_plan(
+                plan,
+                node_instance_id_generator=serial_generator)
+            parallel_generator = copy.deepcopy(node_instance_id_generator)
+            parallel = create_deployment_plan(
+                plan,
+                node_instance_id_generator=parallel_generator,
+                processes=2)
+            self.assertEqual(serial['node_instances'],
+                             parallel['node_instances'])
+            self.assertEqual(20, len(parallel['node_instances']))
+            self.assertEqual(serial_generator.get_state(),
+                             parallel_generator.get_state())
+
+    def test_parallel_expansion_id_collision(self):
+        plan = self.parse_1_3(self._independent_trees_blueprint())
+        # each worker starts from the same counter, so ids collide and the
+        # trees are expanded serially
+        serial = create_deployment_plan(
+            plan,
+            node_instance_id_generator=SharedCounterNodeInstanceIdGenerator())
+        parallel = create_deployment_plan(
+            plan,
+            node_instance_id_generator=SharedCounterNodeInstanceIdGenerator(),
+            processes=2)
+        self.assertEqual(serial['node_instances'],
+                         parallel['node_instances'])
+
+    def _assert_estimate(self, estimate, node_instances):
+        self.assertEqual(len(node_instances), estimate['node_instances'])
+        self.assertEqual(len(self._nodes_relationships(node_instances)),
+                         estimate['relationship_instances'])
+        for node_id, instances in estimate['nodes'].items():
+            self.assertEqual(
+                instances, len(self._nodes_by_name(node_instances, node_id)))
+
+    def _estimate_blueprint(self):
+        return self.BASE_BLUEPRINT + """
+    host:
+        type: cloudify.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+    db:
+        type: db
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: host
+    webserver:
+        type: webserver
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 3
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: host
+            -   type: cloudify.relationships.connected_to
+                target: db
+            -   type: cloudify.relationships.connected_to
+                target: monitor
+                properties:
+                    connection_type: all_to_one
+    network:
+        type: network
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+        relationships:
+            -   type: cloudify.relationships.connected_to
+                target: db
+    monitor:
+        type: type
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+    loadbalancer:
+        type: type
+        relationships:
+            -   type: cloudify.relationships.connected_to
+                target: webserver
+groups:
+    group1:
+        members: [host]
+    group2:
+        members: [group1, network]
+policies:
+    policy1:
+        type: cloudify.policies.scaling
+        targets: [group1]
+        properties:
+            default_instances: 2
+    policy2:
+        type: cloudify.policies.scaling
+        targets: [group2]
+        properties:
+            default_instances: 2
+"""
+
+    def test_estimate_deployment_plan(self):
+        plan = self.parse_1_3(self._estimate_blueprint())
+        original_plan = copy.deepcopy(plan)
+        estimate = estimate_deployment_plan(plan)
+        self.assertEqual(original_plan, plan)
+        self.assertEqual({'group1': 4, 'group2': 2},
+                         estimate['scaling_groups'])
+        self.assertEqual({'host': 8,
+                          'db': 16,
+                          'webserver': 24,
+                          'network': 4,
+                          'monitor': 2,
+                          'loadbalancer': 1},
+                         estimate['nodes'])
+        self._assert_estimate(estimate,
+                              create_deployment_plan(plan)['node_instances'])
+
+    def test_estimate_modified_deployment_plan(self):
+        plan = create_deployment_plan(
+            self.parse_1_3(self._estimate_blueprint()))
+        for modified_nodes in [{'group1': {'instances': 3}},
+                               {'group2': {'instances': 1}},
+                               {'group2': {'instances': 0}},
+                               {'db': {'instances': 5}},
+                               {'webserver': {'instances': 1},
+                                'loadbalancer': {'instances': 4}}]:
+            deployment_graph = DeploymentGraph.from_plan(plan)
+            estimate = estimate_deployment_plan(plan, modified_nodes)
+            deployment_graph.modify(modified_nodes)
+            self._assert_estimate(estimate, deployment_graph.node_instances)
+
+    def test_estimate_validate_no_all_to_one_in_group(self):
+        plan = self.parse_1_3(self._estimate_blueprint())
+        plan['scaling_groups']['group2']['members'].append('monitor')
+        self.assertRaises(exceptions.UnsupportedAllToOneInGroup,
+                          estimate_deployment_plan, plan)
+
+
+class SharedCounterNodeInstanceIdGenerator(rel_graph.NodeInstanceIdGenerator):
+    """Generates 'id_<counter>' ids, using one counter for all nodes"""
+
+    def __init__(self):
+        self.counter = 0
+
+    def generate(self, node_id, existing_ids):
+        while True:
+            self.counter += 1
+            new_node_instance_id = 'id_{0}'.format(self.counter)
+            if new_node_instance_id not in existing_ids:
+                return new_node_instance_id
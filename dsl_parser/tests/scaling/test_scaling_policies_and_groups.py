@@ -17,7 +17,9 @@ import yaml
 
 from dsl_parser import constants
 from dsl_parser import exceptions
-from dsl_parser.tests.abstract_test_parser import AbstractTestParser
+from dsl_parser.elements import policies as _policies
+from dsl_parser.tests.abstract_test_parser import (AbstractTestParser,
+                                                   timeout)
 
 
 class TestScalingPoliciesAndGroups(AbstractTestParser):
@@ -347,6 +349,49 @@ class TestRemovedContainedInMember(AbstractTestParser):
         }
         self.assert_removal(groups, nodes, expected)
 
+    def test_removed_contained_in_member9(self):
+        groups = {
+            'group': ['node1', 'node2', 'node3', 'node4', 'node5']
+        }
+        nodes = {
+            'node1': None,
+            'node2': None,
+            'node3': 'node1',
+            'node4': 'node3',
+            'node5': 'node2'
+        }
+        expected = {
+            'group': ['node1', 'node2']
+        }
+        self.assert_removal(groups, nodes, expected)
+
+    @timeout(seconds=10)
+    def test_removed_contained_in_member_large_groups(self):
+        node_templates = []
+        hosts = []
+        apps = []
+        for i in range(5000):
+            host = 'host{0}'.format(i)
+            app = 'app{0}'.format(i)
+            node_templates.append({'id': host})
+            node_templates.append({
+                'id': app,
+                constants.RELATIONSHIPS: [{
+                    'type_hierarchy': [constants.CONTAINED_IN_REL_TYPE],
+                    'target_id': host
+                }]
+            })
+            hosts.append(host)
+            apps.append(app)
+        scaling_groups = {
+            'outer': {'members': ['inner'] + hosts},
+            'inner': {'members': list(apps)}
+        }
+        _policies.Policies._validate_and_update_groups(scaling_groups,
+                                                       node_templates)
+        self.assertEqual(hosts, scaling_groups['outer']['members'])
+        self.assertEqual(apps, scaling_groups['inner']['members'])
+
     def assert_removal(self, groups, nodes, expected):
         blueprint = base_blueprint(groups=groups, nodes=nodes)
         plan = self.parse(blueprint)
@@ -658,6 +703,22 @@ class TestScalingPoliciesAndGroupsValidation(AbstractTestParser):
             groups=groups,
             nodes=nodes)
 
+    def test_validate_non_contained_group_members4(self):
+        groups = {
+            'group': ['node3', 'node4', 'node5']
+        }
+        nodes = {
+            'node1': None,
+            'node2': None,
+            'node3': 'node1',
+            'node4': 'node1',
+            'node5': 'node2'
+        }
+        self.assert_validation(
+            expected_error_code=exceptions.ERROR_NON_CONTAINED_GROUP_MEMBERS,
+            groups=groups,
+            nodes=nodes)
+
     def test_validate_policies_spec_version(self):
         nodes = {
             'node': None
@@ -0,0 +1,134 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import threading
+import time
+
+from dsl_parser import functions
+from dsl_parser.import_resolver.abstract_import_resolver import \
+    AbstractImportResolver
+from dsl_parser.parser import parse as dsl_parse
+from dsl_parser.tasks import prepare_deployment_plan
+from dsl_parser.tests.abstract_test_parser import (AbstractTestParser,
+                                                   timeout)
+
+THREADS = 8
+PARSES_PER_THREAD = 4
+TYPES = 3
+
+
+class SlowImportResolver(AbstractImportResolver):
+
+    def __init__(self, imports, latency=0.01):
+        self.imports = imports
+        self.latency = latency
+
+    def resolve(self, import_url):
+        # imports are I/O bound, and are fetched while other threads parse
+        time.sleep(self.latency)
+        return self.imports[import_url]
+
+
+def suffix_function(suffix):
+
+    class Suffix(functions.Function):
+
+        def parse_args(self, args):
+            self.arg = args
+
+        def validate(self, plan):
+            pass
+
+        def evaluate(self, plan):
+            return '{0}-{1}'.format(self.arg, suffix)
+
+        def evaluate_runtime(self, storage):
+            return self.evaluate(plan=None)
+
+    return Suffix
+
+
+class TestConcurrentParse(AbstractTestParser):
+
+    imports = dict(
+        ('http://example.com/types{0}.yaml'.format(i), """
+node_types:
+    type{0}:
+        properties:
+            key:
+                default: {{ suffix: key{0} }}
+""".format(i))
+        for i in range(TYPES))
+
+    blueprint = AbstractTestParser.BASIC_VERSION_SECTION_DSL_1_3 + """
+imports:
+""" + ''.join('    - {0}\n'.format(url) for url in sorted(imports)) + """
+node_templates:
+""" + ''.join("""    node{0}:
+        type: type{0}
+""".format(i) for i in range(TYPES)) + """
+outputs:
+    output:
+        value: { suffix: output }
+"""
+
+    def _parse_and_prepare(self, suffix):
+        template_functions = {'suffix': suffix_function(suffix)}
+        plan = dsl_parse(self.blueprint,
+                         resolver=SlowImportResolver(self.imports),
+                         template_functions=template_functions)
+        return prepare_deployment_plan(plan,
+                                       template_functions=template_functions)
+
+    def _assert_plan(self, plan, suffix):
+        properties = dict((node['id'], node['properties']['key'])
+                          for node in plan['nodes'])
+        self.assertEqual(
+            dict(('node{0}'.format(i), 'key{0}-{1}'.format(i, suffix))
+                 for i in range(TYPES)),
+            properties)
+        self.assertEqual('output-{0}'.format(suffix),
+                         plan['outputs']['output']['value'])
+        self.assertEqual(TYPES, len(plan['node_instances']))
+
+    @timeout(seconds=60)
+    def test_concurrent_parses(self):
+        errors = []
+
+        def parse_in_thread(thread_index):
+            try:
+                for i in range(PARSES_PER_THREAD):
+                    suffix = '{0}.{1}'.format(thread_index, i)
+                    self._assert_plan(self._parse_and_prepare(suffix),
+                                      suffix)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=parse_in_thread, args=(i,))
+                   for i in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        # the function was only available to the parses using it
+        self.assertIsNone(functions.get_function('suffix'))
+
+    def test_template_functions_not_registered(self):
+        plan = prepare_deployment_plan(
+            dsl_parse(self.blueprint,
+                      resolver=SlowImportResolver(self.imports, latency=0)))
+        self.assertEqual({'suffix': 'output'},
+                         plan['outputs']['output']['value'])
@@ -13,8 +13,10 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
-from dsl_parser.tests.abstract_test_parser import AbstractTestParser
-from dsl_parser import exceptions
+from dsl_parser.tests.abstract_test_parser import (AbstractTestParser,
+                                                   timeout)
+from dsl_parser import (exceptions,
+                        utils)
 from dsl_parser.exceptions import DSLParsingLogicException
 
 
@@ -705,3 +707,113 @@ node_templates:
         properties = self.parse_1_2(yaml)['nodes'][0]['properties']
         self.assertEqual(properties['prop1']['prop1'], 'value1')
         self.assertEqual(properties['prop2']['prop2'], 'value2')
+
+    def test_default_values_not_shared_between_node_templates(self):
+        yaml = """
+data_types:
+    data1:
+        properties:
+            inner:
+                default: [1, 2]
+node_types:
+    type1:
+        properties:
+            prop1:
+                type: data1
+            prop2:
+                default:
+                    key: [value]
+node_templates:
+    node1:
+        type: type1
+    node2:
+        type: type1
+"""
+        node1, node2 = self.parse_1_2(yaml)['nodes']
+        self.assertEqual({'prop1': {'inner': [1, 2]},
+                          'prop2': {'key': ['value']}},
+                         node1['properties'])
+        self.assertEqual(node1['properties'], node2['properties'])
+        self.assertIsNot(node1['properties']['prop1']['inner'],
+                         node2['properties']['prop1']['inner'])
+        self.assertIsNot(node1['properties']['prop2'],
+                         node2['properties']['prop2'])
+        self.assertIsNot(node1['properties']['prop2']['key'],
+                         node2['properties']['prop2']['key'])
+
+    def test_compiled_properties_schemas(self):
+        data_types = {
+            'data1': {
+                'properties': {
+                    'inner': {'type': 'integer', 'default': 1},
+                    'other': {'required': False}
+                }
+            }
+        }
+        schema_properties = {
+            'prop1': {'type': 'data1', 'default': {'inner': 2}},
+            'prop2': {'type': 'string'},
+        }
+        schemas = utils.PropertiesSchemas(data_types)
+        schema = schemas.compile(schema_properties, key='type1')
+        self.assertIs(schema, schemas.compile({}, key='type1'))
+        self.assertIsNot(schema, schemas.compile(schema_properties))
+
+        def merge(instance_properties):
+            return schema.merge(
+                instance_properties=instance_properties,
+                undefined_property_error_message='{0} {1} undefined',
+                missing_property_error_message='{0} {1} missing',
+                node_name='node')
+
+        self.assertEqual({'prop1': {'inner': 2}, 'prop2': 'value'},
+                         merge({'prop2': 'value'}))
+        self.assertEqual({'prop1': {'inner': 3, 'other': 'value'},
+                          'prop2': {'get_input': 'input'}},
+                         merge({'prop1': {'inner': 3, 'other': 'value'},
+                                'prop2': {'get_input': 'input'}}))
+        ex = self.assertRaises(DSLParsingLogicException,
+                               merge, {'prop2': 'value', 'prop3': 'value'})
+        self.assertEqual(106, ex.err_code)
+        self.assertEqual('node prop3 undefined', str(ex))
+        ex = self.assertRaises(DSLParsingLogicException, merge, {})
+        self.assertEqual(107, ex.err_code)
+        self.assertEqual('node prop2 missing', str(ex))
+        ex = self.assertRaises(DSLParsingLogicException,
+                               merge, {'prop1': {'inner': 'value'},
+                                       'prop2': 'value'})
+        self.assertEqual(exceptions.ERROR_VALUE_DOES_NOT_MATCH_TYPE,
+                         ex.err_code)
+        self.assertIn("property 'prop1.inner' type is 'integer'", str(ex))
+
+    @timeout(seconds=30)
+    def test_deep_data_types_hierarchy(self):
+        depth = 100
+        data_types = []
+        for i in range(depth):
+            data_type = """
+    data{0}:
+        properties:
+            prop:
+                default: value{0}""".format(i)
+            if i:
+                data_type += """
+            inner:
+                type: data{0}""".format(i - 1)
+            data_types.append(data_type)
+        yaml = """
+data_types:{0}
+node_types:
+    type:
+        properties:
+            prop:
+                type: data{1}
+node_templates:
+    node:
+        type: type
+""".format(''.join(reversed(data_types)), depth - 1)
+        properties = self.parse_1_2(yaml)['nodes'][0]['properties']
+        for i in reversed(range(depth)):
+            properties = properties['prop'] if i == depth - 1 \
+                else properties['inner']
+            self.assertEqual('value{0}'.format(i), properties['prop'])
@@ -175,6 +175,31 @@ class TestDefaultResolver(testtools.TestCase):
             partial_err_msg="Unable to open import url {0}"
             .format(ILLEGAL_URL))
 
+    def test_probe_import_single_attempt(self):
+        attempts = []
+
+        class Response(object):
+            status_code = 500
+            text = 'internal server error'
+
+        def timeout(url, timeout):
+            attempts.append(url)
+            raise requests.ConnectionError('Timeout while trying to import')
+
+        def internal_error(url, timeout):
+            attempts.append(url)
+            return Response()
+
+        resolver = DefaultImportResolver(
+            rules=[{ORIGINAL_V1_PREFIX: VALID_V1_PREFIX}])
+        for requests_get in [timeout, internal_error]:
+            del attempts[:]
+            with mock.patch('requests.get', new=requests_get, create=True):
+                self.assertRaises(DSLParsingLogicException,
+                                  resolver.probe_import, ORIGINAL_V1_URL)
+            # one attempt using the rule, and one using the original url
+            self.assertEqual([VALID_V1_URL, ORIGINAL_V1_URL], attempts)
+
     def _test_default_resolver(self, import_url, rules,
                                expected_urls_to_resolve=[],
                                expected_failure=False,
@@ -14,7 +14,10 @@
 #    * limitations under the License.
 
 import collections
+import copy
+import json
 
+import mock
 import testtools.testcase
 
 from dsl_parser import constants
@@ -494,6 +497,488 @@ class TestEvaluateFunctions(AbstractTestParser):
                                          None)
 
 
+class TestEvaluationTemplate(AbstractTestParser):
+
+    def setUp(self):
+        super(TestEvaluationTemplate, self).setUp()
+        self.node_instances = {
+            'node1': NodeInstance({'id': 'node1',
+                                   'node_id': 'webserver',
+                                   'runtime_properties': {'a': 'a_val'}}),
+            'node2': NodeInstance({'id': 'node2',
+                                   'node_id': 'db',
+                                   'runtime_properties': {'b': 'b_val'}}),
+        }
+
+    def get_node_instances(self, node_id):
+        return [i for i in self.node_instances.values()
+                if i.node_id == node_id]
+
+    def get_node_instance(self, node_instance_id):
+        return self.node_instances[node_instance_id]
+
+    @staticmethod
+    def get_node(node_id):
+        return Node({'id': node_id})
+
+    def _storage(self):
+        return functions.RuntimeEvaluationStorage(
+            get_node_instances_method=self.get_node_instances,
+            get_node_instance_method=self.get_node_instance,
+            get_node_method=self.get_node)
+
+    @staticmethod
+    def _payload():
+        return {
+            'a': {'get_attribute': ['SELF', 'a']},
+            'const': {'x': [1, 2, {'y': 'z'}]},
+            'nested': {
+                'list': ['item', {'get_attribute': ['db', 'b']}],
+                'concat': {'concat': [{'get_attribute': ['SELF', 'a']},
+                                      '-',
+                                      {'get_attribute': ['db', 'b']}]}
+            }
+        }
+
+    def test_evaluate(self):
+        template = functions.compile_evaluation_template(self._payload())
+        self.assertEqual(3, len(template.slots))
+        result = template.evaluate(self._storage(), {'self': 'node1'})
+        expected = self._payload()
+        functions.evaluate_functions(expected, {'self': 'node1'},
+                                     self.get_node_instances,
+                                     self.get_node_instance,
+                                     self.get_node)
+        self.assertEqual(expected, result)
+        self.assertEqual('a_val-b_val', result['nested']['concat'])
+
+    def test_template_reusable(self):
+        payload = self._payload()
+        template = functions.compile_evaluation_template(payload)
+        payload['a'] = 'changed'
+        first = template.evaluate(self._storage(), {'self': 'node1'})
+        first['const']['x'].append(3)
+        self.node_instances['node1'].runtime_properties['a'] = 'new_val'
+        second = template.evaluate(self._storage(), {'self': 'node1'})
+        self.assertEqual('a_val', first['a'])
+        self.assertEqual('new_val', second['a'])
+        self.assertEqual('new_val-b_val', second['nested']['concat'])
+        self.assertEqual([1, 2, {'y': 'z'}], second['const']['x'])
+
+    def test_serialize(self):
+        template = functions.compile_evaluation_template(self._payload())
+        serialized = json.loads(json.dumps(template.serialize()))
+        restored = functions.EvaluationTemplate.deserialize(serialized)
+        self.assertEqual(template.slots, restored.slots)
+        self.assertEqual(
+            template.evaluate(self._storage(), {'self': 'node1'}),
+            restored.evaluate(self._storage(), {'self': 'node1'}))
+
+    def test_evaluation_error_path(self):
+        template = functions.compile_evaluation_template(
+            {'x': [{'get_attribute': ['SELF', 'a']}]})
+        with testtools.testcase.ExpectedException(
+                exceptions.FunctionEvaluationError,
+                '.*SELF is missing.*payload.x\\[0\\].*'):
+            template.evaluate(self._storage(), {})
+
+
+class TestBulkEvaluation(AbstractTestParser):
+
+    NODES_COUNT = 50
+
+    def setUp(self):
+        super(TestBulkEvaluation, self).setUp()
+        self.storage = CountingStorage()
+        for i in range(self.NODES_COUNT):
+            node_id = 'node{0}'.format(i)
+            runtime_properties = {'key': i} if i % 2 == 0 else {}
+            self.storage.add(
+                Node({'id': node_id, 'properties': {'key': 'default'}}),
+                NodeInstance({'id': '{0}_1'.format(node_id),
+                              'node_id': node_id,
+                              'runtime_properties': runtime_properties}))
+        self.outputs = dict(
+            ('output{0}'.format(i),
+             {'value': {'get_attribute': ['node{0}'.format(i), 'key']}})
+            for i in range(self.NODES_COUNT))
+
+    def _evaluate_outputs(self, bulk):
+        kwargs = {}
+        if bulk:
+            kwargs = {
+                'get_node_instances_bulk_method':
+                    self.storage.get_node_instances_bulk,
+                'get_node_instance_bulk_method':
+                    self.storage.get_node_instance_bulk,
+                'get_node_bulk_method': self.storage.get_node_bulk
+            }
+        return functions.evaluate_outputs(
+            self.outputs,
+            self.storage.get_node_instances,
+            self.storage.get_node_instance,
+            self.storage.get_node,
+            **kwargs)
+
+    def test_no_bulk_methods(self):
+        outputs = self._evaluate_outputs(bulk=False)
+        self.assertEqual(0, outputs['output0'])
+        self.assertEqual('default', outputs['output1'])
+        self.assertEqual(self.NODES_COUNT,
+                         self.storage.calls['get_node_instances'])
+        self.assertEqual(self.NODES_COUNT / 2,
+                         self.storage.calls['get_node'])
+
+    def test_bulk_methods(self):
+        outputs = self._evaluate_outputs(bulk=True)
+        self.assertEqual(self._evaluate_outputs(bulk=False), outputs)
+        self.storage.calls.clear()
+        self._evaluate_outputs(bulk=True)
+        self.assertEqual({'get_node_instances_bulk': 1,
+                          'get_node_bulk': 1},
+                         self.storage.calls)
+
+    def test_bulk_methods_with_context(self):
+        payload = {
+            'a': {'get_attribute': ['SELF', 'key']},
+            'b': {'concat': [{'get_attribute': ['TARGET', 'key']},
+                             {'get_attribute': ['node2', 'key']}]}
+        }
+        functions.evaluate_functions(
+            payload,
+            {'self': 'node0_1', 'target': 'node1_1'},
+            self.storage.get_node_instances,
+            self.storage.get_node_instance,
+            self.storage.get_node,
+            get_node_instances_bulk_method=(
+                self.storage.get_node_instances_bulk),
+            get_node_instance_bulk_method=self.storage.get_node_instance_bulk,
+            get_node_bulk_method=self.storage.get_node_bulk)
+        self.assertEqual({'a': 0, 'b': 'default2'}, payload)
+        self.assertEqual({'get_node_instances_bulk': 1,
+                          'get_node_instance_bulk': 1,
+                          'get_node_bulk': 1},
+                         self.storage.calls)
+
+    def test_template_prefetch(self):
+        template = functions.compile_evaluation_template(
+            dict((k, v['value']) for k, v in self.outputs.items()))
+        storage = functions.RuntimeEvaluationStorage(
+            get_node_instances_method=self.storage.get_node_instances,
+            get_node_instance_method=self.storage.get_node_instance,
+            get_node_method=self.storage.get_node,
+            get_node_instances_bulk_method=(
+                self.storage.get_node_instances_bulk),
+            get_node_bulk_method=self.storage.get_node_bulk)
+        result = template.evaluate(storage)
+        self.assertEqual(self._evaluate_outputs(bulk=False), result)
+        self.assertEqual(1, self.storage.calls['get_node_instances_bulk'])
+        self.assertEqual(1, self.storage.calls['get_node_bulk'])
+
+    def test_template_references_recorded_once(self):
+        payload = dict((k, v['value']) for k, v in self.outputs.items())
+        # node0_1 is only referenced through the context
+        del payload['output0']
+        payload['self'] = {'get_attribute': ['SELF', 'key']}
+        template = functions.compile_evaluation_template(payload)
+        storage = functions.RuntimeEvaluationStorage(
+            get_node_instances_method=self.storage.get_node_instances,
+            get_node_instance_method=self.storage.get_node_instance,
+            get_node_method=self.storage.get_node,
+            get_node_instances_bulk_method=(
+                self.storage.get_node_instances_bulk),
+            get_node_instance_bulk_method=self.storage.get_node_instance_bulk,
+            get_node_bulk_method=self.storage.get_node_bulk)
+        with mock.patch('dsl_parser.functions._runtime_reference_keys') \
+                as runtime_reference_keys:
+            result = template.evaluate(storage, {'self': 'node0_1'})
+        # the payload is not scanned for references on each evaluation
+        self.assertFalse(runtime_reference_keys.called)
+        self.assertEqual(0, result['self'])
+        self.assertEqual({'get_node_instances_bulk': 1,
+                          'get_node_instance_bulk': 1,
+                          'get_node_bulk': 1},
+                         self.storage.calls)
+
+
+class TestRuntimeEvaluationCache(AbstractTestParser):
+
+    def setUp(self):
+        super(TestRuntimeEvaluationCache, self).setUp()
+        self.now = 0
+        self.storage = CountingStorage()
+        for node_id in ['node1', 'node2']:
+            self.storage.add(
+                Node({'id': node_id}),
+                NodeInstance({'id': '{0}_1'.format(node_id),
+                              'node_id': node_id,
+                              'runtime_properties': {'key': node_id}}))
+
+    def _cache(self, **kwargs):
+        return functions.RuntimeEvaluationCache(clock=lambda: self.now,
+                                                **kwargs)
+
+    def _evaluate(self, cache):
+        payload = {
+            'a': {'get_attribute': ['SELF', 'key']},
+            'b': {'get_attribute': ['node2', 'key']}
+        }
+        return functions.evaluate_functions(
+            payload, {'self': 'node1_1'},
+            self.storage.get_node_instances,
+            self.storage.get_node_instance,
+            self.storage.get_node,
+            cache=cache)
+
+    def test_shared_between_evaluations(self):
+        cache = self._cache()
+        for _ in range(3):
+            self.assertEqual({'a': 'node1', 'b': 'node2'},
+                             self._evaluate(cache))
+        self.assertEqual({'get_node_instance': 1,
+                          'get_node_instances': 1},
+                         self.storage.calls)
+
+    def test_ttl(self):
+        cache = self._cache(ttl=10)
+        self._evaluate(cache)
+        self.now = 9
+        self._evaluate(cache)
+        self.assertEqual(1, self.storage.calls['get_node_instance'])
+        self.now = 10
+        self._evaluate(cache)
+        self.assertEqual(2, self.storage.calls['get_node_instance'])
+
+    def test_entry_ttl(self):
+        cache = self._cache(ttl=10)
+        cache.set(cache.NODE, 'node', 'value', ttl=1)
+        cache.set(cache.NODE, 'other_node', 'value')
+        self.now = 1
+        self.assertIsNone(cache.get(cache.NODE, 'node'))
+        self.assertEqual('value', cache.get(cache.NODE, 'other_node'))
+
+    def test_invalidate_node_instance(self):
+        cache = self._cache()
+        self._evaluate(cache)
+        self.storage.add(
+            Node({'id': 'node2'}),
+            NodeInstance({'id': 'node2_1',
+                          'node_id': 'node2',
+                          'runtime_properties': {'key': 'new_value'}}))
+        self.assertEqual('node2', self._evaluate(cache)['b'])
+        cache.invalidate_node_instance('node2_1')
+        self.assertEqual('new_value', self._evaluate(cache)['b'])
+        self.assertEqual(1, self.storage.calls['get_node_instance'])
+        self.assertEqual(2, self.storage.calls['get_node_instances'])
+
+    def test_cached_values_not_shared_with_results(self):
+        self.storage.add(
+            Node({'id': 'node3', 'properties': {'list': [1]}}),
+            NodeInstance({'id': 'node3_1',
+                          'node_id': 'node3',
+                          'runtime_properties': {'cfg': {'port': 1}}}))
+        cache = self._cache()
+        payload = {
+            'cfg': {'get_attribute': ['SELF', 'cfg']},
+            'list': {'get_attribute': ['SELF', 'list']}
+        }
+        for _ in range(2):
+            result = functions.evaluate_functions(
+                copy.deepcopy(payload), {'self': 'node3_1'},
+                self.storage.get_node_instances,
+                self.storage.get_node_instance,
+                self.storage.get_node,
+                cache=cache)
+            self.assertEqual({'cfg': {'port': 1}, 'list': [1]}, result)
+            result['cfg']['port'] = 999
+            result['list'].append(2)
+        self.assertEqual(1, self.storage.calls['get_node_instance'])
+
+    def test_max_size(self):
+        cache = self._cache(max_size=2)
+        for key in ['a', 'b', 'c']:
+            cache.set(cache.NODE, key, key)
+            # mark 'a' as recently used
+            cache.get(cache.NODE, 'a')
+        self.assertEqual(2, len(cache))
+        self.assertEqual('a', cache.get(cache.NODE, 'a'))
+        self.assertIsNone(cache.get(cache.NODE, 'b'))
+        self.assertEqual('c', cache.get(cache.NODE, 'c'))
+
+
+class TestScalingGroupResolutionIndex(AbstractTestParser):
+
+    GROUP_INSTANCES = 100
+
+    def setUp(self):
+        super(TestScalingGroupResolutionIndex, self).setUp()
+        self.storage = CountingStorage()
+        contained_in = [{'target_id': 'host',
+                         'type_hierarchy': [constants.CONTAINED_IN_REL_TYPE]}]
+        host_instances = []
+        app_instances = []
+        db_instances = []
+        for i in range(self.GROUP_INSTANCES):
+            host_instances.append(NodeInstance({
+                'id': 'host_{0}'.format(i),
+                'node_id': 'host',
+                'runtime_properties': {'key': 'host{0}'.format(i)},
+                'scaling_groups': [{'name': 'group',
+                                    'id': 'group_{0}'.format(i)}]}))
+            for node_id, instances in [('app', app_instances),
+                                       ('db', db_instances)]:
+                instances.append(NodeInstance({
+                    'id': '{0}_{1}'.format(node_id, i),
+                    'node_id': node_id,
+                    'relationships': [{'target_name': 'host',
+                                       'target_id': 'host_{0}'.format(i)}],
+                    'runtime_properties': {'key': i}}))
+        self.storage.add(Node({'id': 'host'}), *host_instances)
+        self.storage.add(Node({'id': 'app', 'relationships': contained_in}),
+                         *app_instances)
+        self.storage.add(Node({'id': 'db', 'relationships': contained_in}),
+                         *db_instances)
+
+    def _storage(self, cache=None):
+        return functions.RuntimeEvaluationStorage(
+            get_node_instances_method=self.storage.get_node_instances,
+            get_node_instance_method=self.storage.get_node_instance,
+            get_node_method=self.storage.get_node,
+            cache=cache)
+
+    def _scale_out(self):
+        i = self.GROUP_INSTANCES
+        self.storage.add(self.storage.nodes['host'], NodeInstance({
+            'id': 'host_{0}'.format(i),
+            'node_id': 'host',
+            'runtime_properties': {'key': 'host{0}'.format(i)},
+            'scaling_groups': [{'name': 'group',
+                                'id': 'group_{0}'.format(i)}]}))
+        for node_id in ['app', 'db']:
+            self.storage.add(self.storage.nodes[node_id], NodeInstance({
+                'id': '{0}_{1}'.format(node_id, i),
+                'node_id': node_id,
+                'relationships': [{'target_name': 'host',
+                                   'target_id': 'host_{0}'.format(i)}],
+                'runtime_properties': {'key': i}}))
+
+    def _evaluate_app(self, storage, index):
+        template = functions.compile_evaluation_template({
+            'app': {'get_attribute': ['app', 'key']}
+        })
+        return template.evaluate(storage,
+                                 {'self': 'db_{0}'.format(index)})['app']
+
+    def test_resolution(self):
+        template = functions.compile_evaluation_template({
+            'app': {'get_attribute': ['app', 'key']},
+            'host': {'get_attribute': ['host', 'key']}
+        })
+        storage = self._storage()
+        for i in range(self.GROUP_INSTANCES):
+            result = template.evaluate(storage,
+                                       {'self': 'db_{0}'.format(i)})
+            self.assertEqual(i, result['app'])
+            self.assertEqual('host{0}'.format(i), result['host'])
+
+    def test_indexes_follow_invalidation(self):
+        cache = functions.RuntimeEvaluationCache()
+        storage = self._storage(cache)
+        self.assertEqual(0, self._evaluate_app(storage, 0))
+        self._scale_out()
+        for node_id in ['host', 'app', 'db']:
+            cache.invalidate_node(node_id)
+        self.assertEqual(self.GROUP_INSTANCES,
+                         self._evaluate_app(storage, self.GROUP_INSTANCES))
+        self.assertEqual(0, self._evaluate_app(storage, 0))
+
+    def test_indexes_expire_with_their_entries(self):
+        now = [0]
+        cache = functions.RuntimeEvaluationCache(ttl=10,
+                                                 clock=lambda: now[0])
+        storage = self._storage(cache)
+        self.assertEqual(0, self._evaluate_app(storage, 0))
+        self._scale_out()
+        now[0] = 10
+        self.assertEqual(self.GROUP_INSTANCES,
+                         self._evaluate_app(storage, self.GROUP_INSTANCES))
+
+    def test_derived_entries_removed_with_dependencies(self):
+        cache = functions.RuntimeEvaluationCache()
+        cache.set(cache.NODE, 'node', 'node')
+        cache.set(cache.NODE_INSTANCE, 'node_1', 'node_1')
+        cache.set(cache.CONTAINING_GROUP_INSTANCES, 'node_1', [],
+                  depends_on=[(cache.NODE, 'node'),
+                              (cache.NODE_INSTANCE, 'node_1')])
+        cache.set(cache.CONTAINING_GROUP_INSTANCES, 'node_2', [],
+                  depends_on=[(cache.NODE_INSTANCE, 'node_2')])
+        self.assertEqual([], cache.get(cache.CONTAINING_GROUP_INSTANCES,
+                                       'node_1'))
+        # not cached, as node_2 is not
+        self.assertIsNone(cache.get(cache.CONTAINING_GROUP_INSTANCES,
+                                    'node_2'))
+        cache.invalidate_node('node')
+        self.assertIsNone(cache.get(cache.CONTAINING_GROUP_INSTANCES,
+                                    'node_1'))
+        self.assertEqual(1, len(cache))
+
+    def test_containment_walked_once_per_instance(self):
+        original = functions.RuntimeEvaluationStorage._parent_node_instance
+        storage = self._storage()
+        payload = dict(('key{0}'.format(i),
+                        {'get_attribute': ['app', 'key']})
+                       for i in range(10))
+        with mock.patch.object(functions.RuntimeEvaluationStorage,
+                               '_parent_node_instance',
+                               autospec=True,
+                               side_effect=original) as parent_node_instance:
+            template = functions.compile_evaluation_template(payload)
+            for i in range(self.GROUP_INSTANCES):
+                template.evaluate(storage, {'self': 'db_{0}'.format(i)})
+        # each app, db and host instance is walked exactly once
+        self.assertEqual(3 * self.GROUP_INSTANCES,
+                         parent_node_instance.call_count)
+
+
+class CountingStorage(object):
+
+    def __init__(self):
+        self.nodes = {}
+        self.node_instances = {}
+        self.calls = collections.defaultdict(int)
+
+    def add(self, node, *node_instances):
+        self.nodes[node.id] = node
+        for node_instance in node_instances:
+            self.node_instances[node_instance.id] = node_instance
+
+    def get_node_instances(self, node_id):
+        self.calls['get_node_instances'] += 1
+        return [i for i in self.node_instances.values()
+                if i.node_id == node_id]
+
+    def get_node_instance(self, node_instance_id):
+        self.calls['get_node_instance'] += 1
+        return self.node_instances[node_instance_id]
+
+    def get_node(self, node_id):
+        self.calls['get_node'] += 1
+        return self.nodes[node_id]
+
+    def get_node_instances_bulk(self, node_ids):
+        self.calls['get_node_instances_bulk'] += 1
+        return [i for i in self.node_instances.values()
+                if i.node_id in node_ids]
+
+    def get_node_instance_bulk(self, node_instance_ids):
+        self.calls['get_node_instance_bulk'] += 1
+        return [self.node_instances[i] for i in node_instance_ids]
+
+    def get_node_bulk(self, node_ids):
+        self.calls['get_node_bulk'] += 1
+        return [self.nodes[n] for n in node_ids]
+
+
 class NodeInstance(dict):
 
     def __init__(self, values):
@@ -13,6 +13,8 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import mock
+
 from dsl_parser import exceptions
 from dsl_parser import functions
 from dsl_parser.tasks import prepare_deployment_plan
@@ -321,6 +323,75 @@ outputs:
         self.assertEqual('http', outputs['protocol'])
         self.assertIsNone(outputs['none'])
 
+    def _test_evaluate_outputs_batch(self, max_workers):
+        outputs_def = {
+            'port': {'value': {'get_attribute': ['webserver', 'port']}},
+            'endpoint': {
+                'value': {
+                    'port': {'get_attribute': ['webserver', 'port']}
+                }
+            }
+        }
+        other_outputs_def = {
+            'ip': {'value': {'get_attribute': ['webserver', 'ip']}}
+        }
+
+        def storage(deployment_index):
+            def get_node_instances(node_id=None):
+                if deployment_index == 3:
+                    return []
+                return [NodeInstance({
+                    'id': 'webserver1',
+                    'node_id': 'webserver',
+                    'runtime_properties': {
+                        'port': 8080 + deployment_index,
+                        'ip': '10.0.0.{0}'.format(deployment_index)
+                    }
+                })]
+            return functions.RuntimeEvaluationStorage(
+                get_node_instances_method=get_node_instances,
+                get_node_instance_method=None,
+                get_node_method=None)
+
+        deployments_outputs = dict(
+            ('d{0}'.format(i), (outputs_def.copy(), storage(i)))
+            for i in range(5))
+        deployments_outputs['other'] = (other_outputs_def, storage(0))
+
+        with mock.patch.object(
+                functions, 'compile_evaluation_template',
+                wraps=functions.compile_evaluation_template) as compile_mock:
+            results = functions.evaluate_outputs_batch(
+                deployments_outputs, max_workers=max_workers)
+        self.assertEqual(2, compile_mock.call_count)
+
+        self.assertEqual(6, len(results))
+        for i in [0, 1, 2, 4]:
+            result = results['d{0}'.format(i)]
+            self.assertIsNone(result['error'])
+            self.assertEqual({'port': 8080 + i,
+                              'endpoint': {'port': 8080 + i}},
+                             result['outputs'])
+        self.assertIsNone(results['d3']['outputs'])
+        self.assertIsInstance(results['d3']['error'],
+                              exceptions.FunctionEvaluationError)
+        self.assertEqual({'ip': '10.0.0.0'}, results['other']['outputs'])
+
+    def test_evaluate_outputs_batch(self):
+        self._test_evaluate_outputs_batch(max_workers=None)
+
+    def test_evaluate_outputs_batch_threads(self):
+        self._test_evaluate_outputs_batch(max_workers=4)
+
+    def test_evaluate_outputs_batch_invalid_definition(self):
+        storage = functions.RuntimeEvaluationStorage(None, None, None)
+        results = functions.evaluate_outputs_batch({
+            'valid': ({'port': {'value': 1}}, storage),
+            'invalid': ({'port': {}}, storage)
+        })
+        self.assertEqual({'port': 1}, results['valid']['outputs'])
+        self.assertIsInstance(results['invalid']['error'], KeyError)
+
 
 class NodeInstance(dict):
 
@@ -13,6 +13,12 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import urllib2
+
+import requests
+
+from dsl_parser import exceptions
+from dsl_parser.elements.imports import ImportsCache
 from dsl_parser.tests.abstract_test_parser import AbstractTestParser
 from dsl_parser.import_resolver.abstract_import_resolver import \
     AbstractImportResolver
@@ -61,3 +67,64 @@ imports:
         self.assertEqual(len(urls), 2)
         self.assertIn('http://url1', urls)
         self.assertIn('http://url2', urls)
+
+    def _probe_blueprint(self, resolver):
+        return self.parse("""
+imports:
+    -   http://blueprints/types.yaml
+node_templates:
+    resolver_2:
+        type: resolver_type_2""",
+                          resources_base_url='http://resources/',
+                          resolver=resolver)
+
+    def test_probe_errors_fall_back_to_resources_base_url(self):
+        imports = {
+            'http://blueprints/types.yaml': """
+imports:
+    -   node_types.yaml""",
+            'http://resources/node_types.yaml': BLUEPRINT_2
+        }
+        for error in [
+                exceptions.DSLParsingLogicException(13, 'missing'),
+                urllib2.HTTPError('http://blueprints/node_types.yaml',
+                                  503, 'unavailable', None, None),
+                requests.ConnectionError('unreachable')]:
+
+            class CustomResolver(AbstractImportResolver):
+                def resolve(self, url):
+                    if url not in imports:
+                        raise error
+                    return imports[url]
+            result = self._probe_blueprint(CustomResolver())
+            self.assertEqual('default',
+                             result['nodes'][0]['properties']['key'])
+
+    def test_probe_programming_errors_raised(self):
+        class BrokenResolver(AbstractImportResolver):
+            def resolve(self, url):
+                if url == 'http://blueprints/types.yaml':
+                    return """
+imports:
+    -   node_types.yaml"""
+                raise TypeError('broken resolver')
+        self.assertRaises(TypeError, self._probe_blueprint, BrokenResolver())
+
+    def test_imports_cache_per_resolver(self):
+        yaml_to_parse = """
+imports:
+    -   http://url1"""
+
+        class CustomResolver(AbstractImportResolver):
+            def __init__(self, value):
+                self.value = value
+
+            def resolve(self, url):
+                return BLUEPRINT_1.replace('value_1', self.value)
+        imports_cache = ImportsCache()
+        for value in ['value_1', 'value_2']:
+            result = self.parse(yaml_to_parse,
+                                resolver=CustomResolver(value),
+                                imports_cache=imports_cache)
+            self.assertEqual(value,
+                             result['nodes'][0]['properties']['key'])
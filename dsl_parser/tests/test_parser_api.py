@@ -13,20 +13,33 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import copy
+import json
 import os
+import pickle
 import socket
 import StringIO
 import yaml as yml
 from urllib2 import HTTPError
 from urllib import pathname2url
 
+from mock import patch
+
 from dsl_parser import exceptions
 from dsl_parser import constants
 from dsl_parser import version
 from dsl_parser import models
+from dsl_parser import utils
+from dsl_parser.elements.imports import ImportsCache
+from dsl_parser.import_resolver.abstract_import_resolver import (
+    MAX_NUMBER_RETRIES,
+    read_import)
+from dsl_parser.import_resolver.default_import_resolver import \
+    DefaultImportResolver
 from dsl_parser.tests.abstract_test_parser import AbstractTestParser
 from dsl_parser.parser import parse_from_path, parse_from_url
 from dsl_parser.parser import parse as dsl_parse
+from dsl_parser.tasks import prepare_deployment_plan
 from dsl_parser.interfaces.constants import NO_OP
 from dsl_parser.interfaces.utils import operation_mapping
 from dsl_parser.constants import TYPE_HIERARCHY
@@ -557,6 +570,89 @@ node_types:
         self.assertEqual('test_type_parent', node[TYPE_HIERARCHY][1])
         self.assertEqual('test_type', node[TYPE_HIERARCHY][2])
 
+    def test_types_hierarchy_shared(self):
+        yaml = self.BASIC_NODE_TEMPLATES_SECTION + """
+    test_node2:
+        type: test_type
+        relationships:
+            -   type: test_relationship
+                target: test_node
+node_types:
+    test_type:
+        derived_from: test_type_parent
+        properties:
+            key:
+                default: "not_val"
+    test_type_parent: {}
+relationships:
+    test_relationship: {}
+    """
+        result = self.parse(yaml)
+        nodes = dict((node['id'], node) for node in result['nodes'])
+        type_hierarchy = nodes['test_node'][TYPE_HIERARCHY]
+        self.assertIs(type_hierarchy, nodes['test_node2'][TYPE_HIERARCHY])
+        self.assertIs(type_hierarchy,
+                      models.TypeHierarchy.of(['test_type_parent',
+                                               'test_type']))
+        self.assertIs(
+            result['relationships']['test_relationship'][TYPE_HIERARCHY],
+            nodes['test_node2']['relationships'][0][TYPE_HIERARCHY])
+        self.assertIs(type_hierarchy, copy.deepcopy(type_hierarchy))
+
+        self.assertIn('test_type_parent', type_hierarchy)
+        self.assertNotIn('test_relationship', type_hierarchy)
+        self.assertNotIn({}, type_hierarchy)
+        self.assertEqual(['test_type_parent', 'test_type'], type_hierarchy)
+        self.assertEqual('["test_type_parent", "test_type"]',
+                         json.dumps(type_hierarchy))
+        self.assertEqual(type_hierarchy,
+                         pickle.loads(pickle.dumps(type_hierarchy)))
+        self.assertRaises(TypeError, type_hierarchy.append, 'test')
+        self.assertRaises(TypeError, type_hierarchy.__setitem__, 0, 'test')
+
+    def test_types_hierarchy_serialized_as_lists(self):
+        yaml = self.BASIC_NODE_TEMPLATES_SECTION + """
+    test_node2:
+        type: test_type
+        relationships:
+            -   type: test_relationship
+                target: test_node
+node_types:
+    test_type:
+        derived_from: test_type_parent
+        properties:
+            key:
+                default: "not_val"
+    test_type_parent: {}
+relationships:
+    cloudify.relationships.depends_on:
+        properties:
+            connection_type:
+                default: all_to_all
+    test_relationship:
+        derived_from: cloudify.relationships.depends_on
+    """
+        plan = prepare_deployment_plan(self.parse(yaml))
+        for protocol in [0, pickle.HIGHEST_PROTOCOL]:
+            data = pickle.dumps(plan, protocol)
+            self.assertNotIn('TypeHierarchy', data)
+            loaded = pickle.loads(data)
+            self.assertEqual(plan, loaded)
+            self.assertIs(list, type(loaded['nodes'][0][TYPE_HIERARCHY]))
+
+        # the plan and its version are dict subclasses, which the safe
+        # dumper does not represent
+        serializable = dict((key, plan[key]) for key in
+                            ['nodes', 'node_instances', 'relationships'])
+        dumped = yml.safe_dump(serializable)
+        self.assertEqual(serializable, yml.safe_load(dumped))
+        self.assertEqual(dumped, yml.dump(serializable))
+        self.assertIn('type_hierarchy: [test_type_parent, test_type]',
+                      dumped)
+        self.assertIn('type_hierarchy: [cloudify.relationships.depends_on, '
+                      'test_relationship]', dumped)
+        self.assertNotIn('&', dumped)
+
     def test_type_properties_recursive_derivation(self):
         yaml = self.BASIC_NODE_TEMPLATES_SECTION + """
 node_types:
@@ -840,6 +936,43 @@ imports:
         result = self.parse(top_level_yaml)
         self._assert_blueprint(result)
 
+    def test_relative_import_fetched_once(self):
+        bottom_level_yaml = self.BASIC_TYPE
+        self.make_file_with_name(bottom_level_yaml, 'bottom_level.yaml')
+
+        mid_level_yaml = self.BASIC_PLUGIN + """
+imports:
+    -   \"bottom_level.yaml\""""
+        mid_file_name = self.make_yaml_file(mid_level_yaml)
+
+        top_level_yaml = self.BASIC_NODE_TEMPLATES_SECTION + """
+imports:
+    -   {0}""".format('file:///' + pathname2url(mid_file_name))
+        resolver = DefaultImportResolver()
+        imports_cache = ImportsCache()
+        with patch('dsl_parser.import_resolver.default_import_resolver.'
+                   'read_import',
+                   side_effect=read_import) as read:
+            with patch('dsl_parser.utils.url_exists') as url_exists:
+                result = self.parse(top_level_yaml,
+                                    resolver=resolver,
+                                    imports_cache=imports_cache)
+                self._assert_blueprint(result)
+                self.assertFalse(url_exists.called)
+            fetched = [c[0][0] for c in read.call_args_list]
+            self.assertEqual(2, len(fetched))
+            self.assertEqual(2, len(set(fetched)))
+            # the relative import was probed with a single attempt
+            self.assertEqual([MAX_NUMBER_RETRIES, 0],
+                             [c[1]['retries'] for c in read.call_args_list])
+
+            # the cache is shared with the next parse
+            result = self.parse(top_level_yaml,
+                                resolver=resolver,
+                                imports_cache=imports_cache)
+            self._assert_blueprint(result)
+            self.assertEqual(2, read.call_count)
+
     def test_empty_top_level_relationships(self):
         yaml = self.MINIMAL_BLUEPRINT + """
 relationships: {}
@@ -2891,6 +3024,179 @@ node_templates:
         self.assertEqual(workflow2['parameters']['key']['default'], 'value')
         self.assertEqual(workflow['plugin'], constants.SCRIPT_PLUGIN_NAME)
 
+    def _script_mapping_blueprint(self):
+        return self.BASIC_VERSION_SECTION_DSL_1_0 + """
+plugins:
+    script:
+        executor: central_deployment_agent
+        install: false
+
+node_types:
+    type:
+        interfaces:
+            test:
+                op: stub.py
+                op2: stub.py
+workflows:
+    workflow: stub.py
+
+node_templates:
+    node1:
+        type: type
+    node2:
+        type: type
+"""
+
+    def test_script_mapping_existence_cached(self):
+        self.make_file_with_name(content='content',
+                                 filename='stub.py',
+                                 base_dir='resources')
+        yaml_path = self.make_file_with_name(
+            content=self._script_mapping_blueprint(),
+            filename='blueprint.yaml',
+            base_dir='blueprint')
+        additional_resource_source = 'file://{0}'.format(
+            pathname2url(os.path.join(self._temp_dir, 'resources')))
+        with patch('dsl_parser.utils.url_exists',
+                   side_effect=utils.url_exists) as url_exists:
+            result = parse_from_path(
+                yaml_path,
+                additional_resource_sources=[additional_resource_source])
+        # stub.py is looked up once under the blueprint directory, where
+        # it is missing, and once under the additional resource source
+        self.assertEqual(2, url_exists.call_count)
+        self.assertEqual(
+            'stub.py',
+            result['nodes'][0]['operations']['op']['inputs']['script_path'])
+
+    def test_script_mapping_resource_manifest(self):
+        with patch('dsl_parser.utils.url_exists') as url_exists:
+            result = dsl_parse(self._script_mapping_blueprint(),
+                               resources_base_url='http://localhost:1',
+                               resource_manifest=['./stub.py', 'other.sh'])
+            self.assertFalse(url_exists.called)
+            for node in result['nodes']:
+                for operation in ['op', 'op2']:
+                    self.assertEqual(
+                        'stub.py',
+                        node['operations'][operation]['inputs'][
+                            'script_path'])
+            self.assertEqual(
+                constants.SCRIPT_PLUGIN_EXECUTE_WORKFLOW_TASK,
+                result['workflows']['workflow']['operation'])
+
+            operation_blueprint = self.BASIC_VERSION_SECTION_DSL_1_0 + """
+plugins:
+    script:
+        executor: central_deployment_agent
+        install: false
+node_types:
+    type:
+        interfaces:
+            test:
+                op: stub.py
+node_templates:
+    node:
+        type: type
+"""
+            workflow_blueprint = self.BASIC_VERSION_SECTION_DSL_1_0 + """
+plugins:
+    script:
+        executor: central_deployment_agent
+        install: false
+node_types:
+    type: {}
+node_templates:
+    node:
+        type: type
+workflows:
+    workflow: stub.py
+"""
+            for blueprint, err_code in [(operation_blueprint, 10),
+                                        (workflow_blueprint, 21)]:
+                ex = self.assertRaises(
+                    exceptions.DSLParsingLogicException,
+                    dsl_parse,
+                    blueprint,
+                    resources_base_url='http://localhost:1',
+                    resource_manifest=['other.sh'])
+                self.assertEqual(err_code, ex.err_code)
+            self.assertFalse(url_exists.called)
+
+    def test_shared_operations(self):
+        yaml = self.BASIC_VERSION_SECTION_DSL_1_3 + self.BASIC_PLUGIN + """
+node_types:
+    type:
+        properties:
+            port: {}
+        interfaces:
+            test:
+                op:
+                    implementation: test_plugin.op
+                    inputs:
+                        key:
+                            default: [1, {nested: value}]
+                op2:
+                    implementation: test_plugin.op2
+                    inputs:
+                        port:
+                            default: { get_property: [SELF, port] }
+relationships:
+    cloudify.relationships.contained_in: {}
+    relationship:
+        derived_from: cloudify.relationships.contained_in
+        source_interfaces:
+            test:
+                op: test_plugin.op
+node_templates:
+    host:
+        type: type
+        properties:
+            port: 1
+    node1:
+        type: type
+        properties:
+            port: 2
+        relationships:
+            -   type: relationship
+                target: host
+    node2:
+        type: type
+        properties:
+            port: 3
+        relationships:
+            -   type: relationship
+                target: host
+"""
+        result = dsl_parse(yaml)
+        shared_result = dsl_parse(yaml, share_operations=True)
+        for plan in [result, shared_result]:
+            plan['nodes'].sort(key=lambda node: node['id'])
+        self.assertEqual(result, shared_result)
+
+        nodes = dict((node['id'], node) for node in shared_result['nodes'])
+        node1 = nodes['node1']
+        node2 = nodes['node2']
+        self.assertIs(node1['operations']['op'],
+                      node2['operations']['op'])
+        self.assertIs(node1['operations']['op'],
+                      node1['operations']['test.op'])
+        self.assertIs(node1['interfaces']['test']['op'],
+                      node2['interfaces']['test']['op'])
+        self.assertIs(
+            node1['relationships'][0]['source_operations']['op'],
+            node2['relationships'][0]['source_operations']['op'])
+        # operations with intrinsic functions are evaluated per node
+        self.assertIsNot(node1['operations']['op2'],
+                         node2['operations']['op2'])
+
+        plan = prepare_deployment_plan(shared_result)
+        self.assertEqual(prepare_deployment_plan(result)['nodes'],
+                         plan['nodes'])
+        ports = dict((node['id'], node['operations']['op2']['inputs']['port'])
+                     for node in plan['nodes'])
+        self.assertEqual({'host': 1, 'node1': 2, 'node2': 3}, ports)
+
     def test_version(self):
         def assertion(version_str, expected):
             version = self.parse(self.MINIMAL_BLUEPRINT,
@@ -19,6 +19,7 @@ from yaml import safe_dump as yaml_dump
 
 from dsl_parser.exceptions import DSLParsingLogicException
 from dsl_parser import constants
+from dsl_parser.elements.plugins import PluginsIndex
 from dsl_parser.tests.abstract_test_parser import AbstractTestParser
 
 
@@ -98,3 +99,68 @@ node_types:
                 self.assertEqual(source, plugin['source'])
             if package_name is not None:
                 self.assertEqual(package_name, plugin['package_name'])
+
+
+class PluginsIndexTest(AbstractTestParser):
+
+    def test_match(self):
+        index = PluginsIndex(['one', 'one.two', 'three', 'one.t'])
+        self.assertEqual(('one', 'one.two'), index.match('one.two.op'))
+        self.assertEqual(('one',), index.match('one.tw.op'))
+        self.assertEqual(('three',), index.match('three.op'))
+        self.assertEqual((), index.match('three'))
+        self.assertEqual((), index.match('four.op'))
+        self.assertEqual((), index.match('scripts/one.sh'))
+        # memoized
+        self.assertIs(index.match('one.two.op'), index.match('one.two.op'))
+
+    def test_dotted_plugin_name_mapping(self):
+        yaml = """
+node_types:
+    test_type: {}
+node_templates:
+    test_node:
+        type: test_type
+        interfaces:
+            test_interface:
+                op1: one.two.three
+                op2: one.three
+plugins:
+    one.two:
+        executor: central_deployment_agent
+        source: dummy
+    one.t:
+        executor: central_deployment_agent
+        source: dummy
+"""
+        self._assert_dsl_parsing_exception_error_code(
+            yaml, 10, DSLParsingLogicException)
+        yaml = yaml.replace('op2: one.three', 'op2: one.t.three')
+        operations = self.parse(yaml)['nodes'][0]['operations']
+        self.assertEqual('one.two', operations['op1']['plugin'])
+        self.assertEqual('three', operations['op1']['operation'])
+        self.assertEqual('one.t', operations['op2']['plugin'])
+        self.assertEqual('three', operations['op2']['operation'])
+
+    def test_ambiguous_mapping_used_more_than_once(self):
+        yaml = """
+node_types:
+    test_type:
+        interfaces:
+            test_interface:
+                op: one.two.three
+node_templates:
+    test_node1:
+        type: test_type
+    test_node2:
+        type: test_type
+plugins:
+    one.two:
+        executor: host_agent
+        source: dummy
+    one:
+        executor: host_agent
+        source: dummy
+"""
+        self._assert_dsl_parsing_exception_error_code(
+            yaml, 91, DSLParsingLogicException)
@@ -15,8 +15,10 @@
 
 
 from dsl_parser import constants
+from dsl_parser.elements import node_templates
 from dsl_parser.tests.test_parser_api import op_struct
-from dsl_parser.tests.abstract_test_parser import AbstractTestParser
+from dsl_parser.tests.abstract_test_parser import (AbstractTestParser,
+                                                   timeout)
 
 
 class NodePluginsToInstallTest(AbstractTestParser):
@@ -189,6 +191,100 @@ plugins:
         self.assertEquals('test_plugin2', test_plugin2['name'])
         self.assertEquals(2, len(nodes[0]['plugins_to_install']))
 
+    def test_node_plugins_shared_between_nodes(self):
+        yaml = """
+node_templates:
+    test_node1:
+        type: cloudify.nodes.Compute
+    test_node2:
+        type: test_type
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: test_node1
+    test_node3:
+        type: test_type
+        relationships:
+            -   type: cloudify.relationships.contained_in
+                target: test_node1
+node_types:
+    cloudify.nodes.Compute: {}
+    test_type:
+        interfaces:
+            test_interface:
+                start:
+                    implementation: test_plugin.start
+                    inputs: {}
+                stop:
+                    implementation: test_plugin.stop
+                    executor: central_deployment_agent
+                    inputs: {}
+relationships:
+    cloudify.relationships.contained_in: {}
+plugins:
+    test_plugin:
+        executor: host_agent
+        source: dummy
+"""
+        result = self.parse(yaml)
+        nodes = self._sort_result_nodes(
+            result['nodes'], ['test_node1', 'test_node2', 'test_node3'])
+
+        def plugin(node, executor):
+            return next(p for p in node['plugins']
+                        if p['executor'] == executor)
+
+        host_agent_plugin = plugin(nodes[1], 'host_agent')
+        central_plugin = plugin(nodes[1], 'central_deployment_agent')
+        self.assertEqual('test_plugin', host_agent_plugin['name'])
+        self.assertEqual('test_plugin', central_plugin['name'])
+        self.assertIsNot(host_agent_plugin, central_plugin)
+        self.assertIs(host_agent_plugin, plugin(nodes[2], 'host_agent'))
+        self.assertIs(central_plugin,
+                      plugin(nodes[2], 'central_deployment_agent'))
+        self.assertEqual([host_agent_plugin], nodes[0]['plugins_to_install'])
+        self.assertIs(host_agent_plugin, nodes[0]['plugins_to_install'][0])
+        for node in nodes[1:]:
+            self.assertIs(central_plugin,
+                          node['deployment_plugins_to_install'][0])
+
+    @timeout(seconds=10)
+    def test_node_plugins_to_install_many_hosts(self):
+        hosts_num = 10000
+        processed_nodes = {}
+        for i in range(hosts_num):
+            host_id = 'host{0}'.format(i)
+            node_id = 'node{0}'.format(i)
+            processed_nodes[host_id] = {
+                'id': host_id,
+                'type': 'cloudify.nodes.Compute',
+                'host_id': host_id,
+                'operations': {},
+                'relationships': []
+            }
+            processed_nodes[node_id] = {
+                'id': node_id,
+                'type': 'test_type',
+                'host_id': host_id,
+                'operations': {
+                    'start': {'plugin': 'test_plugin',
+                              'executor': 'host_agent'}
+                },
+                'relationships': []
+            }
+        plugins = {'test_plugin': {'name': 'test_plugin',
+                                   'executor': 'host_agent',
+                                   'source': 'dummy'}}
+        node_templates._process_nodes_plugins(
+            processed_nodes=processed_nodes,
+            host_types=set(['cloudify.nodes.Compute']),
+            plugins=plugins)
+        host_plugins = [processed_nodes['host{0}'.format(i)][
+                        'plugins_to_install'] for i in range(hosts_num)]
+        self.assertEqual(hosts_num, len(host_plugins))
+        self.assertEqual(set([1]), set(len(p) for p in host_plugins))
+        self.assertEqual(1, len(set(id(p[0]) for p in host_plugins)))
+        self.assertEqual('host_agent', host_plugins[0][0]['executor'])
+
     def test_instance_relationships_target_node_plugins(self):
         # tests that plugins defined on instance relationships as
         # "run_on_node"="target" will
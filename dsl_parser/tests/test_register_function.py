@@ -100,6 +100,25 @@ outputs:
         self.assertEqual('PROPERTY_VALUE', o['output2'])
         self.assertEqual('ATTRIBUTE_VALUE', o['output3'])
 
+    def test_overlay(self):
+        class ToUpper(functions.Function):
+            pass
+
+        class ToLower(functions.Function):
+            pass
+
+        self.assertIsNone(functions.get_function('to_upper'))
+        with functions.overlay({'to_upper': ToUpper}):
+            self.assertIs(ToUpper, functions.get_function('to_upper'))
+            self.assertEqual('to_upper', ToUpper.name)
+            with functions.overlay({'to_lower': ToLower}):
+                self.assertIs(ToUpper, functions.get_function('to_upper'))
+                self.assertIs(ToLower, functions.get_function('to_lower'))
+            self.assertIsNone(functions.get_function('to_lower'))
+        self.assertIsNone(functions.get_function('to_upper'))
+        self.assertNotIn('to_upper', functions.TEMPLATE_FUNCTIONS)
+        self.assertIs(functions.GetInput, functions.get_function('get_input'))
+
 
 class NodeInstance(dict):
 
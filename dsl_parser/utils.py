@@ -99,12 +99,9 @@ def merge_schema_and_instance_properties(
         node_name,
         path=None,
         raise_on_missing_property=True):
-    flattened_schema_props = flatten_schema(schema_properties)
-    return _merge_flattened_schema_and_instance_properties(
+    schema = PropertiesSchemas(data_types).compile(schema_properties)
+    return schema.merge(
         instance_properties=instance_properties,
-        schema_properties=schema_properties,
-        flattened_schema_properties=flattened_schema_props,
-        data_types=data_types,
         undefined_property_error_message=undefined_property_error_message,
         missing_property_error_message=missing_property_error_message,
         node_name=node_name,
@@ -112,62 +109,6 @@ def merge_schema_and_instance_properties(
         raise_on_missing_property=raise_on_missing_property)
 
 
-def _merge_flattened_schema_and_instance_properties(
-        instance_properties,
-        schema_properties,
-        flattened_schema_properties,
-        data_types,
-        undefined_property_error_message,
-        missing_property_error_message,
-        node_name,
-        path,
-        raise_on_missing_property):
-    path = path or []
-
-    # validate instance properties don't
-    # contain properties that are not defined
-    # in the schema.
-    for key in instance_properties.iterkeys():
-        if key not in schema_properties:
-            ex = DSLParsingLogicException(
-                106,
-                undefined_property_error_message.format(
-                    node_name,
-                    _property_description(path, key)))
-            ex.property = key
-            raise ex
-
-    merged_properties = dict(flattened_schema_properties.items() +
-                             instance_properties.items())
-    result = {}
-    for key, property_schema in schema_properties.iteritems():
-        if key not in merged_properties:
-            required = property_schema.get('required', True)
-            if required and raise_on_missing_property:
-                ex = DSLParsingLogicException(
-                    107,
-                    missing_property_error_message.format(
-                        node_name,
-                        _property_description(path, key)))
-                ex.property = key
-                raise ex
-            else:
-                continue
-        prop_path = copy.copy(path)
-        prop_path.append(key)
-        result[key] = parse_value(
-            value=merged_properties.get(key),
-            derived_value=flattened_schema_properties.get(key),
-            type_name=property_schema.get('type'),
-            data_types=data_types,
-            undefined_property_error_message=undefined_property_error_message,
-            missing_property_error_message=missing_property_error_message,
-            node_name=node_name,
-            path=prop_path,
-            raise_on_missing_property=raise_on_missing_property)
-    return result
-
-
 def parse_value(
         value,
         type_name,
@@ -178,57 +119,207 @@ def parse_value(
         path,
         derived_value=None,
         raise_on_missing_property=True):
-    if type_name is None:
-        return value
-    if functions.parse(value) != value:
-        # intrinsic function - not validated at the moment
-        return value
-    if type_name == 'integer':
-        if isinstance(value, (int, long)) and not isinstance(
-                value, bool):
+    return PropertiesSchemas(data_types).parse_value(
+        value=value,
+        derived_value=derived_value,
+        type_name=type_name,
+        undefined_property_error_message=undefined_property_error_message,
+        missing_property_error_message=missing_property_error_message,
+        node_name=node_name,
+        path=path[:-1],
+        name=path[-1] if path else None,
+        raise_on_missing_property=raise_on_missing_property)
+
+
+class PropertiesSchemas(object):
+    """
+    Compiles properties schemas into PropertiesSchema objects, which
+    instance properties are merged into and validated against.
+
+    The schemas of data types are compiled once, when first used, and so
+    are other schemas compiled with a key (e.g. the properties schema of a
+    node type), so a single instance is meant to be used for all the
+    properties of a parse.
+    """
+
+    def __init__(self, data_types):
+        """
+        :param data_types: The data types (by name) properties may be of.
+        """
+        self._data_types = data_types
+        self._data_type_schemas = {}
+        self._schemas = {}
+
+    def __deepcopy__(self, memo):
+        # shared by the elements requiring it, along with the compiled schemas
+        return self
+
+    def compile(self, schema_properties, key=None):
+        """
+        :param schema_properties: The properties schema to compile.
+        :param key: When given, the schema is compiled once for this key, and
+         the compiled schema is returned for later calls with the same key.
+        """
+        if key is None:
+            return PropertiesSchema(schema_properties, self)
+        schema = self._schemas.get(key)
+        if schema is None:
+            schema = PropertiesSchema(schema_properties, self)
+            self._schemas[key] = schema
+        return schema
+
+    def parse_value(self,
+                    value,
+                    derived_value,
+                    type_name,
+                    undefined_property_error_message,
+                    missing_property_error_message,
+                    node_name,
+                    path,
+                    name,
+                    raise_on_missing_property):
+        if type_name is None:
             return value
-    elif type_name == 'float':
-        if isinstance(value, (int, float, long)) and not isinstance(
-                value, bool):
+        if isinstance(value, dict) and len(value) == 1 and \
+                functions.parse(value) != value:
+            # intrinsic function - not validated at the moment
             return value
-    elif type_name == 'boolean':
-        if isinstance(value, bool):
+        if type_name == 'integer':
+            if isinstance(value, (int, long)) and not isinstance(
+                    value, bool):
+                return value
+        elif type_name == 'float':
+            if isinstance(value, (int, float, long)) and not isinstance(
+                    value, bool):
+                return value
+        elif type_name == 'boolean':
+            if isinstance(value, bool):
+                return value
+        elif type_name == 'string':
             return value
-    elif type_name == 'string':
-        return value
-    elif type_name in data_types:
-        if isinstance(value, dict):
-            data_schema = data_types[type_name]['properties']
-            flattened_data_schema = flatten_schema(data_schema)
-            if isinstance(derived_value, dict):
-                flattened_data_schema.update(derived_value)
-            undef_msg = undefined_property_error_message
-            return _merge_flattened_schema_and_instance_properties(
-                instance_properties=value,
-                schema_properties=data_schema,
-                flattened_schema_properties=flattened_data_schema,
-                data_types=data_types,
-                undefined_property_error_message=undef_msg,
+        elif type_name in self._data_types:
+            if isinstance(value, dict):
+                prop_path = list(path)
+                if name is not None:
+                    prop_path.append(name)
+                undef_msg = undefined_property_error_message
+                missing_msg = missing_property_error_message
+                return self._data_type_schema(type_name).merge(
+                    instance_properties=value,
+                    undefined_property_error_message=undef_msg,
+                    missing_property_error_message=missing_msg,
+                    node_name=node_name,
+                    path=prop_path,
+                    raise_on_missing_property=raise_on_missing_property,
+                    derived_defaults=derived_value)
+        else:
+            raise RuntimeError(
+                "Unexpected type defined in property schema for property "
+                "'{0}' - unknown type is '{1}'".format(
+                    _property_description(path, name),
+                    type_name))
+
+        raise DSLParsingLogicException(
+            exceptions.ERROR_VALUE_DOES_NOT_MATCH_TYPE,
+            "Property type validation failed in '{0}': property "
+            "'{1}' type is '{2}', yet it was assigned with the "
+            "value '{3}'".format(
+                node_name,
+                _property_description(path, name),
+                type_name,
+                value))
+
+    def _data_type_schema(self, type_name):
+        schema = self._data_type_schemas.get(type_name)
+        if schema is None:
+            schema = PropertiesSchema(
+                self._data_types[type_name]['properties'], self)
+            self._data_type_schemas[type_name] = schema
+        return schema
+
+
+class PropertiesSchema(object):
+    """
+    A compiled properties schema: its flattened defaults, required
+    properties and property types, computed once. Schemas of data typed
+    properties are compiled (once) by the PropertiesSchemas it belongs to.
+    """
+
+    def __init__(self, schema_properties, schemas):
+        self._schemas = schemas
+        self._types = dict((key, prop.get('type'))
+                           for key, prop in schema_properties.iteritems())
+        self._required = frozenset(
+            key for key, prop in schema_properties.iteritems()
+            if prop.get('required', True))
+        self._defaults = flatten_schema(schema_properties)
+
+    def merge(self,
+              instance_properties,
+              undefined_property_error_message,
+              missing_property_error_message,
+              node_name,
+              path=None,
+              raise_on_missing_property=True,
+              derived_defaults=None):
+        """
+        Merge instance properties with the schema defaults, and validate them
+        against the schema.
+
+        :param derived_defaults: Defaults overriding the schema defaults.
+        :return: The merged properties.
+        """
+        path = path or []
+        types = self._types
+
+        # validate instance properties don't
+        # contain properties that are not defined
+        # in the schema.
+        for key in instance_properties.iterkeys():
+            if key not in types:
+                ex = DSLParsingLogicException(
+                    106,
+                    undefined_property_error_message.format(
+                        node_name,
+                        _property_description(path, key)))
+                ex.property = key
+                raise ex
+
+        defaults = self._defaults
+        if isinstance(derived_defaults, dict):
+            defaults = dict(defaults)
+            defaults.update(derived_defaults)
+        result = {}
+        for key, type_name in types.iteritems():
+            if key in instance_properties:
+                value = instance_properties[key]
+            elif key in defaults:
+                # compiled defaults are shared, merged properties are not
+                value = defaults[key]
+                if isinstance(value, (dict, list)):
+                    value = copy.deepcopy(value)
+            else:
+                if key in self._required and raise_on_missing_property:
+                    ex = DSLParsingLogicException(
+                        107,
+                        missing_property_error_message.format(
+                            node_name,
+                            _property_description(path, key)))
+                    ex.property = key
+                    raise ex
+                continue
+            result[key] = self._schemas.parse_value(
+                value=value,
+                derived_value=defaults.get(key),
+                type_name=type_name,
+                undefined_property_error_message=(
+                    undefined_property_error_message),
                 missing_property_error_message=missing_property_error_message,
                 node_name=node_name,
                 path=path,
+                name=key,
                 raise_on_missing_property=raise_on_missing_property)
-    else:
-        raise RuntimeError(
-            "Unexpected type defined in property schema for property '{0}'"
-            " - unknown type is '{1}'".format(
-                _property_description(path),
-                type_name))
-
-    raise DSLParsingLogicException(
-        exceptions.ERROR_VALUE_DOES_NOT_MATCH_TYPE,
-        "Property type validation failed in '{0}': property "
-        "'{1}' type is '{2}', yet it was assigned with the "
-        "value '{3}'".format(
-            node_name,
-            _property_description(path),
-            type_name,
-            value))
+        return result
 
 
 def load_yaml(raw_yaml, error_message, filename=None):